@@ -0,0 +1,147 @@
+import math
+
+from lp import Exchange, Factory
+
+
+class Opportunity:
+    """
+        A profitable cycle of swaps: `hops` are (exchange, token_in, token_out), starting
+        and ending with `token`
+    """
+
+    def __init__(self, token, hops, amount_in, amount_out) -> None:
+        self.token = token
+        self.hops = hops
+        self.amount_in = amount_in
+        self.amount_out = amount_out
+
+    @property
+    def profit(self):
+        return self.amount_out - self.amount_in
+
+    @property
+    def path(self):
+        return [self.token] + [token_out for _, _, token_out in self.hops]
+
+    def __repr__(self):
+        return f"Opportunity({' -> '.join(self.path)}, amount_in={self.amount_in}, profit={self.profit})"
+
+
+class ArbitrageDetector:
+    """
+        Finds profitable cycles of up to `max_length` pools as reserves change.
+
+        Each direction of a pool is an edge of the token graph weighted by
+        -log(price), so a cycle is profitable when its weights add up to less than
+        zero. The detector listens to the factory (see Factory.listeners) and after
+        an update only the cycles through the changed pool are checked; they are
+        enumerated once per pool and cached until a pool is created.
+
+        The optimal input of a profitable cycle comes from composing its pools into
+        a single virtual constant-product pool, then the cycle is quoted hop by hop
+        with get_amount_out. Callables in `callbacks` receive every opportunity found.
+    """
+
+    def __init__(self, factory: Factory, max_length=3) -> None:
+        self.factory = factory
+        self.max_length = max_length
+        self.weights = {}           # (pool name, zero_for_one) -> -log(price)
+        self.cycles = {}            # pool name -> [[(exchange, token_in, token_out), ...], ...]
+        self.pair_count = factory.pair_count()
+        self.opportunities = []     # found by the last update
+        self.callbacks = []
+        for exchange in factory.all_pairs:
+            self._weigh(exchange)
+        factory.listeners.append(self.on_update)
+
+    def _weigh(self, exchange):
+        gamma = (1000 - exchange.fee) / 1000
+        reserve0, reserve1 = exchange.get_reserves(exchange.token0)
+        if reserve0 > 0 and reserve1 > 0:
+            self.weights[(exchange.name, True)] = -math.log(gamma * reserve1 / reserve0)
+            self.weights[(exchange.name, False)] = -math.log(gamma * reserve0 / reserve1)
+        else:
+            self.weights[(exchange.name, True)] = self.weights[(exchange.name, False)] = math.inf
+
+    def _cycles(self, exchange):
+        if self.factory.pair_count() != self.pair_count:
+            self.pair_count = self.factory.pair_count()
+            self.cycles.clear()
+
+        cycles = self.cycles.get(exchange.name)
+        if cycles is None:
+            cycles = self.cycles[exchange.name] = []
+            for token_in, token_out in ((exchange.token0, exchange.token1), (exchange.token1, exchange.token0)):
+                self._close(token_in, [(exchange, token_in, token_out)], {token_out}, {exchange.name}, cycles)
+        return cycles
+
+    def _close(self, start, hops, tokens, pools, cycles):
+        """
+        Depth-first search of the paths from the last token of `hops` back to `start`
+        """
+        token = hops[-1][2]
+        for exchange in self.factory.get_pairs(token):
+            if exchange.name in pools:
+                continue
+            token_out = exchange.token1 if token == exchange.token0 else exchange.token0
+            hop = (exchange, token, token_out)
+            if token_out == start:
+                cycles.append(hops + [hop])
+            elif len(hops) + 1 < self.max_length and token_out not in tokens:
+                self._close(start, hops + [hop], tokens | {token_out}, pools | {exchange.name}, cycles)
+
+    def on_update(self, exchange: Exchange):
+        self._weigh(exchange)
+        self.opportunities = self.check(exchange)
+        for opportunity in self.opportunities:
+            for callback in self.callbacks:
+                callback(opportunity)
+
+    def check(self, exchange: Exchange):
+        """
+        Profitable cycles through the pool, most profitable first
+        """
+        weights = self.weights
+        opportunities = []
+        for hops in self._cycles(exchange):
+            weight = 0
+            for hop_exchange, token_in, _ in hops:
+                key = (hop_exchange.name, token_in == hop_exchange.token0)
+                if key not in weights:
+                    self._weigh(hop_exchange)
+                weight += weights[key]
+            if weight < 0:
+                opportunity = self._size(hops)
+                if opportunity is not None:
+                    opportunities.append(opportunity)
+
+        opportunities.sort(key=lambda opportunity: opportunity.profit, reverse=True)
+        return opportunities
+
+    def _size(self, hops):
+        """
+        Optimal input of the cycle. Pools in a row trade like a single pool with
+        virtual reserves (reserve_in, reserve_out), composed hop by hop; its optimal
+        input is (sqrt(gamma * reserve_in * reserve_out) - reserve_in) / gamma.
+        """
+        first, token, _ = hops[0]
+        reserve_in, reserve_out = first.get_reserves(token)
+        gamma = (1000 - first.fee) / 1000
+        for exchange, token_in, _ in hops[1:]:
+            hop_gamma = (1000 - exchange.fee) / 1000
+            hop_in, hop_out = exchange.get_reserves(token_in)
+            denominator = hop_in + hop_gamma * reserve_out
+            reserve_in, reserve_out = reserve_in * hop_in / denominator, hop_gamma * reserve_out * hop_out / denominator
+
+        amount_in = (math.sqrt(gamma * reserve_in * reserve_out) - reserve_in) / gamma
+        if first.numeric.name == "integer":
+            amount_in = int(amount_in)
+        if amount_in <= 0:
+            return None
+
+        amount = amount_in
+        for exchange, token_in, _ in hops:
+            amount = exchange.get_amount_out(amount, *exchange.get_reserves(token_in))
+        if amount <= amount_in:
+            return None
+        return Opportunity(token, hops, amount_in, amount)
@@ -0,0 +1,232 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from lp import ERC20, Exchange, Factory
+from staking_rewards import StakingRewards
+
+
+BENCHMARKS = {}
+DEFAULTS = {"pools": 100, "holders": 1000, "trades": 10_000, "seed": 0}
+
+
+def benchmark(name):
+    """
+    Registers a scenario: a function of the parameters returning the operation to
+    time and the list of argument tuples it is called with, one call per entry
+    """
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def _factory(params, liquidity=True, numeric="float"):
+    factory = Factory("bench", "0x0", numeric=numeric)
+    pools = [
+        factory.create_exchange(ERC20(f"TKN{pool}", f"0x{pool:x}"), ERC20(f"ETH{pool}", f"0xe{pool:x}"), f"TKN{pool}")
+        for pool in range(params["pools"])
+    ]
+    if liquidity:
+        for holder in range(params["holders"]):
+            pools[holder % len(pools)].add_liquidity(f"holder{holder}", 10_000, 10_000, 0, 0)
+    return factory, pools
+
+
+@benchmark("create_exchange")
+def bench_create_exchange(params):
+    factory = Factory("bench", "0x0")
+    arguments = [
+        (factory, ERC20(f"TKN{pool}", f"0x{pool:x}"), ERC20(f"ETH{pool}", f"0xe{pool:x}"), f"TKN{pool}")
+        for pool in range(params["pools"])
+    ]
+    return Factory.create_exchange, arguments
+
+
+@benchmark("add_liquidity")
+def bench_add_liquidity(params):
+    _, pools = _factory(params)
+    rng = np.random.default_rng(params["seed"])
+    amounts = rng.integers(1, 1000, params["trades"]).tolist()
+    arguments = [
+        (pools[trade % len(pools)], f"holder{trade % params['holders']}", amount, amount, 0, 0)
+        for trade, amount in enumerate(amounts)
+    ]
+    return Exchange.add_liquidity, arguments
+
+
+@benchmark("swapExactTokensForTokens")
+def bench_swap(params):
+    # integer pools, so every trade is exact
+    _, pools = _factory(params, numeric="integer")
+    rng = np.random.default_rng(params["seed"])
+    amounts = rng.integers(10, 100, params["trades"]).tolist()    # Python ints for the integer pools
+    arguments = [
+        (pools[trade % len(pools)], amount, 0, f"holder{trade % params['holders']}")
+        for trade, amount in enumerate(amounts)
+    ]
+    return Exchange.swapExactTokensForTokens, arguments
+
+
+@benchmark("multicall")
+def bench_multicall(params):
+    # the swaps of the swapExactTokensForTokens scenario, 10 per call on the same pool
+    _, pools = _factory(params, numeric="integer")
+    rng = np.random.default_rng(params["seed"])
+    amounts = rng.integers(10, 100, params["trades"]).tolist()
+    trades = [range(pool, params["trades"], len(pools)) for pool in range(len(pools))]
+    arguments = [
+        (pools[pool], [
+            ("swapExactTokensForTokens", amounts[trade], 0, f"holder{trade % params['holders']}")
+            for trade in trades[pool][start:start + 10]
+        ])
+        for start in range(0, len(trades[0]), 10)
+        for pool in range(len(pools))
+        if start < len(trades[pool])
+    ]
+    return Exchange.multicall, arguments
+
+
+@benchmark("remove_liquidity")
+def bench_remove_liquidity(params):
+    _, pools = _factory(params)
+    arguments = [
+        (pools[trade % len(pools)], f"holder{trade % params['holders']}", 1, 0, 0)
+        for trade in range(params["trades"])
+    ]
+    return Exchange.remove_liquidity, arguments
+
+
+def _stakings(params):
+    _, pools = _factory(params)
+    stakings = [StakingRewards(pool) for pool in pools]
+    for staking in stakings:
+        staking.add_rewards(1_000_000)
+    return stakings
+
+
+@benchmark("stake")
+def bench_stake(params):
+    stakings = _stakings(params)
+    arguments = [
+        (stakings[holder % len(stakings)], f"holder{holder}", 1)
+        for holder in (trade % params["holders"] for trade in range(params["trades"]))
+    ]
+    return StakingRewards.stake, arguments
+
+
+@benchmark("earned")
+def bench_earned(params):
+    stakings = _stakings(params)
+    for holder in range(params["holders"]):
+        stakings[holder % len(stakings)].stake(f"holder{holder}", 100)
+    arguments = [
+        (stakings[holder % len(stakings)], f"holder{holder}")
+        for holder in (trade % params["holders"] for trade in range(params["trades"]))
+    ]
+    return StakingRewards.earned, arguments
+
+
+def _time(operation, arguments):
+    latencies = np.empty(len(arguments), dtype=np.int64)
+    errors = 0
+    clock = time.perf_counter_ns
+    start = clock()
+    for index, args in enumerate(arguments):
+        began = clock()
+        try:
+            operation(*args)
+        except AssertionError:
+            errors += 1
+        latencies[index] = clock() - began
+    return clock() - start, latencies, errors
+
+
+def run(name, params):
+    """
+    Runs a scenario twice: once timed, once under tracemalloc for the peak memory
+    of building and running it
+    """
+    operation, arguments = BENCHMARKS[name](params)
+    elapsed, latencies, errors = _time(operation, arguments)
+
+    tracemalloc.start()
+    operation, arguments = BENCHMARKS[name](params)
+    _time(operation, arguments)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    p50, p99 = np.percentile(latencies, [50, 99]) / 1000 if len(latencies) else (0, 0)
+    return {
+        "ops": len(arguments),
+        "errors": errors,
+        "ops_per_sec": len(arguments) / (elapsed / 1e9) if elapsed else 0,
+        "p50_us": float(p50),
+        "p99_us": float(p99),
+        "peak_kib": peak / 1024,
+    }
+
+
+def run_all(params, names=None):
+    return {
+        "params": params,
+        "python": platform.python_version(),
+        "results": {name: run(name, params) for name in names or BENCHMARKS},
+    }
+
+
+def compare(report, baseline, tolerance=0.2):
+    """
+    Regressions of a report against a baseline: throughput lower, or p99 latency
+    or peak memory higher, than the baseline by more than `tolerance`
+    """
+    regressions = []
+    for name, result in report["results"].items():
+        expected = baseline["results"].get(name)
+        if expected is None:
+            continue
+        if result["ops_per_sec"] < expected["ops_per_sec"] * (1 - tolerance):
+            regressions.append(f"{name}: {result['ops_per_sec']:.0f} op/s < {expected['ops_per_sec']:.0f} op/s")
+        if result["p99_us"] > expected["p99_us"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {result['p99_us']:.1f}us > {expected['p99_us']:.1f}us")
+        if result["peak_kib"] > expected["peak_kib"] * (1 + tolerance):
+            regressions.append(f"{name}: peak {result['peak_kib']:.0f}KiB > {expected['peak_kib']:.0f}KiB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the pool and staking hot paths")
+    for param, default in DEFAULTS.items():
+        parser.add_argument(f"--{param}", type=int, default=default)
+    parser.add_argument("--only", nargs="*", choices=sorted(BENCHMARKS), help="scenarios to run")
+    parser.add_argument("--output", help="where to write the results as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    params = {param: getattr(args, param) for param in DEFAULTS}
+    report = run_all(params, args.only)
+    for name, result in report["results"].items():
+        print(f"{name:26} {result['ops_per_sec']:>12.0f} op/s  p50 {result['p50_us']:8.1f}us  "
+              f"p99 {result['p99_us']:8.1f}us  peak {result['peak_kib']:10.0f}KiB  errors {result['errors']}")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(report, json.load(baseline), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,31 @@
+import time
+
+
+class SystemClock:
+    """
+        Wall-clock time
+    """
+
+    def time(self):
+        return time.time()
+
+
+class ManualClock:
+    """
+        Virtual time that only moves when told to, so simulations can jump over
+        a whole reward period instantly and each one keeps its own time
+    """
+
+    def __init__(self, start=0.0) -> None:
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        assert seconds >= 0, "Clock can't go back in time"
+        self.now += seconds
+
+    def set(self, timestamp):
+        assert timestamp >= self.now, "Clock can't go back in time"
+        self.now = timestamp
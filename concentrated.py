@@ -0,0 +1,501 @@
+import math
+from bisect import bisect_left, bisect_right, insort
+
+import numpy as np
+
+from lp import MULTICALL_METHODS, POOL_KINDS, Factory, liquidity_ledger
+
+
+MIN_TICK = -887272
+MAX_TICK = 887272
+
+
+def sqrt_price_at(tick):
+    return 1.0001 ** (tick / 2)
+
+
+def tick_at(sqrt_price):
+    return math.floor(math.log(sqrt_price * sqrt_price) / math.log(1.0001))
+
+
+def amounts_for_liquidity(sqrt_price, sqrt_lower, sqrt_upper, liquidity):
+    """
+    Token amounts backing `liquidity` in the range [sqrt_lower, sqrt_upper] at sqrt_price
+    """
+    if sqrt_price <= sqrt_lower:
+        return liquidity * (sqrt_upper - sqrt_lower) / (sqrt_lower * sqrt_upper), 0
+    if sqrt_price < sqrt_upper:
+        return liquidity * (sqrt_upper - sqrt_price) / (sqrt_price * sqrt_upper), liquidity * (sqrt_price - sqrt_lower)
+    return 0, liquidity * (sqrt_upper - sqrt_lower)
+
+
+def liquidity_for_amounts(sqrt_price, sqrt_lower, sqrt_upper, amount0, amount1):
+    """
+    Largest liquidity in the range [sqrt_lower, sqrt_upper] the amounts can back at sqrt_price
+    """
+    if sqrt_price <= sqrt_lower:
+        return amount0 * sqrt_lower * sqrt_upper / (sqrt_upper - sqrt_lower)
+    if sqrt_price < sqrt_upper:
+        return min(
+            amount0 * sqrt_price * sqrt_upper / (sqrt_upper - sqrt_price),
+            amount1 / (sqrt_price - sqrt_lower),
+        )
+    return amount1 / (sqrt_upper - sqrt_lower)
+
+
+class ConcentratedExchange:
+    """
+        Uniswap V3 style pool: liquidity providers choose the price range
+        [tick_lower, tick_upper) of their position, price = 1.0001 ** tick.
+        https://uniswap.org/whitepaper-v3.pdf
+
+        Only the liquidity of the positions around the current price trades. The
+        ticks where that liquidity changes are kept sorted, so a swap finds the next
+        one with a bisect and costs O(ticks crossed), whatever the number of positions.
+        Within two ticks the pool trades like a constant-product pool with virtual
+        reserves (liquidity / sqrt_price, liquidity * sqrt_price), which get_reserves
+        returns, so the router and the arbitrage detector use it like an Exchange.
+        It has the trading interface of an Exchange too (price_impact, get_amount_in,
+        swapExactTokensForTokensBatch, multicall), without the low level mint and burn.
+
+        Created by Factory.create_exchange(..., kind="concentrated"), float pools only.
+    """
+
+    def __init__(self, creator: Factory, token0_name: str, token1_name: str, name: str, symbol: str,
+                 tick_spacing=1) -> None:
+        assert creator.numeric.name == "float", "Concentrated pools are float only"
+        self.factory = creator
+        self.token0 = token0_name
+        self.token1 = token1_name
+        self.name = name
+        self.symbol = symbol
+        self.numeric = creator.numeric
+        self.fee = 0
+        self.tick_spacing = tick_spacing
+
+        self.reserve0 = 0           # token balances of the pool
+        self.reserve1 = 0
+        self.sqrt_price = None      # set by the first deposit
+        self.tick = None
+        self.liquidity = 0          # active liquidity
+        self.ticks = []             # initialized ticks, sorted
+        self.liquidity_net = {}     # tick -> liquidity added when crossing it upwards
+        self.liquidity_gross = {}   # tick -> liquidity of the positions using it
+        self.positions = {}         # (owner, tick_lower, tick_upper) -> liquidity
+        self.liquidity_providers = liquidity_ledger(self.numeric)     # owner -> liquidity of all its positions
+        self.total_supply = 0
+
+        self.version = 0
+        self.price0_cumulative_last = 0
+        self.price1_cumulative_last = 0
+        self.block_timestamp_last = 0
+        self._price_last = 0
+        self._batch = None          # tokens of the pool while a multicall runs
+
+    def info(self):
+        print(f"Exchange {self.name} ({self.symbol}), liquidez concentrada")
+        print(f"Moedas: {self.token0}/{self.token1}")
+        print(f"Reservas: {self.token0} = {self.reserve0} | {self.token1} = {self.reserve1}")
+        print(f"Preço: {self.price} | Liquidez ativa: {self.liquidity}")
+
+    @property
+    def price(self):
+        return self.sqrt_price ** 2 if self.sqrt_price else 0
+
+    def get_tokens(self):
+        if self._batch is not None:
+            return self._batch
+        return self.factory.exchange_to_tokens[self.name]
+
+    def multicall(self, calls):
+        """
+        Exchange.multicall on a concentrated pool. The tick and position tables are
+        copied up front, so a batch costs O(positions) on top of its calls.
+        """
+        assert self._batch is None, 'Multicall: REENTRANT'
+        for method, *_ in calls:
+            assert method in MULTICALL_METHODS and hasattr(self, method), f'Multicall: INVALID_METHOD {method}'
+
+        tokens = self.get_tokens()
+        ledgers = [self.liquidity_providers.ledger] + [token.ledger for token in tokens.values()]
+        checkpoint = self._checkpoint()
+        tables = (
+            list(self.ticks), dict(self.liquidity_net), dict(self.liquidity_gross), dict(self.positions),
+            self.total_supply,
+        )
+        totals = [token.total for token in tokens.values()]
+        for ledger in ledgers:
+            ledger.begin()
+
+        self._batch = tokens
+        try:
+            results = [getattr(self, method)(*args) for method, *args in calls]
+        except BaseException:
+            self._rollback(checkpoint)
+            self.ticks, self.liquidity_net, self.liquidity_gross, self.positions, self.total_supply = tables
+            for token, total in zip(tokens.values(), totals):
+                token.total = total
+            for ledger in ledgers:
+                ledger.rollback()
+            raise
+        finally:
+            self._batch = None
+
+        for ledger in ledgers:
+            ledger.commit()
+        self._commit(checkpoint)
+        return results
+
+    def _range(self, tick_lower, tick_upper):
+        spacing = self.tick_spacing
+        tick_lower = -(MAX_TICK // spacing * spacing) if tick_lower is None else tick_lower
+        tick_upper = MAX_TICK // spacing * spacing if tick_upper is None else tick_upper
+        assert tick_lower < tick_upper, 'UniswapV3: TLU'
+        assert tick_lower >= MIN_TICK and tick_upper <= MAX_TICK, 'UniswapV3: TICK_RANGE'
+        assert tick_lower % spacing == 0 and tick_upper % spacing == 0, 'UniswapV3: TICK_SPACING'
+        return tick_lower, tick_upper
+
+    def _update_tick(self, tick, liquidity_delta, upper):
+        gross = self.liquidity_gross.get(tick, 0) + liquidity_delta
+        if gross <= 0:
+            del self.liquidity_gross[tick], self.liquidity_net[tick]
+            del self.ticks[bisect_left(self.ticks, tick)]
+            return
+
+        if tick not in self.liquidity_gross:
+            insort(self.ticks, tick)
+        self.liquidity_gross[tick] = gross
+        self.liquidity_net[tick] = self.liquidity_net.get(tick, 0) + (-liquidity_delta if upper else liquidity_delta)
+
+    def _modify_position(self, owner, tick_lower, tick_upper, liquidity_delta):
+        key = (owner, tick_lower, tick_upper)
+        self.positions[key] = self.positions.get(key, 0) + liquidity_delta
+        if self.positions[key] <= 0:
+            del self.positions[key]
+        self.liquidity_providers.add(owner, liquidity_delta)
+        self.total_supply += liquidity_delta
+
+        self._update_tick(tick_lower, liquidity_delta, upper=False)
+        self._update_tick(tick_upper, liquidity_delta, upper=True)
+        if tick_lower <= self.tick < tick_upper:
+            self.liquidity += liquidity_delta
+
+    def add_liquidity(self, _from, balance0, balance1, balance0Min, balance1Min, tick_lower=None, tick_upper=None):
+        """
+        Deposits at most (balance0, balance1) in a position over [tick_lower, tick_upper),
+        the full range by default. The first deposit sets the price to balance1 / balance0.
+        """
+        tokens = self.get_tokens()
+        tick_lower, tick_upper = self._range(tick_lower, tick_upper)
+        if self.sqrt_price is None:
+            assert balance0 > 0 and balance1 > 0, 'UniswapV2: INSUFFICIENT_LIQUIDITY_MINTED'
+            self.sqrt_price = math.sqrt(balance1 / balance0)
+            self.tick = tick_at(self.sqrt_price)
+            self._price_last = self.price
+
+        sqrt_lower, sqrt_upper = sqrt_price_at(tick_lower), sqrt_price_at(tick_upper)
+        liquidity = liquidity_for_amounts(self.sqrt_price, sqrt_lower, sqrt_upper, balance0, balance1)
+        assert liquidity > 0, 'UniswapV2: INSUFFICIENT_LIQUIDITY_MINTED'
+        amount0, amount1 = amounts_for_liquidity(self.sqrt_price, sqrt_lower, sqrt_upper, liquidity)
+        assert amount0 >= balance0Min, 'UniswapV2Router: INSUFFICIENT_A_AMOUNT'
+        assert amount1 >= balance1Min, 'UniswapV2Router: INSUFFICIENT_B_AMOUNT'
+
+        tokens[self.token0].deposit(_from, amount0)
+        tokens[self.token1].deposit(_from, amount1)
+        self._modify_position(_from, tick_lower, tick_upper, liquidity)
+        self._update(tokens[self.token0].total, tokens[self.token1].total)
+        return amount0, amount1
+
+    def remove_liquidity(self, to, liquidity, amount0_min, amount1_min, tick_lower=None, tick_upper=None):
+        tokens = self.get_tokens()
+        tick_lower, tick_upper = self._range(tick_lower, tick_upper)
+        position = self.positions.get((to, tick_lower, tick_upper))
+        assert position, 'UniswapV2: INSUFFICIENT_LIQUIDITY_BURNED'
+        liquidity = min(liquidity, position)
+
+        amount0, amount1 = amounts_for_liquidity(
+            self.sqrt_price, sqrt_price_at(tick_lower), sqrt_price_at(tick_upper), liquidity
+        )
+        assert amount0 >= amount0_min, 'UniswapV2Router: INSUFFICIENT_A_AMOUNT'
+        assert amount1 >= amount1_min, 'UniswapV2Router: INSUFFICIENT_B_AMOUNT'
+
+        self._modify_position(to, tick_lower, tick_upper, -liquidity)
+        tokens[self.token0].transfer(to, amount0)
+        tokens[self.token1].transfer(to, amount1)
+        self._update(tokens[self.token0].total, tokens[self.token1].total)
+        return amount0, amount1
+
+    def _compute_swap(self, amount_in, zero_for_one):
+        """
+        Walks the ticks from the current price until amount_in is used up. Returns
+        the output and the (sqrt_price, tick, liquidity) the pool ends at, without
+        changing it.
+        """
+        assert amount_in > 0, 'UniswapV2Library: INSUFFICIENT_INPUT_AMOUNT'
+        assert self.sqrt_price is not None, 'UniswapV2Library: INSUFFICIENT_LIQUIDITY'
+        ticks = self.ticks
+        sqrt_price, tick, liquidity = self.sqrt_price, self.tick, self.liquidity
+        remaining = amount_in * (1000 - self.fee) / 1000
+        amount_out = 0
+
+        while remaining > 0:
+            next_tick = self._next_tick(tick, zero_for_one)
+            sqrt_target = sqrt_price_at(next_tick)
+
+            if liquidity > 0:
+                if zero_for_one:
+                    step_in = liquidity * (sqrt_price - sqrt_target) / (sqrt_price * sqrt_target)
+                else:
+                    step_in = liquidity * (sqrt_target - sqrt_price)
+
+                if remaining < step_in:
+                    if zero_for_one:
+                        next_sqrt_price = liquidity * sqrt_price / (liquidity + remaining * sqrt_price)
+                        amount_out += liquidity * (sqrt_price - next_sqrt_price)
+                        tick = min(max(tick_at(next_sqrt_price), next_tick), tick)
+                    else:
+                        next_sqrt_price = sqrt_price + remaining / liquidity
+                        amount_out += liquidity * (next_sqrt_price - sqrt_price) / (sqrt_price * next_sqrt_price)
+                        tick = max(min(tick_at(next_sqrt_price), next_tick - 1), tick)
+                    return amount_out, (next_sqrt_price, tick, liquidity)
+
+                remaining -= step_in
+                if zero_for_one:
+                    amount_out += liquidity * (sqrt_price - sqrt_target)
+                else:
+                    amount_out += liquidity * (sqrt_target - sqrt_price) / (sqrt_price * sqrt_target)
+
+            sqrt_price = sqrt_target
+            tick, liquidity = self._cross(next_tick, liquidity, zero_for_one)
+
+        return amount_out, (sqrt_price, tick, liquidity)
+
+    def _next_tick(self, tick, zero_for_one):
+        """
+        Next initialized tick a trade moving the price from tick reaches
+        """
+        if zero_for_one:
+            index = bisect_right(self.ticks, tick) - 1
+            assert index >= 0, 'UniswapV2Library: INSUFFICIENT_LIQUIDITY'
+        else:
+            index = bisect_right(self.ticks, tick)
+            assert index < len(self.ticks), 'UniswapV2Library: INSUFFICIENT_LIQUIDITY'
+        return self.ticks[index]
+
+    def _cross(self, next_tick, liquidity, zero_for_one):
+        """
+        (tick, active liquidity) once a trade crossed next_tick
+        """
+        if zero_for_one:
+            return next_tick - 1, liquidity - self.liquidity_net[next_tick]
+        return next_tick, liquidity + self.liquidity_net[next_tick]
+
+    def _compute_amount_in(self, amount_out, zero_for_one):
+        """
+        Input, fee included, that buys amount_out: _compute_swap the other way around
+        """
+        assert amount_out > 0, 'UniswapV2Library: INSUFFICIENT_OUTPUT_AMOUNT'
+        assert self.sqrt_price is not None, 'UniswapV2Library: INSUFFICIENT_LIQUIDITY'
+        sqrt_price, tick, liquidity = self.sqrt_price, self.tick, self.liquidity
+        remaining = amount_out
+        amount_in = 0
+
+        while True:
+            next_tick = self._next_tick(tick, zero_for_one)
+            sqrt_target = sqrt_price_at(next_tick)
+
+            if liquidity > 0:
+                if zero_for_one:
+                    step_out = liquidity * (sqrt_price - sqrt_target)
+                else:
+                    step_out = liquidity * (sqrt_target - sqrt_price) / (sqrt_price * sqrt_target)
+
+                if remaining < step_out:
+                    if zero_for_one:
+                        next_sqrt_price = sqrt_price - remaining / liquidity
+                        amount_in += liquidity * (sqrt_price - next_sqrt_price) / (sqrt_price * next_sqrt_price)
+                    else:
+                        next_sqrt_price = 1 / (1 / sqrt_price - remaining / liquidity)
+                        amount_in += liquidity * (next_sqrt_price - sqrt_price)
+                    return amount_in * 1000 / (1000 - self.fee)
+
+                remaining -= step_out
+                if zero_for_one:
+                    amount_in += liquidity * (sqrt_price - sqrt_target) / (sqrt_price * sqrt_target)
+                else:
+                    amount_in += liquidity * (sqrt_target - sqrt_price)
+
+            sqrt_price = sqrt_target
+            tick, liquidity = self._cross(next_tick, liquidity, zero_for_one)
+
+    def _direction(self, reserve_in, reserve_out):
+        """
+        Direction of a trade quoted against the reserves returned by get_reserves,
+        None for other reserves
+        """
+        if reserve_in is None:
+            return True
+        if (reserve_in, reserve_out) == self.get_reserves(self.token0):
+            return True
+        if (reserve_in, reserve_out) == self.get_reserves(self.token1):
+            return False
+        return None
+
+    def get_amount_out(self, amount_in, reserve_in=None, reserve_out=None):
+        """
+        Output of a trade against the pool, token0 -> token1 by default. Like
+        Exchange.get_amount_out, reserves other than the pool's are quoted with
+        the constant-product formula.
+        """
+        zero_for_one = self._direction(reserve_in, reserve_out)
+        if zero_for_one is None:
+            assert amount_in > 0, 'UniswapV2Library: INSUFFICIENT_INPUT_AMOUNT'
+            assert reserve_in > 0 and reserve_out > 0, 'UniswapV2Library: INSUFFICIENT_LIQUIDITY'
+            return amount_in * reserve_out / (reserve_in + amount_in)
+        return self._compute_swap(amount_in, zero_for_one)[0]
+
+    def get_amount_in(self, amount_out, reserve_in=None, reserve_out=None):
+        """
+        Input of a trade buying amount_out from the pool, token0 -> token1 by default,
+        see get_amount_out
+        """
+        zero_for_one = self._direction(reserve_in, reserve_out)
+        if zero_for_one is None:
+            assert amount_out > 0, 'UniswapV2Library: INSUFFICIENT_OUTPUT_AMOUNT'
+            assert reserve_in > 0 and reserve_out > amount_out, 'UniswapV2Library: INSUFFICIENT_LIQUIDITY'
+            return reserve_in * amount_out / (reserve_out - amount_out)
+        return self._compute_amount_in(amount_out, zero_for_one)
+
+    def price_impact(self, amounts_in, zero_for_one=True):
+        """
+        Exchange.price_impact, walking the ticks for every size
+        """
+        amounts_in = np.asarray(amounts_in, dtype=np.float64)
+        assert (amounts_in > 0).all(), 'UniswapV2Library: INSUFFICIENT_INPUT_AMOUNT'
+        assert self.liquidity > 0, 'UniswapV2Library: INSUFFICIENT_LIQUIDITY'
+
+        amounts_out = np.array([self._compute_swap(amount_in, zero_for_one)[0] for amount_in in amounts_in.tolist()])
+        effective_prices = amounts_out / amounts_in
+        spot_price = self.price if zero_for_one else 1 / self.price
+        price_impacts = 1 - effective_prices / ((1000 - self.fee) / 1000 * spot_price)
+        return amounts_out, effective_prices, price_impacts
+
+    def get_reserves(self, token_in):
+        """
+        Virtual reserves (reserve_in, reserve_out) of the active liquidity
+        """
+        reserve0 = self.liquidity / self.sqrt_price if self.sqrt_price else 0
+        reserve1 = self.liquidity * self.sqrt_price if self.sqrt_price else 0
+        if token_in == self.token0:
+            return reserve0, reserve1
+        assert token_in == self.token1, 'UniswapV2Library: INVALID_PATH'
+        return reserve1, reserve0
+
+    def quote(self, amount0, reserve0, reserve1):
+        assert amount0 > 0, 'UniswapV2Library: INSUFFICIENT_AMOUNT'
+        assert reserve0 > 0 and reserve1 > 0, 'UniswapV2Library: INSUFFICIENT_LIQUIDITY'
+        return amount0 * reserve1 / reserve0
+
+    def swapExactTokensForTokens(self, amount_in, amount_out_min, to, zero_for_one=True):
+        amount_out, state = self._compute_swap(amount_in, zero_for_one)
+        assert amount_out >= amount_out_min, 'UniswapV2Router: INSUFFICIENT_OUTPUT_AMOUNT'
+
+        tokens = self.get_tokens()
+        token_in, token_out = (self.token0, self.token1) if zero_for_one else (self.token1, self.token0)
+        tokens[token_in].deposit(to, amount_in)
+        tokens[token_out].transfer(to, amount_out)
+        self.sqrt_price, self.tick, self.liquidity = state
+        self._update(tokens[self.token0].total, tokens[self.token1].total)
+        return amount_out
+
+    def swapExactTokensForTokensBatch(self, amounts0_in, amounts1_out_min, to):
+        """
+        Exchange.swapExactTokensForTokensBatch: token0 -> token1 trades applied one
+        after the other, the tokens moving once for the whole run. A trade missing
+        its minimum or the liquidity it needs is rejected.
+        """
+        amounts0_in = np.asarray(amounts0_in, dtype=np.float64)
+        amounts1_out_min = np.broadcast_to(np.asarray(amounts1_out_min, dtype=np.float64), amounts0_in.shape)
+        amounts1_out = np.zeros_like(amounts0_in)
+        accepted = np.zeros(amounts0_in.shape, dtype=bool)
+
+        for i, (amount0_in, amount1_out_min) in enumerate(zip(amounts0_in.tolist(), amounts1_out_min.tolist())):
+            if amount0_in <= 0:
+                continue
+            try:
+                amount1_out, next_state = self._compute_swap(amount0_in, True)
+            except AssertionError:
+                continue
+            if amount1_out < amount1_out_min:
+                continue
+            amounts1_out[i] = amount1_out
+            accepted[i] = True
+            self.sqrt_price, self.tick, self.liquidity = next_state
+
+        if accepted.any():
+            tokens = self.get_tokens()
+            tokens[self.token0].deposit(to, sum(amounts0_in[accepted].tolist()))
+            tokens[self.token1].transfer(to, sum(amounts1_out[accepted].tolist()))
+            self._update(tokens[self.token0].total, tokens[self.token1].total)
+        return amounts1_out, accepted, (self.reserve0, self.reserve1)
+
+    def swap(self, amount0_out, amount1_out, to, log=True):
+        """
+        Low-level swap like Exchange.swap: the input must already be deposited in
+        the token, and it has to buy at least the requested output. Concentrated
+        pools are never journaled, `log` is there for the callers of Exchange.swap.
+        """
+        assert amount0_out > 0 or amount1_out > 0, 'UniswapV2: INSUFFICIENT_OUTPUT_AMOUNT'
+        tokens = self.get_tokens()
+        zero_for_one = amount1_out > 0
+        if zero_for_one:
+            amount_in, amount_out = tokens[self.token0].total - self.reserve0, amount1_out
+        else:
+            amount_in, amount_out = tokens[self.token1].total - self.reserve1, amount0_out
+        assert amount_in > 0, 'UniswapV2: INSUFFICIENT_INPUT_AMOUNT'
+
+        bought, state = self._compute_swap(amount_in, zero_for_one)
+        assert bought >= amount_out, 'UniswapV2: K'
+
+        tokens[self.token1 if zero_for_one else self.token0].transfer(to, amount_out)
+        self.sqrt_price, self.tick, self.liquidity = state
+        self._update(tokens[self.token0].total, tokens[self.token1].total)
+
+    def _update(self, balance0, balance1):
+        now = self.factory.clock.time()
+        time_elapsed = now - self.block_timestamp_last
+        if time_elapsed > 0 and self._price_last:
+            self.price0_cumulative_last += self._price_last * time_elapsed
+            self.price1_cumulative_last += time_elapsed / self._price_last
+
+        self.reserve0 = balance0
+        self.reserve1 = balance1
+        self._price_last = self.price
+        self.block_timestamp_last = now
+        self.version += 1
+        if self._batch is None and self.factory.listeners:
+            self.factory.notify(self)
+
+    def _commit(self, checkpoint):
+        """
+        Like Exchange._commit; the accumulators already moved with every update of the batch
+        """
+        if self.factory.listeners:
+            self.factory.notify(self)
+
+    def _checkpoint(self):
+        return (
+            self.reserve0, self.reserve1, self.sqrt_price, self.tick, self.liquidity,
+            self.price0_cumulative_last, self.price1_cumulative_last, self._price_last, self.block_timestamp_last,
+        )
+
+    def _rollback(self, checkpoint):
+        """
+        Like Exchange._rollback
+        """
+        (self.reserve0, self.reserve1, self.sqrt_price, self.tick, self.liquidity,
+         self.price0_cumulative_last, self.price1_cumulative_last, self._price_last, self.block_timestamp_last) = checkpoint
+        self.version += 1
+
+
+POOL_KINDS["concentrated"] = ConcentratedExchange
@@ -0,0 +1,184 @@
+import os
+import tempfile
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+from lp import Exchange, Factory
+
+
+# columns of a history; timestamps are floats, the other columns have the dtype of the history
+COLUMNS = ("timestamp", "reserve0", "reserve1", "total_supply")
+
+
+class ReserveHistory:
+    """
+        Every (timestamp, reserve0, reserve1, total_supply) a pool went through, in
+        typed columns split in segments of `segment_size` rows.
+
+        The last segment is in memory and grows geometrically up to segment_size, so
+        a quiet pool costs a few rows. A full segment is sealed and, with a
+        `spill_dir`, written as one .npy file per column to a directory of its own
+        created in spill_dir, and mapped back read-only, so old history lives in
+        the page cache instead of the heap. Existing files are never overwritten.
+
+        Values are float64 unless `dtype` says otherwise; object columns hold the
+        exact integers of IntegerMath pools. Those can't be memory-mapped, so
+        only the timestamps of their sealed segments are spilled.
+
+        Rows are in timestamp order, several rows can share a timestamp and the
+        last one is the state at that time. Queries bisect the first timestamp of
+        every segment, then search within the segment.
+    """
+
+    def __init__(self, segment_size=65536, spill_dir=None, prefix="pool", dtype=np.float64) -> None:
+        assert segment_size > 0, 'History: INVALID_SEGMENT_SIZE'
+        self.segment_size = segment_size
+        self.spill_dir = spill_dir
+        self.prefix = prefix        # of the spill directory
+        self.directory = None       # created in spill_dir by the first spill
+        self.dtypes = {name: np.dtype(np.float64 if name == "timestamp" else dtype) for name in COLUMNS}
+        self.sealed = []            # segments, as {column: array}, memory-mapped once spilled
+        self.firsts = []            # first timestamp of every segment, the last one included
+        self.columns = self._empty(min(16, segment_size))
+        self.size = 0               # rows of the last segment
+
+    def _empty(self, size):
+        return {name: np.zeros(size, dtype=dtype) for name, dtype in self.dtypes.items()}
+
+    def __len__(self):
+        return len(self.sealed) * self.segment_size + self.size
+
+    def append(self, timestamp, reserve0, reserve1, total_supply):
+        if self.size == self.segment_size:
+            self._seal()
+        elif self.size == len(self.columns["timestamp"]):
+            self._grow()
+
+        if self.size == 0:
+            self.firsts.append(timestamp)
+        row = self.size
+        columns = self.columns
+        columns["timestamp"][row] = timestamp
+        columns["reserve0"][row] = reserve0
+        columns["reserve1"][row] = reserve1
+        columns["total_supply"][row] = total_supply
+        self.size += 1
+
+    def _grow(self):
+        capacity = min(2 * len(self.columns["timestamp"]), self.segment_size)
+        for name, old in self.columns.items():
+            new = self.columns[name] = np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old
+
+    def _seal(self):
+        segment = self.columns
+        if self.spill_dir is not None:
+            if self.directory is None:
+                self.directory = tempfile.mkdtemp(prefix=f"{self.prefix}-", dir=self.spill_dir)
+            index = len(self.sealed)
+            segment = dict(segment)
+            for name, values in self.columns.items():
+                if values.dtype.hasobject:
+                    continue
+                path = os.path.join(self.directory, f"{index}-{name}.npy")
+                with open(path, "xb") as file:
+                    np.save(file, values)
+                segment[name] = np.load(path, mmap_mode="r")
+        self.sealed.append(segment)
+        self.columns = self._empty(min(16, self.segment_size))
+        self.size = 0
+
+    def _segment(self, index):
+        if index < len(self.sealed):
+            return self.sealed[index], self.segment_size
+        return self.columns, self.size
+
+    def as_of(self, timestamp):
+        """
+        (reserve0, reserve1, total_supply) of the last row not after timestamp
+        """
+        index = bisect_right(self.firsts, timestamp) - 1
+        assert index >= 0, 'History: OLD'
+        segment, size = self._segment(index)
+        row = int(np.searchsorted(segment["timestamp"][:size], timestamp, side="right")) - 1
+        return segment["reserve0"].item(row), segment["reserve1"].item(row), segment["total_supply"].item(row)
+
+    def segments(self, start, end):
+        """
+        Rows with start <= timestamp < end as {column: view}, one per segment they
+        span; nothing is copied
+        """
+        views = []
+        first = max(bisect_left(self.firsts, start) - 1, 0)     # rows at start may end the previous segment
+        last = bisect_right(self.firsts, end)
+        for index in range(first, last):
+            segment, size = self._segment(index)
+            timestamps = segment["timestamp"][:size]
+            low, high = np.searchsorted(timestamps, (start, end))
+            if low < high:
+                views.append({name: values[low:high] for name, values in segment.items()})
+        return views
+
+    def range(self, start, end):
+        """
+        Rows with start <= timestamp < end as {column: array}. The arrays are views
+        when the rows are in a single segment, and concatenated copies otherwise.
+        """
+        views = self.segments(start, end)
+        if len(views) == 1:
+            return views[0]
+        if not views:
+            return self._empty(0)
+        return {name: np.concatenate([view[name] for view in views]) for name in COLUMNS}
+
+
+class HistoryRecorder:
+    """
+        Opt-in reserve history of the pools of a factory, for backtests: it listens
+        to the factory (see Factory.listeners) and appends the state of a pool to its
+        ReserveHistory after every update, then answers what the reserves and the
+        liquidity supply of a pool were at a given time.
+        `segment_size` and `spill_dir` are passed to every ReserveHistory, which
+        keeps the values in the dtype of the factory's numeric mode.
+    """
+
+    def __init__(self, factory: Factory, segment_size=65536, spill_dir=None) -> None:
+        self.factory = factory
+        self.segment_size = segment_size
+        self.spill_dir = spill_dir
+        self.histories = {}     # pool name -> ReserveHistory
+        factory.listeners.append(self.record)
+
+    def record(self, exchange: Exchange):
+        history = self.histories.get(exchange.name)
+        if history is None:
+            history = self.histories[exchange.name] = ReserveHistory(
+                self.segment_size, self.spill_dir, prefix=f"pool{len(self.histories)}", dtype=self.factory.numeric.dtype
+            )
+        history.append(
+            exchange.block_timestamp_last, exchange.reserve0, exchange.reserve1, exchange.total_supply
+        )
+
+    def close(self):
+        """
+        Stops recording; what was recorded can still be queried
+        """
+        self.factory.listeners.remove(self.record)
+
+    def _history(self, pool):
+        history = self.histories.get(pool.name)
+        assert history is not None, 'History: OLD'
+        return history
+
+    def as_of(self, pool: Exchange, timestamp):
+        """
+        (reserve0, reserve1, total_supply) of the pool at timestamp
+        """
+        return self._history(pool).as_of(timestamp)
+
+    def range(self, pool: Exchange, start, end):
+        """
+        Columns of the updates of the pool with start <= timestamp < end, see ReserveHistory.range
+        """
+        return self._history(pool).range(start, end)
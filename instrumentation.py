@@ -0,0 +1,219 @@
+import functools
+import os
+import time
+from bisect import bisect_left
+from collections import Counter
+
+import numpy as np
+
+from concentrated import ConcentratedExchange
+from lp import BaseExchange
+from staking_rewards import StakingRewards
+
+
+METHODS = {
+    BaseExchange: (
+        "add_liquidity", "remove_liquidity", "swapExactTokensForTokens", "swapExactTokensForTokensBatch",
+        "swap", "mint", "burn", "quote", "get_amount_out", "get_amount_in", "price_impact",
+    ),
+    ConcentratedExchange: (
+        "add_liquidity", "remove_liquidity", "swapExactTokensForTokens", "swapExactTokensForTokensBatch",
+        "swap", "quote", "get_amount_out", "get_amount_in", "price_impact",
+    ),
+    StakingRewards: ("add_rewards", "stake", "withdraw", "get_reward", "earned", "earned_all"),
+}
+
+# HDR style latency buckets in nanoseconds: 4 linear sub-buckets per power of two, 128ns to ~69s
+BOUNDS = [2 ** exponent * (4 + step) // 4 for exponent in range(7, 36) for step in range(4)]
+
+
+def _target(obj):
+    if isinstance(obj, StakingRewards):
+        return f"{obj.lp.name}:staking"
+    return obj.name
+
+
+class Metrics:
+    """
+        Calls, latency histograms and assertion failures by target (pool name, or
+        "<pool>:staking" for staking contracts) and method
+    """
+
+    def __init__(self) -> None:
+        self.histograms = {}        # (target, method) -> counts per bucket, the last one unbounded
+        self.latency_sum = Counter()
+        self.failures = Counter()   # (target, method, message) -> count
+
+    def observe(self, target, method, nanoseconds):
+        key = (target, method)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = np.zeros(len(BOUNDS) + 1, dtype=np.int64)
+        histogram[bisect_left(BOUNDS, nanoseconds)] += 1
+        self.latency_sum[key] += nanoseconds
+
+    def failure(self, target, method, message):
+        self.failures[(target, method, message)] += 1
+
+    def reset(self):
+        self.histograms.clear()
+        self.latency_sum.clear()
+        self.failures.clear()
+
+    def _percentile(self, histogram, fraction):
+        rank = np.searchsorted(np.cumsum(histogram), fraction * histogram.sum())
+        return BOUNDS[rank] if rank < len(BOUNDS) else float("inf")
+
+    def snapshot(self):
+        """
+        Plain dict of the metrics: calls, latency (count, sum, p50/p99 upper bounds and
+        non-empty buckets, in nanoseconds) and failures, by target and method
+        """
+        snapshot = {"calls": {}, "latency": {}, "failures": {}}
+        for (target, method), histogram in self.histograms.items():
+            count = int(histogram.sum())
+            snapshot["calls"].setdefault(target, {})[method] = count
+            snapshot["latency"].setdefault(target, {})[method] = {
+                "count": count,
+                "sum_ns": self.latency_sum[(target, method)],
+                "p50_ns": self._percentile(histogram, 0.5),
+                "p99_ns": self._percentile(histogram, 0.99),
+                "buckets": {
+                    (BOUNDS[index] if index < len(BOUNDS) else "+Inf"): int(histogram[index])
+                    for index in np.flatnonzero(histogram).tolist()
+                },
+            }
+        for (target, method, message), count in self.failures.items():
+            snapshot["failures"].setdefault(target, {}).setdefault(method, {})[message] = count
+        return snapshot
+
+    def prometheus(self):
+        """
+        The metrics in the Prometheus text exposition format
+        """
+        lines = [
+            "# HELP lp_calls_total Calls by target and method",
+            "# TYPE lp_calls_total counter",
+        ]
+        for (target, method), histogram in self.histograms.items():
+            lines.append(f"lp_calls_total{{{_labels(target, method)}}} {int(histogram.sum())}")
+
+        lines += [
+            "# HELP lp_latency_seconds Latency by target and method",
+            "# TYPE lp_latency_seconds histogram",
+        ]
+        for (target, method), histogram in self.histograms.items():
+            labels = _labels(target, method)
+            cumulative = np.cumsum(histogram)
+            for index in np.flatnonzero(histogram[:-1]).tolist():
+                lines.append(f'lp_latency_seconds_bucket{{{labels},le="{BOUNDS[index] / 1e9:g}"}} {cumulative[index]}')
+            lines.append(f'lp_latency_seconds_bucket{{{labels},le="+Inf"}} {cumulative[-1]}')
+            lines.append(f"lp_latency_seconds_sum{{{labels}}} {self.latency_sum[(target, method)] / 1e9:g}")
+            lines.append(f"lp_latency_seconds_count{{{labels}}} {cumulative[-1]}")
+
+        lines += [
+            "# HELP lp_assertion_failures_total Failed assertions by target, method and message",
+            "# TYPE lp_assertion_failures_total counter",
+        ]
+        for (target, method, message), count in self.failures.items():
+            lines.append(f'lp_assertion_failures_total{{{_labels(target, method)},message="{_escape(message)}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """
+        Writes the Prometheus dump to path, atomically so a scraper never reads half a file
+        """
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as file:
+            file.write(self.prometheus())
+        os.replace(temporary, path)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(target, method):
+    return f'target="{_escape(target)}",method="{method}"'
+
+
+def _wrap(function, method, metrics):
+    clock = time.perf_counter_ns
+
+    @functools.wraps(function)
+    def instrumented(self, *args, **kwargs):
+        start = clock()
+        try:
+            return function(self, *args, **kwargs)
+        except AssertionError as error:
+            metrics.failure(_target(self), method, str(error))
+            raise
+        finally:
+            metrics.observe(_target(self), method, clock() - start)
+
+    return instrumented
+
+
+def _methods(cls):
+    for base, methods in METHODS.items():
+        if issubclass(cls, base):
+            return methods
+    raise TypeError(f"{cls.__name__} can't be instrumented")
+
+
+# (class, metrics) -> instrumented subclass
+_subclasses = {}
+
+
+def instrument(obj, metrics: Metrics):
+    """
+    Instruments a single exchange or staking contract by switching its class to a
+    subclass with instrumented methods; other objects of the class are untouched
+    """
+    cls = type(obj)
+    if getattr(cls, "_instrumented", False):
+        cls = cls.__bases__[0]
+
+    subclass = _subclasses.get((cls, metrics))
+    if subclass is None:
+        namespace = {"__slots__": (), "_instrumented": True}
+        for method in _methods(cls):
+            namespace[method] = _wrap(getattr(cls, method), method, metrics)
+        subclass = _subclasses[(cls, metrics)] = type(cls.__name__, (cls,), namespace)
+    obj.__class__ = subclass
+    return obj
+
+
+def uninstrument(obj):
+    """
+    Back to plain method calls
+    """
+    if getattr(type(obj), "_instrumented", False):
+        obj.__class__ = type(obj).__bases__[0]
+    return obj
+
+
+# class -> {method: original function}
+_originals = {}
+
+
+def enable(metrics: Metrics, classes=(BaseExchange, ConcentratedExchange, StakingRewards)):
+    """
+    Instruments every object of the classes (and their subclasses). Don't combine
+    with `instrument` on the same objects, their calls would be counted twice.
+    """
+    for cls in classes:
+        if cls in _originals:
+            disable((cls,))
+        _originals[cls] = {method: cls.__dict__[method] for method in _methods(cls)}
+        for method, function in _originals[cls].items():
+            setattr(cls, method, _wrap(function, method, metrics))
+
+
+def disable(classes=None):
+    """
+    Restores the original methods, so calls cost exactly what they did before `enable`
+    """
+    for cls in list(_originals if classes is None else classes):
+        for method, function in _originals.pop(cls, {}).items():
+            setattr(cls, method, function)
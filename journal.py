@@ -0,0 +1,390 @@
+import os
+import struct
+from numbers import Integral
+
+from clock import ManualClock, SystemClock
+from lp import ERC20, Factory
+from numeric import IntegerMath
+from router import Router
+from staking_rewards import StakingRewards
+
+
+# operation codes
+STRING = 0
+FACTORY = 1
+CREATE_EXCHANGE = 2
+ADD_LIQUIDITY = 3
+REMOVE_LIQUIDITY = 4
+SWAP = 5
+STAKING = 6
+STAKE = 7
+WITHDRAW = 8
+GET_REWARD = 9
+ADD_REWARDS = 10
+SWAP_BATCH = 11
+PAIR_SWAP = 12
+PAIR_MINT = 13
+PAIR_BURN = 14
+SET_FEE = 15
+ROUTER_SWAP = 16
+
+NO_ID = 0xFFFFFFFF
+
+# op, bitmask of integer amounts, target id, address id, extra
+HEADER = struct.Struct("<BBxxIII")
+AMOUNT_SIZE = 16
+AMOUNTS = 4
+RECORD_SIZE = HEADER.size + AMOUNTS * AMOUNT_SIZE
+FLOAT = struct.Struct("<d")
+
+
+def _pack_amount(value):
+    if isinstance(value, Integral):
+        return True, int(value).to_bytes(AMOUNT_SIZE, "little", signed=True)
+    return False, FLOAT.pack(value).ljust(AMOUNT_SIZE, b"\0")
+
+
+def _unpack_amount(buffer, offset, is_int):
+    if is_int:
+        return int.from_bytes(buffer[offset:offset + AMOUNT_SIZE], "little", signed=True)
+    return FLOAT.unpack_from(buffer, offset)[0]
+
+
+class Journal:
+    """
+        Append-only binary log of the state-changing calls on a factory, its
+        exchanges and their staking contracts.
+
+        Every call is a fixed-width record of RECORD_SIZE bytes: a header with the
+        operation, the pool or staking id and the address, followed by four 16 bytes
+        amounts, stored as float64 or as 128 bit ints so integer pools are logged
+        exactly. Strings (names, addresses) are interned: the first time one is seen
+        a STRING record is written with its bytes in the records that follow it.
+
+        Records are buffered and written with a single fsync every `group_size`
+        records (group commit) or on commit/close. Only calls that succeeded are
+        logged, so `recover` can replay the file without rejects: the records of an
+        Exchange.multicall stay in the buffer until it succeeds (see savepoint) and
+        are dropped if it fails.
+
+        Opening an existing journal appends to it: its strings, pools and staking
+        contracts are read back so the ids keep counting from where they were, and
+        a record cut short by a crash is dropped. Pass the journal to `recover` to
+        attach it to the rebuilt factory and staking contracts.
+    """
+
+    def __init__(self, path, group_size=256) -> None:
+        self.path = path
+        self.group_size = group_size
+        self.buffer = bytearray()
+        self.pending = 0
+        self.savepoints = 0         # while > 0, records are held in the buffer
+
+        self.strings = {}
+        self.pool_ids = {}          # exchange name -> pool id
+        self.staking_ids = {}       # id(staking) -> staking id
+        self.stakings = []          # None for the ones logged before the journal was opened
+        self._scan()
+        self.file = open(path, "ab")
+
+    def _scan(self):
+        """
+        Reads back the ids of an existing journal and truncates a partial record at its end
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as file:
+            buffer = file.read()
+
+        strings = []
+        size = 0
+        for size, op, _, _, _, amounts in _records(buffer, strings):
+            if op == CREATE_EXCHANGE:
+                self.pool_ids[f"{amounts[0]}/{amounts[2]}"] = len(self.pool_ids)
+            elif op == STAKING:
+                self.stakings.append(None)
+        self.strings = {value: string_id for string_id, value in enumerate(strings)}
+        if size < len(buffer):
+            os.truncate(self.path, size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _string_id(self, value):
+        if value is None:
+            return NO_ID
+
+        string_id = self.strings.get(value)
+        if string_id is None:
+            string_id = self.strings[value] = len(self.strings)
+            data = value.encode()
+            padding = -len(data) % RECORD_SIZE
+            self._write(HEADER.pack(STRING, 0, string_id, NO_ID, len(data)).ljust(RECORD_SIZE, b"\0"))
+            self._write(data + b"\0" * padding)
+        return string_id
+
+    def _append(self, op, target, address, *amounts, extra=0):
+        address_id = self._string_id(address)
+        flags = ~0 << len(amounts) & 0xFF     # unused amounts read back as integer 0
+        record = bytearray()
+        for i, amount in enumerate(amounts):
+            is_int, packed = _pack_amount(amount)
+            flags |= is_int << i
+            record += packed
+
+        self._write(HEADER.pack(op, flags, target, address_id, extra) + bytes(record).ljust(AMOUNTS * AMOUNT_SIZE, b"\0"))
+        self.pending += 1
+        if self.pending >= self.group_size and not self.savepoints:
+            self.commit()
+
+    def _write(self, data):
+        self.buffer += data
+
+    def savepoint(self):
+        self.savepoints += 1
+        return len(self.buffer), len(self.strings), self.pending, len(self.pool_ids)
+
+    def release(self, savepoint):
+        self.savepoints -= 1
+        if self.pending >= self.group_size and not self.savepoints:
+            self.commit()
+
+    def rollback(self, savepoint):
+        """
+        Drops the records written since the savepoint, with the strings they interned
+        """
+        size, strings, self.pending, pools = savepoint
+        del self.buffer[size:]
+        for value in list(self.strings)[strings:]:
+            del self.strings[value]
+        for name in list(self.pool_ids)[pools:]:
+            del self.pool_ids[name]
+        self.savepoints -= 1
+
+    def commit(self):
+        if self.buffer:
+            self.file.write(self.buffer)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.buffer.clear()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.file.close()
+
+    def log_factory(self, factory):
+        self._append(
+            FACTORY, NO_ID, None,
+            self._string_id(factory.name), self._string_id(factory.address), self._string_id(factory.numeric.name),
+        )
+
+    def log_create_exchange(self, exchange, token0, token1):
+        pool_id = self.pool_ids[exchange.name] = len(self.pool_ids)
+        self._append(
+            CREATE_EXCHANGE, pool_id, exchange.symbol,
+            self._string_id(token0.name), self._string_id(token0.token_addr),
+            self._string_id(token1.name), self._string_id(token1.token_addr),
+        )
+
+    def log_add_liquidity(self, exchange, _from, balance0, balance1, balance0Min, balance1Min):
+        self._append(ADD_LIQUIDITY, self.pool_ids[exchange.name], _from, balance0, balance1, balance0Min, balance1Min)
+
+    def log_remove_liquidity(self, exchange, to, liquidity, amount0_min, amount1_min):
+        self._append(REMOVE_LIQUIDITY, self.pool_ids[exchange.name], to, liquidity, amount0_min, amount1_min)
+
+    def log_swap(self, exchange, to, amount0_in, amount1_out_min):
+        self._append(SWAP, self.pool_ids[exchange.name], to, amount0_in, amount1_out_min)
+
+    def log_swap_batch(self, exchange, to, amounts0_in, amounts1_out_min):
+        """
+        One record per trade of the batch, `extra` is its position, so 0 starts a batch
+        """
+        pool_id = self.pool_ids[exchange.name]
+        for position, (amount0_in, amount1_out_min) in enumerate(zip(amounts0_in, amounts1_out_min)):
+            self._append(SWAP_BATCH, pool_id, to, amount0_in, amount1_out_min, extra=position)
+
+    def log_pair_swap(self, exchange, to, amount0_out, amount1_out, amount0_in, amount1_in):
+        self._append(PAIR_SWAP, self.pool_ids[exchange.name], to, amount0_out, amount1_out, amount0_in, amount1_in)
+
+    def log_mint(self, exchange, to, amount0, amount1):
+        self._append(PAIR_MINT, self.pool_ids[exchange.name], to, amount0, amount1)
+
+    def log_burn(self, exchange, to, liquidity, amount0, amount1):
+        self._append(PAIR_BURN, self.pool_ids[exchange.name], to, liquidity, amount0, amount1)
+
+    def log_set_fee(self, exchange, fee):
+        self._append(SET_FEE, self.pool_ids[exchange.name], None, fee)
+
+    def log_router_swap(self, router, amount_in, amount_out_min, token_in, token_out, to):
+        self._append(
+            ROUTER_SWAP, NO_ID, to,
+            amount_in, amount_out_min, self._string_id(token_in), self._string_id(token_out),
+            extra=router.max_hops,
+        )
+
+    def log_staking(self, staking):
+        staking_id = self.staking_ids[id(staking)] = len(self.stakings)
+        self.stakings.append(staking)
+        self._append(STAKING, staking_id, None, extra=self.pool_ids[staking.lp.name])
+
+    def log_add_rewards(self, staking, reward, duration, timestamp):
+        self._append(ADD_REWARDS, self.staking_ids[id(staking)], None, reward, duration or 0, timestamp)
+
+    def log_stake(self, staking, _from, amount, timestamp):
+        self._append(STAKE, self.staking_ids[id(staking)], _from, amount, timestamp)
+
+    def log_withdraw(self, staking, _from, amount, timestamp):
+        self._append(WITHDRAW, self.staking_ids[id(staking)], _from, amount, timestamp)
+
+    def log_get_reward(self, staking, _from, timestamp):
+        self._append(GET_REWARD, self.staking_ids[id(staking)], _from, timestamp)
+
+
+def read_records(buffer, strings=None):
+    """
+    Yields (op, target, address, extra, amounts) for every record of a journal,
+    with strings resolved. The strings met are appended to `strings`.
+    """
+    for _, op, target, address, extra, amounts in _records(buffer, [] if strings is None else strings):
+        if op != STRING:
+            yield op, target, address, extra, amounts
+
+
+def _records(buffer, strings):
+    """
+    read_records, STRING records included, each with the offset where it ends
+    """
+    offset = 0
+    size = len(buffer)
+    while offset + RECORD_SIZE <= size:
+        op, flags, target, address_id, extra = HEADER.unpack_from(buffer, offset)
+        offset += RECORD_SIZE
+
+        if op == STRING:
+            end = offset + extra
+            if end + (-extra % RECORD_SIZE) > size:
+                return
+            strings.append(bytes(buffer[offset:end]).decode())
+            offset = end + (-extra % RECORD_SIZE)
+            yield offset, op, target, None, extra, []
+            continue
+
+        amounts = [
+            _unpack_amount(buffer, offset - RECORD_SIZE + HEADER.size + i * AMOUNT_SIZE, flags >> i & 1)
+            for i in range(AMOUNTS)
+        ]
+        address = strings[address_id] if address_id != NO_ID else None
+        if op == FACTORY:
+            amounts = [strings[string_id] for string_id in amounts[:3]]
+        elif op == CREATE_EXCHANGE:
+            amounts = [strings[string_id] for string_id in amounts]
+        elif op == ROUTER_SWAP:
+            amounts[2:] = [strings[string_id] for string_id in amounts[2:]]
+        yield offset, op, target, address, extra, amounts
+
+
+def _deposit(pool, _from, amount0, amount1):
+    tokens = pool.get_tokens()
+    for token, amount in ((pool.token0, amount0), (pool.token1, amount1)):
+        if amount:
+            tokens[token].deposit(_from, amount)
+
+
+def recover(path, factory_class=Factory, journal=None):
+    """
+    Rebuilds the factory and the staking contracts logged in a journal by replaying
+    its records. The staking contracts read the clock from the log while replaying.
+
+    Batches replay as batches. In integer mode, where swapExactTokensForTokensBatch
+    rounds every trade like swapExactTokensForTokens does, consecutive swaps on a
+    pool to the same address replay as one batch too. The input of a direct
+    Exchange.swap or Exchange.mint is deposited from its `to` address.
+
+    Returns the factory and the list of staking contracts, attached to `journal` if
+    given (the journal of the same file, reopened) and to no journal otherwise.
+    """
+    with open(path, "rb") as file:
+        buffer = file.read()
+
+    factory = None
+    pools = []
+    stakings = []
+    clock = ManualClock()
+    batch = []          # [pool id, to, amounts0_in, amounts1_out_min] of the trades to replay at once
+    batched = False     # whether the pending trades were logged as a batch
+
+    def flush():
+        if not batch:
+            return
+        pool_id, to, amounts0_in, amounts1_out_min = batch
+        if len(amounts0_in) == 1 and not batched:
+            pools[pool_id].swapExactTokensForTokens(amounts0_in[0], amounts1_out_min[0], to)
+        else:
+            pools[pool_id].swapExactTokensForTokensBatch(amounts0_in, amounts1_out_min, to)
+        batch.clear()
+
+    for op, target, address, extra, amounts in read_records(buffer):
+        if op == SWAP and factory.numeric is IntegerMath and not batched and batch[:2] == [target, address]:
+            batch[2].append(amounts[0])
+            batch[3].append(amounts[1])
+            continue
+        if op == SWAP_BATCH and extra > 0:
+            batch[2].append(amounts[0])
+            batch[3].append(amounts[1])
+            continue
+        flush()
+
+        if op == SWAP or op == SWAP_BATCH:
+            batch[:] = [target, address, [amounts[0]], [amounts[1]]]
+            batched = op == SWAP_BATCH
+        elif op == ADD_LIQUIDITY:
+            pools[target].add_liquidity(address, *amounts)
+        elif op == REMOVE_LIQUIDITY:
+            pools[target].remove_liquidity(address, *amounts[:3])
+        elif op == PAIR_SWAP:
+            _deposit(pools[target], address, amounts[2], amounts[3])
+            pools[target].swap(amounts[0], amounts[1], address)
+        elif op == PAIR_MINT:
+            _deposit(pools[target], address, amounts[0], amounts[1])
+            pools[target].mint(address, amounts[0], amounts[1])
+        elif op == PAIR_BURN:
+            pools[target].burn(address, *amounts[:3])
+        elif op == SET_FEE:
+            pools[target].set_fee(amounts[0])
+        elif op == ROUTER_SWAP:
+            Router(factory, extra).swapExactTokensForTokens(amounts[0], amounts[1], amounts[2], amounts[3], address)
+        elif op == STAKE:
+            clock.now = amounts[1]
+            stakings[target].stake(address, amounts[0])
+        elif op == WITHDRAW:
+            clock.now = amounts[1]
+            stakings[target].withdraw(address, amounts[0])
+        elif op == GET_REWARD:
+            clock.now = amounts[0]
+            stakings[target].get_reward(address)
+        elif op == ADD_REWARDS:
+            clock.now = amounts[2]
+            stakings[target].add_rewards(amounts[0], amounts[1] or None)
+        elif op == CREATE_EXCHANGE:
+            token0 = ERC20(amounts[0], amounts[1])
+            token1 = ERC20(amounts[2], amounts[3])
+            pools.append(factory.create_exchange(token0, token1, address))
+        elif op == STAKING:
+            stakings.append(StakingRewards(pools[extra], clock=clock))
+        elif op == FACTORY:
+            factory = factory_class(amounts[0], amounts[1], numeric=amounts[2])
+    flush()
+
+    for staking in stakings:
+        staking.clock = SystemClock()
+    if journal is not None:
+        factory.journal = journal
+        for staking_id, staking in enumerate(stakings):
+            staking.journal = journal
+            journal.staking_ids[id(staking)] = staking_id
+            journal.stakings[staking_id] = staking
+    return factory, stakings
@@ -0,0 +1,408 @@
+import threading
+from collections.abc import MutableMapping
+from itertools import chain
+
+import numpy as np
+
+
+class AddressRegistry:
+    """
+        Interns addresses: every address gets a small integer id the first time it
+        is seen, and the string is only held here. Ledgers in arrays are indexed by
+        these ids; only their addresses are registered, so the registry grows with
+        the holders of big ledgers, not with every address ever seen.
+    """
+
+    def __init__(self) -> None:
+        self.ids = {}           # address -> id
+        self.addresses = []     # id -> address
+        self._lock = threading.Lock()
+
+    def id(self, address):
+        address_id = self.ids.get(address)
+        if address_id is None:
+            with self._lock:
+                address_id = self.ids.get(address)
+                if address_id is None:
+                    address_id = self.ids[address] = len(self.addresses)
+                    self.addresses.append(address)
+        return address_id
+
+    def find(self, address):
+        """
+        Id of the address, None if it was never seen
+        """
+        return self.ids.get(address)
+
+    def address(self, address_id):
+        return self.addresses[address_id]
+
+    def __len__(self):
+        return len(self.addresses)
+
+
+# shared by every ledger of the process
+ADDRESSES = AddressRegistry()
+
+# a ledger moves to arrays only if it holds at least one address in DENSITY of the registry
+DENSITY = 8
+
+_MISSING = object()
+
+
+class ArrayLedger:
+    """
+        Per-address columns, each behaving like its own dict (see mapping).
+
+        Most ledgers are small, a pool with a handful of providers, so a ledger
+        starts as one plain dict per column keyed by address, as fast and compact
+        as the dict it stands for. Once a column holds more than `threshold`
+        addresses, the columns move to NumPy arrays (float64 unless `dtype` says
+        otherwise) indexed directly by the address id in `registry` (ADDRESSES by
+        default): a value costs 9 bytes and a column is read for all the addresses
+        at once. A ledger too sparse in the registry for that stays in dicts.
+        Columns are created by their first write.
+
+        Between begin and commit/rollback, the value of an address in a column is
+        saved the first time it is written, so rolling back only restores what
+        changed. A ledger doesn't move to arrays during a transaction.
+    """
+    __slots__ = ("registry", "threshold", "dtype", "dicts", "views", "values", "present", "capacity", "undo")
+
+    def __init__(self, dtype=np.float64, registry=None, threshold=4096) -> None:
+        self.registry = ADDRESSES if registry is None else registry
+        self.threshold = threshold
+        self.dtype = np.dtype(dtype)
+        self.dicts = {}         # column -> {address: value}, None once in arrays
+        self.views = {}         # column -> LedgerColumn
+        self.values = None      # column -> value by address id, once in arrays
+        self.present = None     # column -> whether the address has a value, by address id
+        self.capacity = 0
+        self.undo = None        # (column, address or id) -> saved value, during a transaction
+
+    def _dict(self, name):
+        column = self.dicts.get(name)
+        if column is None:
+            column = self.dicts[name] = {}
+        return column
+
+    def _arrays(self, name):
+        values = self.values.get(name)
+        if values is None:
+            values = self.values[name] = np.zeros(self.capacity, dtype=self.dtype)
+            self.present[name] = np.zeros(self.capacity, dtype=bool)
+        return values, self.present[name]
+
+    def _grow(self, minimum):
+        capacity = max(minimum, 2 * self.capacity, 16)
+        for columns in (self.values, self.present):
+            for name, old in columns.items():
+                new = columns[name] = np.zeros(capacity, dtype=old.dtype)
+                new[:self.capacity] = old
+        self.capacity = capacity
+
+    def _id(self, address):
+        """
+        Id of the address, registered and within the arrays
+        """
+        address_id = self.registry.id(address)
+        if address_id >= self.capacity:
+            self._grow(address_id + 1)
+        return address_id
+
+    def _ids(self):
+        """
+        Ids holding a value in any column, in order
+        """
+        if not self.present:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(np.logical_or.reduce(list(self.present.values())))
+
+    def _promote(self):
+        """
+        Moves the columns to arrays, unless the ledger is too sparse in the registry,
+        in which case it tries again at twice the size
+        """
+        addresses = self.addresses
+        if len(addresses) * DENSITY < len(self.registry):
+            self.threshold *= 2
+            return False
+
+        ids = self.registry.ids
+        dicts, self.dicts = self.dicts, None
+        self.values, self.present = {}, {}
+        self._grow(max(self.registry.id(address) for address in addresses) + 1)
+        for name, column in dicts.items():
+            values, present = self._arrays(name)
+            rows = np.fromiter((ids[address] for address in column), dtype=np.int64, count=len(column))
+            values[rows] = list(column.values())
+            present[rows] = True
+        for view in self.views.values():
+            view.data = None
+        return True
+
+    @property
+    def addresses(self):
+        """
+        Every address holding a value in any column
+        """
+        if self.dicts is not None:
+            return list(dict.fromkeys(chain.from_iterable(self.dicts.values())))
+        addresses = self.registry.addresses
+        return [addresses[address_id] for address_id in self._ids().tolist()]
+
+    def get(self, name, address, default=None):
+        if self.dicts is not None:
+            column = self.dicts.get(name)
+            return default if column is None else column.get(address, default)
+
+        address_id = self.registry.ids.get(address)
+        values = self.values.get(name)
+        if address_id is None or values is None or address_id >= self.capacity:
+            return default
+        value = values.item(address_id)
+        if value or self.present[name].item(address_id):
+            return value
+        return default
+
+    def set(self, name, address, value):
+        if self.dicts is not None:
+            column = self._dict(name)
+            if address not in column and len(column) >= self.threshold and self.undo is None and self._promote():
+                return self.set(name, address, value)
+            if self.undo is not None:
+                self._save(name, address)
+            column[address] = value
+            return
+
+        address_id = self._id(address)
+        if self.undo is not None:
+            self._save(name, address_id)
+        values, present = self._arrays(name)
+        values[address_id] = value
+        present[address_id] = True
+
+    def add(self, name, address, value):
+        """
+        Adds value to the address in a column, without going through a mapping
+        """
+        if self.dicts is not None:
+            column = self.dicts.get(name)
+            if column is not None and address in column:
+                undo = self.undo
+                if undo is not None and (name, address) not in undo:
+                    undo[name, address] = column[address]
+                column[address] += value
+                return
+        self.set(name, address, self.get(name, address, 0) + value)
+
+    def delete(self, name, address):
+        if self.get(name, address, _MISSING) is _MISSING:
+            raise KeyError(address)
+
+        if self.dicts is not None:
+            if self.undo is not None:
+                self._save(name, address)
+            del self.dicts[name][address]
+            return
+
+        address_id = self.registry.find(address)
+        if self.undo is not None:
+            self._save(name, address_id)
+        self.values[name][address_id] = 0
+        self.present[name][address_id] = False
+
+    def keys(self, name):
+        if self.dicts is not None:
+            return iter(self.dicts.get(name, ()))
+        present = self.present.get(name)
+        if present is None:
+            return iter(())
+        addresses = self.registry.addresses
+        return (addresses[address_id] for address_id in np.flatnonzero(present).tolist())
+
+    def count(self, name):
+        if self.dicts is not None:
+            return len(self.dicts.get(name, ()))
+        present = self.present.get(name)
+        return 0 if present is None else int(np.count_nonzero(present))
+
+    def clear(self, name):
+        if self.undo is not None:
+            for address in list(self.keys(name)):
+                self._save(name, address if self.dicts is not None else self.registry.find(address))
+
+        if self.dicts is not None:
+            self.dicts.get(name, {}).clear()
+        elif name in self.values:
+            self.values[name][:] = 0
+            self.present[name][:] = False
+
+    def gather(self, name, addresses):
+        """
+        Values of the addresses in a column as an array, 0 for the ones without
+        """
+        if self.dicts is not None:
+            column = self.dicts.get(name, {})
+            return np.array([column.get(address, 0) for address in addresses], dtype=self.dtype)
+
+        ids = self.registry.ids
+        address_ids = np.fromiter((ids.get(address, -1) for address in addresses), dtype=np.int64, count=len(addresses))
+        gathered = np.zeros(len(addresses), dtype=self.dtype)
+        values = self.values.get(name)
+        if values is not None:
+            known = (address_ids >= 0) & (address_ids < self.capacity)
+            gathered[known] = values[address_ids[known]]
+        return gathered
+
+    def scatter_add(self, name, addresses, values):
+        """
+        Adds values[i] to addresses[i] in a column, an address may repeat
+        """
+        if self.dicts is not None:
+            for address, value in zip(addresses, values.tolist() if isinstance(values, np.ndarray) else values):
+                self.add(name, address, value)
+            return
+
+        address_ids = np.fromiter((self._id(address) for address in addresses), dtype=np.int64, count=len(addresses))
+        if self.undo is not None:
+            for address_id in np.unique(address_ids).tolist():
+                self._save(name, address_id)
+        column, present = self._arrays(name)
+        np.add.at(column, address_ids, values)
+        present[address_ids] = True
+
+    def begin(self):
+        assert self.undo is None, "Ledger transaction already running"
+        self.undo = {}
+
+    def _save(self, name, key):
+        """
+        Saves the value of an address (an id once in arrays) before it is written
+        """
+        undo = self.undo
+        if (name, key) in undo:
+            return
+        if self.dicts is not None:
+            undo[name, key] = self.dicts.get(name, {}).get(key, _MISSING)
+        else:
+            values, present = self._arrays(name)
+            undo[name, key] = values[key] if present[key] else _MISSING
+
+    def commit(self):
+        self.undo = None
+
+    def rollback(self):
+        undo, self.undo = self.undo, None
+        for (name, key), value in undo.items():
+            if self.dicts is not None:
+                column = self._dict(name)
+                if value is _MISSING:
+                    column.pop(key, None)
+                else:
+                    column[key] = value
+            else:
+                values, present = self._arrays(name)
+                values[key] = 0 if value is _MISSING else value
+                present[key] = value is not _MISSING
+
+    def cast(self, dtype):
+        """
+        Converts the columns to dtype, e.g. to object to hold exact integers
+        """
+        self.dtype = np.dtype(dtype)
+        if self.values is not None:
+            for name, old in self.values.items():
+                self.values[name] = old.astype(self.dtype)
+
+    def lookup(self, addresses):
+        """
+        Positions of the addresses in self.addresses as an array, -1 for unknown ones
+        """
+        if self.dicts is not None:
+            positions = {address: position for position, address in enumerate(self.addresses)}
+            return np.fromiter(
+                (positions.get(address, -1) for address in addresses), dtype=np.int64, count=len(addresses)
+            )
+
+        ids = self._ids()
+        ledger_ids = self.registry.ids
+        address_ids = np.fromiter(
+            (ledger_ids.get(address, -1) for address in addresses), dtype=np.int64, count=len(addresses)
+        )
+        positions = np.minimum(np.searchsorted(ids, address_ids), max(len(ids) - 1, 0))
+        found = (address_ids >= 0) & (positions < len(ids))
+        found[found] &= ids[positions[found]] == address_ids[found]
+        return np.where(found, positions, -1)
+
+    def column(self, name):
+        """
+        Values of a column for every address of self.addresses, 0 for the ones without
+        """
+        if self.dicts is not None:
+            return self.gather(name, self.addresses)
+        ids = self._ids()
+        if name not in self.values:
+            return np.zeros(len(ids), dtype=self.dtype)
+        return self.values[name][ids]
+
+    def mapping(self, name):
+        view = self.views.get(name)
+        if view is None:
+            view = self.views[name] = LedgerColumn(self, name)
+        return view
+
+
+class LedgerColumn(MutableMapping):
+    """
+        dict-like view over one column of an ArrayLedger. While the ledger is in
+        dicts, reads go straight to the dict of the column.
+    """
+    __slots__ = ("ledger", "name", "data")
+
+    def __init__(self, ledger: ArrayLedger, name) -> None:
+        self.ledger = ledger
+        self.name = name
+        self.data = None if ledger.dicts is None else ledger._dict(name)
+
+    def __getitem__(self, address):
+        data = self.data
+        if data is not None:
+            return data[address]
+        value = self.ledger.get(self.name, address, _MISSING)
+        if value is _MISSING:
+            raise KeyError(address)
+        return value
+
+    def get(self, address, default=None):
+        data = self.data
+        if data is not None:
+            return data.get(address, default)
+        return self.ledger.get(self.name, address, default)
+
+    def __contains__(self, address):
+        data = self.data
+        if data is not None:
+            return address in data
+        return self.ledger.get(self.name, address, _MISSING) is not _MISSING
+
+    def __setitem__(self, address, value):
+        self.ledger.set(self.name, address, value)
+
+    def add(self, address, value):
+        self.ledger.add(self.name, address, value)
+
+    def __delitem__(self, address):
+        self.ledger.delete(self.name, address)
+
+    def clear(self):
+        self.ledger.clear(self.name)
+
+    def __iter__(self):
+        return self.ledger.keys(self.name)
+
+    def __len__(self):
+        return self.ledger.count(self.name)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
@@ -1,4 +1,12 @@
-import math
+import threading
+
+import numpy as np
+
+from clock import SystemClock
+from ledger import ArrayLedger
+from numeric import NUMERIC_MODES, IntegerMath
+from quote_cache import QuoteCache
+from sizing import amount_in_for_price_exact, amount_in_for_slippage_exact, amounts_in_for_price, amounts_in_for_slippage
 
 
 MINIMUM_LIQUIDITY = 10
@@ -7,81 +15,229 @@ MINIMUM_LIQUIDITY = 10
 class ERC20:
     """
     https://docs.uniswap.org/protocol/V1/guides/connect-to-uniswap#token-interface
+
+    `total` is what the pools hold of the token; the balance of every holder is
+    kept in an ArrayLedger, created when the first balance is written. The pools
+    move tokens with deposit and transfer without checking the holder's balance,
+    so a holder that was never minted tokens goes negative.
     """
+    __slots__ = ("name", "token_addr", "total_supply", "total", "dtype", "_ledger")
 
     def __init__(self, name: str, addr: str) -> None:
         self.name = name
         self.token_addr = addr
         self.total_supply = 1_000_000_000
         self.total = 0
+        self.dtype = np.float64     # of the balances, see cast
+        self._ledger = None
+
+    @property
+    def ledger(self):
+        ledger = self._ledger
+        if ledger is None:
+            ledger = self._ledger = ArrayLedger(dtype=self.dtype)
+        return ledger
+
+    @property
+    def balances(self):
+        return self.ledger.mapping("balances")
+
+    def cast(self, dtype):
+        """
+        Converts the balances to dtype, e.g. to object to hold exact integers
+        """
+        self.dtype = dtype
+        if self._ledger is not None:
+            self._ledger.cast(dtype)
 
     def deposit(self, _from, value):
         self.total += value
+        self.ledger.add("balances", _from, -value)
 
     def transfer(self, _to, value):
         self.total -= value
+        self.ledger.add("balances", _to, value)
+
+    def mint(self, _to, value):
+        self.ledger.add("balances", _to, value)
+
+    def balance_of(self, address):
+        if self._ledger is None:
+            return 0
+        return self._ledger.get("balances", address, 0)
+
+    def transfer_from(self, _from, _to, value):
+        assert value >= 0, 'ERC20: INVALID_AMOUNT'
+        assert self.balance_of(_from) >= value, 'ERC20: transfer amount exceeds balance'
+        self.ledger.add("balances", _from, -value)
+        self.ledger.add("balances", _to, value)
+
+    def batch_transfer(self, senders, recipients, values):
+        """
+        Applies many transfers at once. Either all of them are applied or, if a
+        sender can't pay the sum of its transfers out of its balance before the
+        batch (what it receives in the batch doesn't count), none is.
+        """
+        ledger = self.ledger
+        values = np.asarray(values, dtype=ledger.dtype)
+        assert len(senders) == len(recipients) == len(values), 'ERC20: LENGTH_MISMATCH'
+        assert (values >= 0).all(), 'ERC20: INVALID_AMOUNT'
+
+        payers = list(dict.fromkeys(senders))
+        index = {sender: position for position, sender in enumerate(payers)}
+        rows = np.fromiter((index[sender] for sender in senders), dtype=np.int64, count=len(values))
+        debits = np.zeros(len(payers), dtype=ledger.dtype)
+        np.add.at(debits, rows, values)
+        assert (debits <= ledger.gather("balances", payers)).all(), 'ERC20: transfer amount exceeds balance'
+
+        paying = np.flatnonzero(debits > 0)
+        ledger.scatter_add("balances", [payers[row] for row in paying.tolist()], -debits[paying])
+        ledger.scatter_add("balances", recipients, values)
+
+# per provider fee state, next to its liquidity, see Exchange._settle
+FEE_COLUMNS = ("fee_growth0", "fee_growth1", "fees0", "fees1")
+
+
+def liquidity_ledger(numeric):
+    """
+    Liquidity of every provider of a pool, a dict-like view keyed by address
+    """
+    return ArrayLedger(dtype=numeric.dtype).mapping("liquidity")
+
+
+def pair_key(token_a: str, token_b: str):
+    """
+    Canonical key of a pair, the same regardless of the order of the tokens
+    """
+    return (token_a, token_b) if token_a < token_b else (token_b, token_a)
 
 
 class Factory:
     """
         Create liquidity pools to a given pair.
         https://docs.uniswap.org/protocol/V1/guides/connect-to-uniswap
+
+        Pools are registered by the ordered pair of their token names and in
+        an adjacency list per token, so a token can be part of many pools and
+        every lookup is a single dict access.
+
+        `numeric` selects the pool math: "float" (default) or "integer" for
+        Uniswap V2 style integer amounts (see numeric.IntegerMath).
+        With a `journal` (see journal.Journal) every state-changing call on the
+        factory and its exchanges is appended to it.
+        `clock` timestamps reserve updates for the price accumulators, and every
+        callable in `listeners` is called with the exchange after each update
+        (see oracle.Oracle), one update at a time even when pools are traded from
+        several threads (see notify).
+        `kind` picks the pool type of create_exchange among POOL_KINDS, e.g.
+        "concentrated" once concentrated.py is imported.
+        `quote_cache_size` enables a shared LRU cache of quotes (see QuoteCache);
+        a quote costs less than a cache lookup, so it only pays off for callers
+        asking the same quotes many times between trades.
     """
 
-    def __init__(self, name: str, address: str) -> None:
+    def __init__(self, name: str, address: str, numeric="float", journal=None, quote_cache_size=0,
+                 clock=None) -> None:
         self.name = name
         self.address = address
-        self.token_to_exchange = {}
+        self.numeric = NUMERIC_MODES[numeric]
+        self.quote_cache = QuoteCache(quote_cache_size) if quote_cache_size else None
+        self.clock = clock or SystemClock()
+        self.listeners = []
+        self._notifying = threading.RLock()     # a listener may trade, and so notify again
+        self.token_to_exchange = {}     # token0 -> first pool listing it
         self.exchange_to_tokens = {}
-
-    def create_exchange(self, token0: ERC20, token1: ERC20, symbol: str):
-        if self.token_to_exchange.get(token0.name):
+        self.pairs = {}                 # pair_key -> exchange
+        self.token_to_pairs = {}        # token -> [exchange, ...]
+        self.all_pairs = []
+
+        self.journal = journal
+        if journal is not None:
+            journal.log_factory(self)
+
+    def create_exchange(self, token0: ERC20, token1: ERC20, symbol: str, kind="constant_product", **options):
+        assert token0.name != token1.name, 'UniswapV2: IDENTICAL_ADDRESSES'
+        key = pair_key(token0.name, token1.name)
+        if key in self.pairs:
             raise Exception("Exchange already created for token")
+        if kind not in POOL_KINDS:
+            raise Exception(f"Unknown pool kind {kind}")
+        assert kind == "constant_product" or self.journal is None, "Only constant product pools are journaled"
 
-        new_exchange = Exchange(
-            self,
-            token0.name,
-            token1.name,
-            f"{token0.name}/{token1.name}",
-            symbol
-        )
-        self.token_to_exchange[token0.name] = new_exchange
+        for token in (token0, token1):
+            token.cast(self.numeric.dtype)
+
+        name = f"{token0.name}/{token1.name}"
+        if kind == "constant_product":
+            new_exchange = self._new_exchange(token0.name, token1.name, name, symbol)
+        else:
+            new_exchange = POOL_KINDS[kind](self, token0.name, token1.name, name, symbol, **options)
+        self.pairs[key] = new_exchange
+        self.all_pairs.append(new_exchange)
+        self.token_to_exchange.setdefault(token0.name, new_exchange)
+        for token in (token0.name, token1.name):
+            self.token_to_pairs.setdefault(token, []).append(new_exchange)
         self.exchange_to_tokens[new_exchange.name] = {token0.name: token0, token1.name: token1}
+
+        if self.journal is not None:
+            self.journal.log_create_exchange(new_exchange, token0, token1)
         return new_exchange
 
+    def notify(self, exchange):
+        """
+        Calls the listeners with an updated exchange, serialized across threads
+        """
+        with self._notifying:
+            for listener in self.listeners:
+                listener(exchange)
+
+    def _new_exchange(self, token0_name, token1_name, name, symbol):
+        return Exchange(self, token0_name, token1_name, name, symbol)
+
     def get_exchange(self, token):
-        return self.token_to_exchange.get(token)
+        """
+        First pool listing the token, or else the first pool quoting against it
+        """
+        exchange = self.token_to_exchange.get(token)
+        if exchange is None and token in self.token_to_pairs:
+            exchange = self.token_to_pairs[token][0]
+        return exchange
+
+    def get_pair(self, token_a, token_b):
+        return self.pairs.get(pair_key(token_a, token_b))
+
+    def get_pairs(self, token):
+        """
+        All the pools holding the token
+        """
+        return iter(self.token_to_pairs.get(token, ()))
 
     def get_token(self, exchange):
-        return self.exchange_to_token.get(exchange)
+        return self.exchange_to_tokens.get(exchange)
 
     def token_count(self):
+        """
+        Tokens listed by a pool (its token0), as before pools were indexed by pair
+        """
         return len(self.token_to_exchange)
 
+    def distinct_token_count(self):
+        """
+        Tokens held by any pool, on either side
+        """
+        return len(self.token_to_pairs)
 
-class Exchange:
-    """
-        Exchanges is how uniswap calls the liquidity pools
-        https://docs.uniswap.org/protocol/V1/guides/connect-to-uniswap#exchange-interface
+    def pair_count(self):
+        return len(self.all_pairs)
 
-        Each exchange is associated with a single ERC20 token and hold a liquidity pool of ETH and the token.
-        - The algorithm used is the constant product automated market maker
-            - which works by maintaning the relationship token_1 * token_2 = invariant
-            - This invariant is held constant during trades
 
+class BaseExchange:
     """
-    def __init__(self, creator: Factory, token0_name: str, token1_name: str, name: str, symbol: str) -> None:
-        self.factory = creator
-        self.token0 = token0_name      # addresses or names. Actual tokens get stored in another place
-        self.token1 = token1_name      # addresses or names. Actual tokens get stored in another place
-        self.reserve0 = 0               # single storage slot
-        self.reserve1 = 0               # single storage slot
-        self.fee = 0
-
-        self.name = name
-        self.symbol = symbol
-        self.liquidity_providers = {}
-        self.total_supply = 0
+        What an exchange does, without its state: the attributes set in
+        Exchange.__init__ are stored by the subclass, in slots for Exchange and in
+        the columns of a PoolTable for pool_table.PoolView.
+    """
+    __slots__ = ()
 
     def info(self):
         print(f"Exchange {self.name} ({self.symbol})")
@@ -93,28 +249,96 @@ class Exchange:
     def doc(self):
         print(f"Funcionalidades disponíveis:\n- Adicionar liquidez\n- Remover liquidez\n- Trocar tokens\n")
 
+    def get_tokens(self):
+        """
+        The ERC20 tokens of the pool, by name
+        """
+        if self._batch is not None:
+            return self._batch
+        return self.factory.exchange_to_tokens[self.name]
+
+    def multicall(self, calls):
+        """
+        Runs (method, *args) calls on the pool as one transaction: either all of them
+        succeed, or the first error is raised and the pool, its tokens, their ledgers
+        and the journal are left as they were before the batch.
+
+        The tokens are resolved once for the whole batch. Instead of copying the
+        state up front, each ledger saves a row the first time the batch writes it,
+        so committing costs nothing and rolling back restores only what was touched.
+        Within the batch the calls only move the reserves: the prices accumulate,
+        the version moves and listeners are notified once, on commit.
+        """
+        assert self._batch is None, 'Multicall: REENTRANT'
+        for call in calls:
+            assert call[0] in MULTICALL_METHODS, f'Multicall: INVALID_METHOD {call[0]}'
+
+        tokens = self.get_tokens()
+        token0, token1 = tokens[self.token0], tokens[self.token1]
+        ledgers = (self.liquidity_providers.ledger, token0.ledger, token1.ledger)
+        # the accumulators and the timestamp only move on commit
+        state = (self.reserve0, self.reserve1, self.total_supply, self.fee_growth0, self.fee_growth1)
+        totals = (token0.total, token1.total)
+        journal = self.factory.journal
+        savepoint = journal.savepoint() if journal is not None else None
+        for ledger in ledgers:
+            ledger.begin()
+
+        self._batch = tokens
+        try:
+            results = [getattr(self, method)(*args) for method, *args in calls]
+        except BaseException:
+            self.reserve0, self.reserve1, self.total_supply, self.fee_growth0, self.fee_growth1 = state
+            self.version += 1           # quotes cached during the batch must not be served
+            token0.total, token1.total = totals
+            for ledger in ledgers:
+                ledger.rollback()
+            if journal is not None:
+                journal.rollback(savepoint)
+            raise
+        finally:
+            self._batch = None
+
+        for ledger in ledgers:
+            ledger.commit()
+        if journal is not None:
+            journal.release(savepoint)
+        self._commit(state)
+        return results
+
+    def _commit(self, checkpoint):
+        """
+        Ends a batch that only moved the reserves since checkpoint (see _checkpoint)
+        as a single update from the reserves of the checkpoint
+        """
+        reserve0, reserve1 = self.reserve0, self.reserve1
+        self.reserve0, self.reserve1 = checkpoint[:2]
+        self._update(reserve0, reserve1)
+
     def add_liquidity(self, _from, balance0, balance1, balance0Min, balance1Min):
         """
         You always need to add liquidity to both types of coins
         """
-        tokens = self.factory.exchange_to_tokens[self.name]
+        tokens = self.get_tokens()
         assert tokens.get(self.token0) and tokens.get(self.token1), "Error"
         amount0, amount1 = self._add_liquidity(balance0, balance1, balance0Min, balance1Min)
 
         tokens.get(self.token0).deposit(_from, amount0)
         tokens.get(self.token1).deposit(_from, amount1)
 
-        self.mint(_from, amount0, amount1)
+        self.mint(_from, amount0, amount1, log=False)
+
+        if self.factory.journal is not None:
+            self.factory.journal.log_add_liquidity(self, _from, balance0, balance1, balance0Min, balance1Min)
         return amount0, amount1
 
     def _add_liquidity(self, balance0, balance1, balance0Min, balance1Min):
         """
-        In practice, Uniswap applies a 0.30% fee to trades, which is added to
-        reserves. As a result, each trade actually increases k. This functions
-        as a payout to liquidity providers, for simplicity I have removed fee
-        related logic.
+        Uniswap applies a 0.30% fee to trades, which is added to reserves. As a
+        result, each trade actually increases k. This functions as a payout to
+        liquidity providers, see `fee`.
         """
-        tokens = self.factory.exchange_to_tokens[self.name]
+        tokens = self.get_tokens()
         assert tokens.get(self.token0) and tokens.get(self.token1), "Error"
 
         if self.reserve0 == 0 and self.reserve1 == 0:
@@ -136,7 +360,7 @@ class Exchange:
         return amount0, amount1
 
     def remove_liquidity(self, to, liquidity, amount0_min, amount1_min):
-        tokens = self.factory.exchange_to_tokens[self.name]
+        tokens = self.get_tokens()
         assert tokens.get(self.token0) and tokens.get(self.token1), "Error"
         assert self.liquidity_providers.get(to)
 
@@ -146,30 +370,130 @@ class Exchange:
         if liquidity >= total_liquidity:
             liquidity = total_liquidity
 
-        amount0 = liquidity * balance0 / self.total_supply      # using balances ensures pro-rata distribution
-        amount1 = liquidity * balance1 / self.total_supply      # using balances ensures pro-rata distribution
+        amount0 = self.numeric.div(liquidity * balance0, self.total_supply)      # using balances ensures pro-rata distribution
+        amount1 = self.numeric.div(liquidity * balance1, self.total_supply)      # using balances ensures pro-rata distribution
         assert amount0 > 0 and amount1 > 0, 'UniswapV2: INSUFFICIENT_LIQUIDITY_BURNED'
         assert amount0 >= amount0_min, 'UniswapV2Router: INSUFFICIENT_A_AMOUNT'
         assert amount1 >= amount1_min, 'UniswapV2Router: INSUFFICIENT_B_AMOUNT'
 
-        self.burn(to, liquidity, amount0, amount1)
+        self.burn(to, liquidity, amount0, amount1, log=False)
+
+        if self.factory.journal is not None:
+            self.factory.journal.log_remove_liquidity(self, to, liquidity, amount0_min, amount1_min)
         return amount0, amount1
 
     def swapExactTokensForTokens(self, amount0_in, amount1_out_min, to):
         amount1_out_expected = self.get_amount_out(amount0_in)
         assert amount1_out_expected >= amount1_out_min, 'UniswapV2Router: INSUFFICIENT_OUTPUT_AMOUNT'
 
-        tokens = self.factory.exchange_to_tokens[self.name]
+        tokens = self.get_tokens()
         tokens.get(self.token0).deposit(to, amount0_in)
 
-        self.swap(0, amount1_out_expected, to)
+        self.swap(0, amount1_out_expected, to, log=False)
 
+        if self.factory.journal is not None:
+            self.factory.journal.log_swap(self, to, amount0_in, amount1_out_min)
         return amount1_out_expected
 
-    def burn(self, to, liquidity, amount0, amount1):
+    def swapExactTokensForTokensBatch(self, amounts0_in, amounts1_out_min, to):
+        """
+        Executes a run of token0 -> token1 trades in a single vectorized pass.
+
+        After a run of swaps reserve0 is the cumulative sum of the inputs, and
+        each swap scales reserve1 by reserve0 / (reserve0 + gamma * amount_in),
+        so reserve1 is a cumulative product of these ratios. Without the fee the
+        product telescopes and reserve1 = k / reserve0 exactly.
+        A trade that misses its minimum output is rejected, just like
+        swapExactTokensForTokens would raise for it, and the trades after it
+        are recomputed from the reserves it left untouched.
+        In integer mode the rounding of every trade matters, so trades are
+        applied one after the other, still without touching the tokens.
+
+        Returns the output of every trade (0 for rejected ones), the mask of
+        accepted trades and the final reserves.
+        """
+        dtype = self.numeric.dtype
+        amounts0_in = np.asarray(amounts0_in, dtype=dtype)
+        amounts1_out_min = np.broadcast_to(np.asarray(amounts1_out_min, dtype=dtype), amounts0_in.shape)
+        assert self.reserve0 > 0 and self.reserve1 > 0, 'UniswapV2Library: INSUFFICIENT_LIQUIDITY'
+
+        tokens = self.get_tokens()
+        token0 = tokens.get(self.token0)
+        token1 = tokens.get(self.token1)
+        assert token0.token_addr != to, 'UniswapV2: INVALID_TO'
+        assert token1.token_addr != to, 'UniswapV2: INVALID_TO'
+
+        if self.numeric is IntegerMath:
+            amounts1_out, accepted, reserve0, reserve1 = self._swap_batch_sequential(amounts0_in, amounts1_out_min)
+        else:
+            amounts1_out, accepted, reserve0, reserve1 = self._swap_batch_closed_form(amounts0_in, amounts1_out_min)
+
+        if accepted.any():
+            if self.numeric is not IntegerMath:
+                self._accrue(sum(amounts0_in[accepted].tolist()), 0)
+            token0.deposit(to, reserve0 - self.reserve0)
+            token1.transfer(to, self.reserve1 - reserve1)
+            self._update(token0.total, token1.total)
+
+        if self.factory.journal is not None:
+            self.factory.journal.log_swap_batch(self, to, amounts0_in.tolist(), amounts1_out_min.tolist())
+        return amounts1_out, accepted, (self.reserve0, self.reserve1)
+
+    def _swap_batch_closed_form(self, amounts0_in, amounts1_out_min):
+        amounts1_out = np.zeros_like(amounts0_in)
+        accepted = amounts0_in > 0      # 'UniswapV2Library: INSUFFICIENT_INPUT_AMOUNT'
+        reserve0, reserve1 = self.reserve0, self.reserve1
+        gamma = self.gamma
+
+        start = 0
+        while start < amounts0_in.size:
+            inputs = np.where(accepted[start:], amounts0_in[start:], 0)
+            balances0 = reserve0 + np.cumsum(inputs)
+            if gamma == 1:
+                balances1 = (reserve0 * reserve1) / balances0
+            else:
+                previous = balances0 - inputs
+                balances1 = reserve1 * np.cumprod(previous / (previous + gamma * inputs))
+            outputs = np.concatenate(([reserve1], balances1[:-1])) - balances1
+
+            rejected = np.flatnonzero(accepted[start:] & (outputs < amounts1_out_min[start:]))
+            stop = rejected[0] if rejected.size else inputs.size
+            amounts1_out[start:start + stop] = np.where(accepted[start:start + stop], outputs[:stop], 0)
+            if stop > 0:
+                reserve0, reserve1 = float(balances0[stop - 1]), float(balances1[stop - 1])
+            if rejected.size:
+                accepted[start + stop] = False
+            start += stop + 1
+
+        return amounts1_out, accepted, reserve0, reserve1
+
+    def _swap_batch_sequential(self, amounts0_in, amounts1_out_min):
+        amounts1_out = np.zeros(amounts0_in.shape, dtype=object)
+        accepted = np.zeros(amounts0_in.shape, dtype=bool)
+        reserve0, reserve1 = self.reserve0, self.reserve1
+
+        for i, (amount0_in, amount1_out_min) in enumerate(zip(amounts0_in.tolist(), amounts1_out_min.tolist())):
+            if amount0_in <= 0:
+                continue
+            amount1_out = self.get_amount_out(amount0_in, reserve0, reserve1)
+            if amount1_out <= 0 or amount1_out < amount1_out_min:
+                continue
+
+            amounts1_out[i] = amount1_out
+            accepted[i] = True
+            reserve0 += amount0_in
+            reserve1 -= amount1_out
+            self._accrue(amount0_in, 0)     # trade by trade, rounding like swap does
+
+        return amounts1_out, accepted, reserve0, reserve1
+
+    def burn(self, to, liquidity, amount0, amount1, log=True):
+        """
+        Low level burn, journaled unless `log` is False (the caller journals the call that made it)
+        """
         self._burn(to, liquidity)
 
-        tokens = self.factory.exchange_to_tokens[self.name]
+        tokens = self.get_tokens()
         tokens.get(self.token0).transfer(to, amount0)
         tokens.get(self.token1).transfer(to, amount1)
 
@@ -177,14 +501,20 @@ class Exchange:
         balance1 = tokens.get(self.token1).total
 
         self._update(balance0, balance1)
+        if log and self.factory.journal is not None:
+            self.factory.journal.log_burn(self, to, liquidity, amount0, amount1)
 
     def _burn(self, to, value):
-        available_liquidity = self.liquidity_providers.get(to)
-        self.liquidity_providers[to] = available_liquidity - value
+        self._settle(to)
+        self.liquidity_providers.add(to, -value)
         self.total_supply -= value
 
-    def mint(self, to, _amount0, _amount1):
-        tokens = self.factory.exchange_to_tokens[self.name]
+    def mint(self, to, _amount0, _amount1, log=True):
+        """
+        Low level mint: the amounts must have been deposited to the tokens of the pool beforehand.
+        Journaled unless `log` is False, see burn.
+        """
+        tokens = self.get_tokens()
         assert tokens.get(self.token0) and tokens.get(self.token1), "Error"
 
         balance0 = tokens.get(self.token0).total
@@ -195,38 +525,61 @@ class Exchange:
         assert amount0 == _amount0
         assert amount1 == _amount1
 
-        self._update(balance0, balance1)
-
-        # keeping track of the liquidity providers
+        # keeping track of the liquidity providers, pro rata of the new balances
         if self.total_supply != 0:
             liquidity = min(
-                amount0 * self.total_supply / self.reserve0,
-                amount1 * self.total_supply / self.reserve1
+                self.numeric.div(amount0 * self.total_supply, balance0),
+                self.numeric.div(amount1 * self.total_supply, balance1)
             )
         else:
-            liquidity = math.sqrt(amount0 * amount1) - MINIMUM_LIQUIDITY
+            liquidity = self.numeric.sqrt(amount0 * amount1) - MINIMUM_LIQUIDITY
             self._mint("0", MINIMUM_LIQUIDITY)
 
         assert liquidity > 0, 'UniswapV2: INSUFFICIENT_LIQUIDITY_MINTED'
         self._mint(to, liquidity)
 
+        self._update(balance0, balance1)     # after minting, so listeners see the new total supply
+        if log and self.factory.journal is not None:
+            self.factory.journal.log_mint(self, to, _amount0, _amount1)
+
     def _update(self, balance0, balance1):
+        """
+        Like UniswapV2Pair._update, accumulates the prices (as floats, in both
+        numeric modes) of the reserves being replaced, weighted by how long they
+        were in place. During a multicall only the reserves move, see multicall.
+        """
+        if self._batch is not None:
+            self.reserve0 = balance0
+            self.reserve1 = balance1
+            return
+
+        now = self.factory.clock.time()
+        time_elapsed = now - self.block_timestamp_last
+        if time_elapsed > 0 and self.reserve0 and self.reserve1:
+            self.price0_cumulative_last += self.reserve1 / self.reserve0 * time_elapsed
+            self.price1_cumulative_last += self.reserve0 / self.reserve1 * time_elapsed
+
         self.reserve0 = balance0
         self.reserve1 = balance1
+        self.block_timestamp_last = now
+        self.version += 1
+        if self.factory.listeners:
+            self.factory.notify(self)
 
     def _mint(self, to, value):
-        if self.liquidity_providers.get(to):
-            self.liquidity_providers[to] += value
-        else:
-            self.liquidity_providers[to] = value
-
+        self._settle(to)
+        self.liquidity_providers.add(to, value)
         self.total_supply += value
 
-    def swap(self, amount0_out, amount1_out, to):
+    def swap(self, amount0_out, amount1_out, to, log=True):
+        """
+        Low level swap: the input must have been deposited to the tokens of the pool beforehand.
+        Journaled unless `log` is False, see burn.
+        """
         assert amount0_out > 0 or amount1_out > 0, 'UniswapV2: INSUFFICIENT_OUTPUT_AMOUNT'
         assert amount0_out < self.reserve0 and amount1_out < self.reserve1, 'UniswapV2: INSUFFICIENT_LIQUIDITY'
 
-        tokens = self.factory.exchange_to_tokens[self.name]
+        tokens = self.get_tokens()
         assert tokens.get(self.token0).token_addr != to, 'UniswapV2: INVALID_TO'
         assert tokens.get(self.token1).token_addr != to, 'UniswapV2: INVALID_TO'
 
@@ -237,18 +590,20 @@ class Exchange:
         amount1_in = balance1 - (self.reserve1 - amount1_out) if balance1 > self.reserve1 - amount1_out else 0
         assert amount0_in > 0 or amount1_in > 0, 'UniswapV2: INSUFFICIENT_INPUT_AMOUNT'
 
-        # disregarding trading fee here
-        # balance0_adjusted = balance0 * 1000 - amount0_in * 3  # trading fee
-        # balance1_adjusted = balance1 * 1000 - amount1_in * 3  # trading fee
+        balance0_adjusted = balance0 * 1000 - amount0_in * self.fee     # trading fee
+        balance1_adjusted = balance1 * 1000 - amount1_in * self.fee     # trading fee
+        assert self.numeric.k_holds(balance0_adjusted * balance1_adjusted, self.reserve0 * self.reserve1 * 1000**2), 'UniswapV2: K'
 
-        balance0_adjusted = balance0 * 1000
-        balance1_adjusted = balance1 * 1000
-        assert balance0_adjusted * balance1_adjusted == self.reserve0 * self.reserve1 * 1000**2, 'UniswapV2: K'
+        self._accrue(amount0_in, amount1_in)
 
-        tokens.get(self.token0).transfer(to, amount0_out)
-        tokens.get(self.token1).transfer(to, amount1_out)
+        if amount0_out:
+            tokens.get(self.token0).transfer(to, amount0_out)
+        if amount1_out:
+            tokens.get(self.token1).transfer(to, amount1_out)
 
         self._update(balance0, balance1)
+        if log and self.factory.journal is not None:
+            self.factory.journal.log_pair_swap(self, to, amount0_out, amount1_out, amount0_in, amount1_in)
 
     def quote(self, amount0, reserve0, reserve1):
         """
@@ -257,29 +612,279 @@ class Exchange:
         """
         assert amount0 > 0, 'UniswapV2Library: INSUFFICIENT_AMOUNT'
         assert reserve0 > 0 and reserve1 > 0, 'UniswapV2Library: INSUFFICIENT_LIQUIDITY'
-        return (amount0 * reserve1) / reserve0;
+        if self.factory.quote_cache is None:
+            return self._quote(amount0, reserve0, reserve1)
+        return self._cached("quote", amount0, reserve0, reserve1, self._quote)
+
+    def _quote(self, amount0, reserve0, reserve1):
+        return self.numeric.div(amount0 * reserve1, reserve0)
+
+    def _cached(self, kind, amount, reserve_in, reserve_out, compute):
+        """
+        Memoizes compute(amount, reserve_in, reserve_out) against the current
+        reserves of the pool; quotes against any other reserves, or during a
+        multicall (which moves the version on commit), are computed every time
+        """
+        if self._batch is not None:
+            return compute(amount, reserve_in, reserve_out)
+        cache = self.factory.quote_cache
+        reserve0, reserve1 = self.reserve0, self.reserve1
+        if reserve_in == reserve0 and reserve_out == reserve1:
+            key = (self, self.version, self.fee, kind, True, amount)
+        elif reserve_in == reserve1 and reserve_out == reserve0:
+            key = (self, self.version, self.fee, kind, False, amount)
+        else:
+            return compute(amount, reserve_in, reserve_out)
+
+        value = cache.get(key)
+        if value is None:
+            value = compute(amount, reserve_in, reserve_out)
+            cache.put(key, value)
+        return value
+
+    def set_fee(self, fee):
+        """
+        Sets the trading fee, in thousandths of the input; unlike assigning `fee`, it is journaled
+        """
+        assert 0 <= fee < 1000, 'UniswapV2: INVALID_FEE'
+        self.fee = fee
+        if self.factory.journal is not None:
+            self.factory.journal.log_set_fee(self, fee)
+
+    def _accrue(self, amount0_in, amount1_in):
+        """
+        Adds the fee taken from the inputs of a trade to the fee growth, O(1)
+        """
+        if not self.fee or not self.total_supply:
+            return
+        scale = self.numeric.growth_scale
+        if amount0_in:
+            self.fee_growth0 += self.numeric.div(amount0_in * self.fee * scale, 1000 * self.total_supply)
+        if amount1_in:
+            self.fee_growth1 += self.numeric.div(amount1_in * self.fee * scale, 1000 * self.total_supply)
+
+    def _settle(self, address):
+        """
+        Credits a provider with the fees of its liquidity since its last checkpoint,
+        which moves to the current fee growth. Until a fee is charged there is
+        nothing to credit, and the fee columns aren't even created.
+        """
+        if not self.fee_growth0 and not self.fee_growth1:
+            return
+        ledger = self.liquidity_providers.ledger
+        fees0, fees1 = self._owed(address)
+        ledger.set("fees0", address, fees0)
+        ledger.set("fees1", address, fees1)
+        ledger.set("fee_growth0", address, self.fee_growth0)
+        ledger.set("fee_growth1", address, self.fee_growth1)
+
+    def _owed(self, address):
+        """
+        Fees of a provider, settled or not
+        """
+        ledger = self.liquidity_providers.ledger
+        liquidity = ledger.get("liquidity", address, 0)
+        scale = self.numeric.growth_scale
+        return tuple(
+            ledger.get(fees, address, 0) + self.numeric.div(liquidity * (growth - ledger.get(checkpoint, address, 0)), scale)
+            for growth, checkpoint, fees in ((self.fee_growth0, "fee_growth0", "fees0"),
+                                             (self.fee_growth1, "fee_growth1", "fees1"))
+        )
+
+    def fees_earned(self, address):
+        """
+        Trading fees (amount of token0, amount of token1) earned by a provider so far
+        """
+        return self._owed(address)
+
+    def _checkpoint(self):
+        """
+        State a trade changes, for _rollback
+        """
+        return (
+            self.reserve0, self.reserve1, self.price0_cumulative_last, self.price1_cumulative_last,
+            self.block_timestamp_last, self.fee_growth0, self.fee_growth1,
+        )
+
+    def _rollback(self, checkpoint):
+        """
+        Puts the state back as it was at the checkpoint, as if the trades since never
+        happened: the accumulators don't advance and listeners aren't notified
+        """
+        (self.reserve0, self.reserve1, self.price0_cumulative_last, self.price1_cumulative_last,
+         self.block_timestamp_last, self.fee_growth0, self.fee_growth1) = checkpoint
+        self.version += 1           # quotes cached since the checkpoint must not be served
+
+    def get_reserves(self, token_in):
+        """
+        Returns the reserves ordered as (reserve_in, reserve_out) for a trade selling token_in
+        """
+        if token_in == self.token0:
+            return self.reserve0, self.reserve1
+        assert token_in == self.token1, 'UniswapV2Library: INVALID_PATH'
+        return self.reserve1, self.reserve0
 
-    def get_amount_out(self, amount_in):
+    def get_amount_out(self, amount_in, reserve_in=None, reserve_out=None):
         """
         Given an input amount of an asset and pair reserves, returns the maximum output amount of the
-        other asset
+        other asset. Reserves default to the token0 -> token1 direction.
 
         (reserve0 + amount_in_with_fee) * (reserve1 - amount_out) = reserve1 * reserve0
         """
+        if reserve_in is None:
+            reserve_in, reserve_out = self.reserve0, self.reserve1
+
         assert amount_in > 0, 'UniswapV2Library: INSUFFICIENT_INPUT_AMOUNT'
-        assert self.reserve0 > 0 and self.reserve1 > 0, 'UniswapV2Library: INSUFFICIENT_LIQUIDITY'
+        assert reserve_in > 0 and reserve_out > 0, 'UniswapV2Library: INSUFFICIENT_LIQUIDITY'
+        if self.factory.quote_cache is not None:
+            return self._cached("out", amount_in, reserve_in, reserve_out, self._get_amount_out)
 
-        amount_in_with_fee = amount_in * 1000              # disconsidering the fee here: amount_in * 997
-        numerator = amount_in_with_fee * self.reserve1
-        denominator = self.reserve0 * 1000 + amount_in_with_fee
-        amount_out = numerator / denominator
+        amount_in_with_fee = amount_in * (1000 - self.fee)
+        return self.numeric.div(amount_in_with_fee * reserve_out, reserve_in * 1000 + amount_in_with_fee)
+
+    def _get_amount_out(self, amount_in, reserve_in, reserve_out):
+        amount_in_with_fee = amount_in * (1000 - self.fee)
+        numerator = amount_in_with_fee * reserve_out
+        denominator = reserve_in * 1000 + amount_in_with_fee
+        amount_out = self.numeric.div(numerator, denominator)
 
         return amount_out
 
+    def get_amount_in(self, amount_out, reserve_in=None, reserve_out=None):
+        """
+        Given an output amount of an asset and pair reserves, returns the required input amount of the
+        other asset. Rounds up in integer mode.
+        """
+        if reserve_in is None:
+            reserve_in, reserve_out = self.reserve0, self.reserve1
+
+        assert amount_out > 0, 'UniswapV2Library: INSUFFICIENT_OUTPUT_AMOUNT'
+        assert reserve_in > 0 and reserve_out > amount_out, 'UniswapV2Library: INSUFFICIENT_LIQUIDITY'
+
+        numerator = reserve_in * amount_out * 1000
+        denominator = (reserve_out - amount_out) * (1000 - self.fee)
+        return self.numeric.div_up(numerator, denominator)
+
+    @property
+    def gamma(self):
+        """
+        Share of the input left after the fee, the fee being in thousandths
+        """
+        return (1000 - self.fee) / 1000
+
+    def get_amount_in_for_price(self, target_price, zero_for_one=True):
+        """
+        Input that moves the spot price (output token per input token) of the pool
+        down to target_price, 0 if it already is at or below it. Solved exactly and
+        rounded down in integer mode, so the price stays at or above the target.
+        """
+        assert target_price > 0, 'UniswapV2Library: INVALID_PRICE'
+        reserve_in, reserve_out = self.get_reserves(self.token0 if zero_for_one else self.token1)
+        assert reserve_in > 0 and reserve_out > 0, 'UniswapV2Library: INSUFFICIENT_LIQUIDITY'
+        if self.numeric is IntegerMath:
+            return amount_in_for_price_exact(reserve_in, reserve_out, target_price, self.fee)
+        return float(amounts_in_for_price(reserve_in, reserve_out, target_price, self.gamma))
+
+    def get_amount_in_for_slippage(self, max_slippage, zero_for_one=True):
+        """
+        Largest input whose price impact, as in price_impact, stays within max_slippage.
+        In integer mode the output is rounded down, as price_impact does.
+        """
+        reserve_in, reserve_out = self.get_reserves(self.token0 if zero_for_one else self.token1)
+        assert reserve_in > 0 and reserve_out > 0, 'UniswapV2Library: INSUFFICIENT_LIQUIDITY'
+        if self.numeric is IntegerMath:
+            return amount_in_for_slippage_exact(reserve_in, reserve_out, max_slippage, self.fee)
+        return float(amounts_in_for_slippage(reserve_in, max_slippage, self.gamma))
+
+    def price_impact(self, amounts_in, zero_for_one=True):
+        """
+        Quotes an array of input sizes against the current reserves without
+        touching the pool state (token0 -> token1 unless zero_for_one is False).
+
+        Returns the output amounts, the effective price (output per unit of input)
+        and the price impact of each size relative to the spot price after the fee.
+        """
+        reserve_in, reserve_out = self.reserve0, self.reserve1
+        if not zero_for_one:
+            reserve_in, reserve_out = reserve_out, reserve_in
+
+        amounts_in = np.asarray(amounts_in, dtype=self.numeric.dtype)
+        assert (amounts_in > 0).all(), 'UniswapV2Library: INSUFFICIENT_INPUT_AMOUNT'
+        assert reserve_in > 0 and reserve_out > 0, 'UniswapV2Library: INSUFFICIENT_LIQUIDITY'
+
+        amounts_in_with_fee = amounts_in * (1000 - self.fee)
+        amounts_out = self.numeric.div(amounts_in_with_fee * reserve_out, reserve_in * 1000 + amounts_in_with_fee)
+        effective_prices = (amounts_out / amounts_in).astype(np.float64)
+        price_impacts = 1 - effective_prices / (self.gamma * reserve_out / reserve_in)
+        return amounts_out, effective_prices, price_impacts
+
     def simulate_transaction(self, amount_t0):
         result = self.get_amount_out(amount_t0)
         print(f"{amount_t0} {self.token0} recebe {round(result, 2)} {self.token1}")
 
+
+class Exchange(BaseExchange):
+    """
+        Exchanges is how uniswap calls the liquidity pools
+        https://docs.uniswap.org/protocol/V1/guides/connect-to-uniswap#exchange-interface
+
+        Each exchange is associated with a single ERC20 token and hold a liquidity pool of ETH and the token.
+        - The algorithm used is the constant product automated market maker
+            - which works by maintaning the relationship token_1 * token_2 = invariant
+            - This invariant is held constant during trades
+
+        `fee` is the trading fee in thousandths of the input (3 for Uniswap's 0.30%),
+        0 by default. It stays in the reserves, so it is paid out to the liquidity
+        providers when they burn. What each provider earned is tracked lazily:
+        every swap adds the fee per unit of liquidity to fee_growth0/1, in O(1)
+        however many providers the pool has, and a provider is only settled, from
+        the growth since its last checkpoint, when it mints, burns or calls fees_earned.
+    """
+    __slots__ = (
+        "factory", "token0", "token1", "reserve0", "reserve1", "fee",
+        "name", "symbol", "_liquidity_providers", "total_supply", "numeric", "version",
+        "price0_cumulative_last", "price1_cumulative_last", "block_timestamp_last", "_batch",
+        "fee_growth0", "fee_growth1",
+    )
+
+    def __init__(self, creator: Factory, token0_name: str, token1_name: str, name: str, symbol: str) -> None:
+        self.factory = creator
+        self.token0 = token0_name      # addresses or names. Actual tokens get stored in another place
+        self.token1 = token1_name      # addresses or names. Actual tokens get stored in another place
+        self.reserve0 = 0               # single storage slot
+        self.reserve1 = 0               # single storage slot
+        self.fee = 0
+        self.numeric = creator.numeric
+        self.version = 0                # bumped on every change of the reserves, see quote cache
+        self.price0_cumulative_last = 0
+        self.price1_cumulative_last = 0
+        self.block_timestamp_last = 0
+        self._batch = None              # tokens of the running multicall, see multicall
+        self.fee_growth0 = 0            # fees per unit of liquidity, scaled by numeric.growth_scale
+        self.fee_growth1 = 0
+
+        self.name = name
+        self.symbol = symbol
+        self._liquidity_providers = None
+        self.total_supply = 0
+
+    @property
+    def liquidity_providers(self):
+        liquidity_providers = self._liquidity_providers
+        if liquidity_providers is None:
+            liquidity_providers = self._liquidity_providers = liquidity_ledger(self.numeric)
+        return liquidity_providers
+
+
+# methods Exchange.multicall accepts
+MULTICALL_METHODS = frozenset((
+    "add_liquidity", "remove_liquidity", "swapExactTokensForTokens", "swapExactTokensForTokensBatch",
+    "swap", "mint", "burn",
+))
+
+# pool types Factory.create_exchange can build, by kind
+POOL_KINDS = {"constant_product": Exchange}
+
 """
 # References
 - Uniswap is made up of a series of ETH-ERC20 exchange contracts. There is exactly one exchange contract per ERC20 token. If a token does not yet have an exchange it can be created by anyone using the Uniswap factory contract. The factory serves as a public registry and is used to look up all token and exchange addresses added to the system.
@@ -309,3 +914,4 @@ https://ethereum.org/en/developers/tutorials/uniswap-v2-annotated-code/#add-liqu
 https://jeiwan.net/posts/programming-defi-uniswapv2-1/
 https://docs.uniswap.org/protocol/V2/concepts/protocol-overview/ecosystem-participants
 """
+
@@ -0,0 +1,77 @@
+import math
+from decimal import Decimal
+
+
+WAD = 10**18
+
+
+def to_wei(amount) -> int:
+    """
+    Converts a token amount to integer units of 10**-18 tokens
+    """
+    return int(Decimal(str(amount)) * WAD)
+
+
+def from_wei(amount: int) -> float:
+    return amount / WAD
+
+
+class FloatMath:
+    """
+        Default pool math: float division and sqrt. Results depend on the
+        order of the operations and drift with rounding.
+    """
+    name = "float"
+    dtype = float
+    growth_scale = 1    # fixed point one of per-liquidity accumulators, see Exchange.fee_growth0
+
+    @staticmethod
+    def div(a, b):
+        return a / b
+
+    @staticmethod
+    def div_up(a, b):
+        return a / b
+
+    @staticmethod
+    def sqrt(a):
+        return math.sqrt(a)
+
+    k_tolerance = 1e-12     # relative rounding error the K check lets through
+
+    @staticmethod
+    def k_holds(k_after, k_before):
+        return k_after >= k_before * (1 - FloatMath.k_tolerance)
+
+
+class IntegerMath:
+    """
+        Uniswap V2 pool math on integer amounts (wei-style, see to_wei).
+
+        Divisions round down, except when computing what a trader has to pay
+        (get_amount_in), which rounds up, so the pool never loses to rounding
+        and the invariant can only grow. Results are bit-reproducible.
+        https://github.dev/Uniswap/v2-core/blob/master/contracts/UniswapV2Pair.sol
+    """
+    name = "integer"
+    dtype = object      # arbitrary precision ints in NumPy arrays
+    growth_scale = 2**128   # Q128, like feeGrowthGlobal in Uniswap V3
+
+    @staticmethod
+    def div(a, b):
+        return a // b
+
+    @staticmethod
+    def div_up(a, b):
+        return -(-a // b)
+
+    @staticmethod
+    def sqrt(a):
+        return math.isqrt(a)
+
+    @staticmethod
+    def k_holds(k_after, k_before):
+        return k_after >= k_before
+
+
+NUMERIC_MODES = {FloatMath.name: FloatMath, IntegerMath.name: IntegerMath}
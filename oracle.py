@@ -0,0 +1,112 @@
+import numpy as np
+
+from lp import Exchange, Factory
+
+
+class Observations:
+    """
+        Fixed-capacity ring buffer of (timestamp, price0 cumulative, price1 cumulative)
+        of a pool, oldest first when read in logical order
+    """
+
+    def __init__(self, capacity) -> None:
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.price0_cumulative = np.zeros(capacity, dtype=np.float64)
+        self.price1_cumulative = np.zeros(capacity, dtype=np.float64)
+        self.capacity = capacity
+        self.start = 0      # slot of the oldest observation
+        self.count = 0
+
+    def _slot(self, index):
+        return (self.start + index) % self.capacity
+
+    def write(self, timestamp, price0_cumulative, price1_cumulative):
+        if self.count and self.timestamps[self._slot(self.count - 1)] == timestamp:
+            slot = self._slot(self.count - 1)       # one observation per timestamp, the last one wins
+        elif self.count < self.capacity:
+            slot = self._slot(self.count)
+            self.count += 1
+        else:
+            slot = self.start
+            self.start = self._slot(1)
+
+        self.timestamps[slot] = timestamp
+        self.price0_cumulative[slot] = price0_cumulative
+        self.price1_cumulative[slot] = price1_cumulative
+
+    def at_or_before(self, timestamp):
+        """
+        Logical index of the last observation not after timestamp, -1 if there is none
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamps[self._slot(middle)] <= timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low - 1
+
+    def get(self, index):
+        slot = self._slot(index)
+        return float(self.timestamps[slot]), float(self.price0_cumulative[slot]), float(self.price1_cumulative[slot])
+
+
+class Oracle:
+    """
+        Time-weighted average prices of the pools of a factory, like the Uniswap V3
+        oracle: after every reserve update the pool's cumulative prices are written
+        to its ring buffer of `capacity` observations, and consult finds the ends
+        of a window with a binary search, interpolating between observations.
+        Memory is constant per pool and windows are limited to what the buffer covers.
+    """
+
+    def __init__(self, factory: Factory, capacity=1024) -> None:
+        self.factory = factory
+        self.capacity = capacity
+        self.observations = {}      # pool name -> Observations
+        factory.listeners.append(self.observe)
+
+    def observe(self, exchange: Exchange):
+        observations = self.observations.get(exchange.name)
+        if observations is None:
+            observations = self.observations[exchange.name] = Observations(self.capacity)
+        observations.write(
+            exchange.block_timestamp_last, exchange.price0_cumulative_last, exchange.price1_cumulative_last
+        )
+
+    def _cumulatives(self, exchange, observations, timestamp):
+        index = observations.at_or_before(timestamp)
+        assert index >= 0, 'Oracle: OLD'
+        observed_at, price0_cumulative, price1_cumulative = observations.get(index)
+        if observed_at == timestamp:
+            return price0_cumulative, price1_cumulative
+
+        if index + 1 < observations.count:
+            next_at, next0, next1 = observations.get(index + 1)
+            weight = (timestamp - observed_at) / (next_at - observed_at)
+            return (
+                price0_cumulative + (next0 - price0_cumulative) * weight,
+                price1_cumulative + (next1 - price1_cumulative) * weight,
+            )
+
+        # after the last observation the reserves haven't changed
+        elapsed = timestamp - observed_at
+        if exchange.reserve0 and exchange.reserve1:
+            price0_cumulative += exchange.reserve1 / exchange.reserve0 * elapsed
+            price1_cumulative += exchange.reserve0 / exchange.reserve1 * elapsed
+        return price0_cumulative, price1_cumulative
+
+    def consult(self, pool: Exchange, window):
+        """
+        Time-weighted average (price0, price1) of the pool over the last `window` seconds,
+        price0 being token1 per token0
+        """
+        assert window > 0, 'Oracle: INVALID_WINDOW'
+        observations = self.observations.get(pool.name)
+        assert observations is not None, 'Oracle: OLD'
+
+        now = self.factory.clock.time()
+        end0, end1 = self._cumulatives(pool, observations, now)
+        start0, start1 = self._cumulatives(pool, observations, now - window)
+        return (end0 - start0) / window, (end1 - start1) / window
@@ -0,0 +1,266 @@
+import numpy as np
+
+from lp import BaseExchange, Factory, liquidity_ledger
+from sizing import amounts_in_for_price, amounts_in_for_slippage
+
+
+class PoolTable:
+    """
+        Struct-of-arrays storage for the state of many pools.
+
+        Reserves, total supply, fee, oracle and fee accumulators of every pool live
+        in contiguous float64 columns indexed by pool id, token names are interned
+        into int32 ids and the liquidity providers table of a pool is only created
+        when it is touched. Columns grow geometrically, so appending a pool is
+        amortized O(1).
+    """
+    # column -> dtype
+    COLUMNS = {
+        "reserve0": np.float64, "reserve1": np.float64, "total_supply": np.float64, "fee": np.float64,
+        "token0": np.int32, "token1": np.int32, "version": np.int64,
+        "price0_cumulative_last": np.float64, "price1_cumulative_last": np.float64,
+        "block_timestamp_last": np.float64, "fee_growth0": np.float64, "fee_growth1": np.float64,
+    }
+
+    def __init__(self, factory: Factory, capacity=1024) -> None:
+        self.factory = factory
+        self.size = 0
+        for column, dtype in self.COLUMNS.items():
+            setattr(self, column, np.zeros(capacity, dtype=dtype))
+
+        self.tokens = []            # token id -> token name
+        self.token_ids = {}         # token name -> token id
+        self.names = []
+        self.symbols = []
+        self.liquidity_providers = {}   # pool id -> liquidity ledger view
+        self.batches = {}               # pool id -> tokens of its running multicall
+
+    def _grow(self):
+        capacity = max(2 * len(self.reserve0), 1)
+        for column in self.COLUMNS:
+            old = getattr(self, column)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, column, new)
+
+    def token_id(self, token):
+        token_id = self.token_ids.get(token)
+        if token_id is None:
+            token_id = self.token_ids[token] = len(self.tokens)
+            self.tokens.append(token)
+        return token_id
+
+    def append(self, token0_name, token1_name, name, symbol):
+        if self.size == len(self.reserve0):
+            self._grow()
+
+        pool_id = self.size
+        self.token0[pool_id] = self.token_id(token0_name)
+        self.token1[pool_id] = self.token_id(token1_name)
+        self.names.append(name)
+        self.symbols.append(symbol)
+        self.size += 1
+        return pool_id
+
+    def get_tokens(self, pool_id):
+        return self.factory.exchange_to_tokens[self.names[pool_id]]
+
+    def providers(self, pool_id):
+        providers = self.liquidity_providers.get(pool_id)
+        if providers is None:
+            providers = self.liquidity_providers[pool_id] = liquidity_ledger(self.factory.numeric)
+            self._load_providers(pool_id, providers)
+        return providers
+
+    def _load_providers(self, pool_id, providers):
+        """
+        Fills the liquidity ledger of a pool when it is first touched
+        """
+
+    def spot_prices(self):
+        """
+        Price of token0 in token1 for every pool (nan for empty pools)
+        """
+        reserve0 = self.reserve0[:self.size]
+        reserve1 = self.reserve1[:self.size]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(reserve0 > 0, reserve1 / reserve0, np.nan)
+
+    def _reserves(self, zero_for_one):
+        reserve0 = self.reserve0[:self.size]
+        reserve1 = self.reserve1[:self.size]
+        return (reserve0, reserve1) if zero_for_one else (reserve1, reserve0)
+
+    def amounts_in_for_price(self, target_prices, zero_for_one=True):
+        """
+        Input that moves every pool to its target price (see sizing.amounts_in_for_price)
+        """
+        reserve_in, reserve_out = self._reserves(zero_for_one)
+        gammas = (1000 - self.fee[:self.size]) / 1000
+        return amounts_in_for_price(reserve_in, reserve_out, target_prices, gammas)
+
+    def amounts_in_for_slippage(self, max_slippages, zero_for_one=True):
+        reserve_in, _ = self._reserves(zero_for_one)
+        gammas = (1000 - self.fee[:self.size]) / 1000
+        return amounts_in_for_slippage(reserve_in, max_slippages, gammas)
+
+    def total_value_locked(self):
+        """
+        Sum of the reserves of each token across all pools
+        """
+        n_tokens = len(self.tokens)
+        totals = np.bincount(self.token0[:self.size], weights=self.reserve0[:self.size], minlength=n_tokens)
+        totals += np.bincount(self.token1[:self.size], weights=self.reserve1[:self.size], minlength=n_tokens)
+        return dict(zip(self.tokens, totals.tolist()))
+
+
+class PoolView(BaseExchange):
+    """
+        Exchange backed by a row of a PoolTable. It only holds the table and the
+        pool id, every attribute of the pool is read from and written to the columns.
+    """
+    __slots__ = ("table", "pool_id")
+
+    def __init__(self, table: PoolTable, pool_id: int) -> None:
+        self.table = table
+        self.pool_id = pool_id
+
+    @property
+    def factory(self):
+        return self.table.factory
+
+    @property
+    def token0(self):
+        return self.table.tokens[self.table.token0[self.pool_id]]
+
+    @property
+    def token1(self):
+        return self.table.tokens[self.table.token1[self.pool_id]]
+
+    @property
+    def name(self):
+        return self.table.names[self.pool_id]
+
+    @property
+    def symbol(self):
+        return self.table.symbols[self.pool_id]
+
+    @property
+    def reserve0(self):
+        return float(self.table.reserve0[self.pool_id])
+
+    @reserve0.setter
+    def reserve0(self, value):
+        self.table.reserve0[self.pool_id] = value
+
+    @property
+    def reserve1(self):
+        return float(self.table.reserve1[self.pool_id])
+
+    @reserve1.setter
+    def reserve1(self, value):
+        self.table.reserve1[self.pool_id] = value
+
+    @property
+    def total_supply(self):
+        return float(self.table.total_supply[self.pool_id])
+
+    @total_supply.setter
+    def total_supply(self, value):
+        self.table.total_supply[self.pool_id] = value
+
+    @property
+    def fee(self):
+        return float(self.table.fee[self.pool_id])
+
+    @fee.setter
+    def fee(self, value):
+        self.table.fee[self.pool_id] = value
+
+    @property
+    def version(self):
+        return int(self.table.version[self.pool_id])
+
+    @version.setter
+    def version(self, value):
+        self.table.version[self.pool_id] = value
+
+    @property
+    def price0_cumulative_last(self):
+        return float(self.table.price0_cumulative_last[self.pool_id])
+
+    @price0_cumulative_last.setter
+    def price0_cumulative_last(self, value):
+        self.table.price0_cumulative_last[self.pool_id] = value
+
+    @property
+    def price1_cumulative_last(self):
+        return float(self.table.price1_cumulative_last[self.pool_id])
+
+    @price1_cumulative_last.setter
+    def price1_cumulative_last(self, value):
+        self.table.price1_cumulative_last[self.pool_id] = value
+
+    @property
+    def block_timestamp_last(self):
+        return float(self.table.block_timestamp_last[self.pool_id])
+
+    @block_timestamp_last.setter
+    def block_timestamp_last(self, value):
+        self.table.block_timestamp_last[self.pool_id] = value
+
+    @property
+    def fee_growth0(self):
+        return float(self.table.fee_growth0[self.pool_id])
+
+    @fee_growth0.setter
+    def fee_growth0(self, value):
+        self.table.fee_growth0[self.pool_id] = value
+
+    @property
+    def fee_growth1(self):
+        return float(self.table.fee_growth1[self.pool_id])
+
+    @fee_growth1.setter
+    def fee_growth1(self, value):
+        self.table.fee_growth1[self.pool_id] = value
+
+    @property
+    def _batch(self):
+        return self.table.batches.get(self.pool_id)
+
+    @_batch.setter
+    def _batch(self, tokens):
+        if tokens is None:
+            self.table.batches.pop(self.pool_id, None)
+        else:
+            self.table.batches[self.pool_id] = tokens
+
+    @property
+    def numeric(self):
+        return self.table.factory.numeric
+
+    @property
+    def liquidity_providers(self):
+        return self.table.providers(self.pool_id)
+
+    def get_tokens(self):
+        tokens = self.table.batches.get(self.pool_id)
+        if tokens is not None:
+            return tokens
+        return self.table.get_tokens(self.pool_id)
+
+
+class TableFactory(Factory):
+    """
+        Factory keeping the state of its pools in a PoolTable. The columns are
+        float64, so only the float numeric mode is supported.
+    """
+
+    def __init__(self, name: str, address: str, numeric="float", journal=None, capacity=1024, clock=None) -> None:
+        assert numeric == "float", "TableFactory only supports float pools"
+        self.pool_table = PoolTable(self, capacity)
+        super().__init__(name, address, numeric, journal, clock=clock)
+
+    def _new_exchange(self, token0_name, token1_name, name, symbol):
+        return PoolView(self.pool_table, self.pool_table.append(token0_name, token1_name, name, symbol))
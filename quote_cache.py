@@ -0,0 +1,51 @@
+import threading
+from collections import OrderedDict
+
+
+class QuoteCache:
+    """
+        Bounded LRU cache of pool quotes.
+
+        Keys carry the reserve version of the pool (see Exchange._update), so an
+        entry can only be hit while the reserves it was computed from are current;
+        entries of older versions are never served and age out of the cache.
+        The cache can be shared by threads trading different pools, see
+        sharding.ShardedExecutor.
+    """
+
+    def __init__(self, maxsize=4096) -> None:
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self.entries[key]
+                self.entries.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        entries = self.entries
+        with self._lock:
+            entries[key] = value
+            if len(entries) > self.maxsize:
+                entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self.entries), "maxsize": self.maxsize,
+            "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+        }
@@ -0,0 +1,207 @@
+import json
+import math
+import time
+from collections import Counter
+from itertools import groupby, islice
+
+from lp import ERC20, Factory
+
+
+class ReplayReport:
+    """
+        Outcome of a replay: throughput, rejected operations by assertion message
+        (only the first `max_samples` are kept with their line number, so memory
+        does not grow with the feed) and the final state of every pool.
+    """
+
+    def __init__(self, max_samples=100) -> None:
+        self.operations = 0
+        self.rejects = Counter()
+        self.samples = []
+        self.max_samples = max_samples
+        self.elapsed = 0
+        self.pools = {}
+
+    def reject(self, line, message):
+        self.rejects[message] += 1
+        if len(self.samples) < self.max_samples:
+            self.samples.append((line, message))
+
+    @property
+    def throughput(self):
+        return self.operations / self.elapsed if self.elapsed else 0
+
+    def info(self):
+        print(f"Operações: {self.operations} ({self.throughput:.0f} op/s)")
+        print(f"Rejeitadas: {sum(self.rejects.values())}")
+        for message, count in self.rejects.most_common():
+            print(f"- {message}: {count}")
+
+
+# fields every operation of a feed needs
+FIELDS = {
+    "create_exchange": ("token0", "token0_addr", "token1", "token1_addr", "symbol"),
+    "add_liquidity": ("pool", "from", "amount0", "amount1", "amount0_min", "amount1_min"),
+    "remove_liquidity": ("pool", "to", "liquidity", "amount0_min", "amount1_min"),
+    "swap": ("pool", "to", "amount_in", "amount_out_min"),
+}
+
+# fields holding an amount, which must be a finite number
+AMOUNTS = {"amount0", "amount1", "amount0_min", "amount1_min", "liquidity", "amount_in", "amount_out_min"}
+
+
+def _is_amount(value):
+    if isinstance(value, float):
+        return math.isfinite(value)
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def malformed(record):
+    """
+    Why the record cannot be applied, None if it has an operation and all its
+    fields, with numbers for the amounts
+    """
+    if not isinstance(record, dict):
+        return "Malformed record"
+    if "op" not in record:
+        return "Missing field op"
+    if record["op"] not in FIELDS:
+        return f"Unknown operation {record['op']}"
+    for field in FIELDS[record["op"]]:
+        if field not in record:
+            return f"Missing field {field}"
+        if field in AMOUNTS and not _is_amount(record[field]):
+            return f"Invalid field {field}"
+    return None
+
+
+def _parse(text):
+    """
+    The record of a line, None (a malformed record) if it isn't JSON
+    """
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+
+def read_chunks(path, chunk_size=10_000):
+    """
+    Streams a JSONL feed as lists of (line number, record), `chunk_size` records at a time
+    """
+    with open(path) as feed:
+        records = ((line, _parse(text)) for line, text in enumerate(feed, 1) if text.strip())
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+def _pool(item):
+    _, record = item
+    return record.get("pool") if isinstance(record, dict) else None
+
+
+class Replayer:
+    """
+        Applies a feed of operations to the pools of a factory.
+
+        Each line of the feed is a JSON object with an `op` and its arguments:
+        - {"op": "create_exchange", "token0": ..., "token0_addr": ..., "token1": ..., "token1_addr": ..., "symbol": ...}
+        - {"op": "add_liquidity", "pool": "A/B", "from": ..., "amount0": ..., "amount1": ..., "amount0_min": ..., "amount1_min": ...}
+        - {"op": "remove_liquidity", "pool": "A/B", "to": ..., "liquidity": ..., "amount0_min": ..., "amount1_min": ...}
+        - {"op": "swap", "pool": "A/B", "to": ..., "amount_in": ..., "amount_out_min": ...}
+
+        Consecutive operations on the same pool are dispatched together, and a run
+        of swaps to the same address goes through swapExactTokensForTokensBatch
+        unless `batch_swaps` is False. Lines that are not JSON objects, or miss a field
+        of their operation, or have an amount that isn't a number, are reported as
+        rejects and skipped.
+    """
+
+    def __init__(self, factory: Factory, batch_swaps=True) -> None:
+        self.factory = factory
+        self.batch_swaps = batch_swaps
+        self.pools = {exchange.name: exchange for exchange in factory.all_pairs}
+
+    def replay(self, path, chunk_size=10_000, report=None):
+        report = report or ReplayReport()
+        start = time.perf_counter()
+        for chunk in read_chunks(path, chunk_size):
+            for pool, records in groupby(chunk, key=_pool):
+                self._apply(self.pools.get(pool), list(records), report)
+            report.operations += len(chunk)
+
+        report.elapsed += time.perf_counter() - start
+        report.pools = {
+            name: (exchange.reserve0, exchange.reserve1, exchange.total_supply) for name, exchange in self.pools.items()
+        }
+        return report
+
+    def _apply(self, exchange, records, report):
+        swaps = []
+        for line, record in records:
+            error = malformed(record)
+            if error is not None:
+                report.reject(line, error)
+                continue
+
+            if swaps and (record["op"] != "swap" or record["to"] != swaps[0][1]["to"]):
+                self._swap(exchange, swaps, report)
+                swaps = []
+
+            if record["op"] == "swap" and self.batch_swaps and exchange is not None:
+                swaps.append((line, record))
+                continue
+
+            try:
+                self._dispatch(exchange, record)
+            except Exception as error:
+                report.reject(line, str(error) or type(error).__name__)
+
+        if swaps:
+            self._swap(exchange, swaps, report)
+
+    def _dispatch(self, exchange, record):
+        op = record["op"]
+        if op == "create_exchange":
+            token0 = ERC20(record["token0"], record["token0_addr"])
+            token1 = ERC20(record["token1"], record["token1_addr"])
+            exchange = self.factory.create_exchange(token0, token1, record["symbol"])
+            self.pools[exchange.name] = exchange
+            return
+
+        assert exchange is not None, "Unknown pool"
+        if op == "swap":
+            exchange.swapExactTokensForTokens(record["amount_in"], record["amount_out_min"], record["to"])
+        elif op == "add_liquidity":
+            exchange.add_liquidity(
+                record["from"], record["amount0"], record["amount1"], record["amount0_min"], record["amount1_min"]
+            )
+        elif op == "remove_liquidity":
+            exchange.remove_liquidity(record["to"], record["liquidity"], record["amount0_min"], record["amount1_min"])
+        else:
+            raise Exception(f"Unknown operation {op}")
+
+    def _swap(self, exchange, swaps, report):
+        amounts_in = [record["amount_in"] for _, record in swaps]
+        amounts_out_min = [record["amount_out_min"] for _, record in swaps]
+        try:
+            _, accepted, _ = exchange.swapExactTokensForTokensBatch(amounts_in, amounts_out_min, swaps[0][1]["to"])
+        except Exception as error:
+            for line, _ in swaps:
+                report.reject(line, str(error) or type(error).__name__)
+            return
+
+        for (line, record), ok in zip(swaps, accepted.tolist()):
+            if not ok:
+                if record["amount_in"] <= 0:
+                    report.reject(line, 'UniswapV2Library: INSUFFICIENT_INPUT_AMOUNT')
+                else:
+                    report.reject(line, 'UniswapV2Router: INSUFFICIENT_OUTPUT_AMOUNT')
+
+
+def replay(path, factory=None, chunk_size=10_000, batch_swaps=True):
+    factory = factory or Factory("ETH pool factory", "0x1")
+    return Replayer(factory, batch_swaps).replay(path, chunk_size)
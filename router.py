@@ -0,0 +1,153 @@
+from lp import Factory
+
+
+class Router:
+    """
+        Trades across the pools of a factory, following the best path of up to `max_hops` pools.
+        https://github.dev/Uniswap/v2-periphery/blob/master/contracts/UniswapV2Router02.sol
+
+        A path is a tuple of hops (exchange, token_in, token_out). The candidate paths
+        between two tokens only depend on which pools exist, so they are cached per
+        pair of tokens and dropped when the factory creates a new pool. Amounts are
+        always computed against the live reserves.
+    """
+
+    def __init__(self, factory: Factory, max_hops=3) -> None:
+        self.factory = factory
+        self.max_hops = max_hops
+        self._paths = {}
+        self._pair_count = factory.pair_count()
+
+    def get_paths(self, token_in, token_out):
+        if self._pair_count != self.factory.pair_count():
+            self._paths.clear()
+            self._pair_count = self.factory.pair_count()
+
+        key = (token_in, token_out)
+        paths = self._paths.get(key)
+        if paths is None:
+            paths = self._paths[key] = self._find_paths(token_in, token_out)
+        return paths
+
+    def _find_paths(self, token_in, token_out):
+        """
+        Depth-first search over the pools, only walking into tokens that can still
+        reach token_out within the remaining hops.
+        """
+        distances = self._distances_to(token_out)
+        paths = []
+
+        def visit(token, hops, visited):
+            for exchange in self.factory.get_pairs(token):
+                next_token = exchange.token1 if exchange.token0 == token else exchange.token0
+                if next_token in visited:
+                    continue
+
+                path = hops + ((exchange, token, next_token),)
+                if next_token == token_out:
+                    paths.append(path)
+                elif distances.get(next_token, self.max_hops) <= self.max_hops - len(path):
+                    visit(next_token, path, visited | {next_token})
+
+        if token_in != token_out:
+            visit(token_in, (), {token_in})
+        return paths
+
+    def _distances_to(self, token_out):
+        """
+        Breadth-first search of the number of hops from every token to token_out
+        """
+        distances = {token_out: 0}
+        frontier = [token_out]
+        for distance in range(1, self.max_hops):
+            next_frontier = []
+            for token in frontier:
+                for exchange in self.factory.get_pairs(token):
+                    next_token = exchange.token1 if exchange.token0 == token else exchange.token0
+                    if next_token not in distances:
+                        distances[next_token] = distance
+                        next_frontier.append(next_token)
+            frontier = next_frontier
+        return distances
+
+    def get_amounts_out(self, amount_in, path):
+        amounts = [amount_in]
+        for exchange, token_in, _ in path:
+            amounts.append(exchange.get_amount_out(amounts[-1], *exchange.get_reserves(token_in)))
+        return amounts
+
+    def get_best_path(self, amount_in, token_in, token_out):
+        """
+        Returns the path with the largest output and its amounts, ignoring paths
+        through empty pools
+        """
+        best_path, best_amounts = None, None
+        for path in self.get_paths(token_in, token_out):
+            if any(exchange.reserve0 <= 0 or exchange.reserve1 <= 0 for exchange, _, _ in path):
+                continue
+
+            amounts = self.get_amounts_out(amount_in, path)
+            if best_amounts is None or amounts[-1] > best_amounts[-1]:
+                best_path, best_amounts = path, amounts
+
+        assert best_path is not None, 'UniswapV2Library: INVALID_PATH'
+        return best_path, best_amounts
+
+    def swapExactTokensForTokens(self, amount_in, amount_out_min, token_in, token_out, to):
+        """
+        Swaps through the best path. Either every hop is applied or, if one of them
+        fails, the pools already traded are restored and the error is raised.
+
+        Like in a multicall, the hops only move the reserves of their pools: the
+        prices accumulate and listeners are notified once per pool, when the whole
+        path succeeded.
+        """
+        path, amounts = self.get_best_path(amount_in, token_in, token_out)
+        assert amounts[-1] >= amount_out_min, 'UniswapV2Router: INSUFFICIENT_OUTPUT_AMOUNT'
+
+        snapshots = []
+        ledgers = []        # of the tokens traded, in a transaction until the trade succeeds
+        try:
+            for (exchange, hop_in, hop_out), hop_amount_in, hop_amount_out in zip(path, amounts, amounts[1:]):
+                tokens = exchange.get_tokens()
+                for token in (tokens[hop_in], tokens[hop_out]):
+                    if token.ledger.undo is None:
+                        token.ledger.begin()
+                        ledgers.append(token.ledger)
+                snapshots.append((exchange, exchange._checkpoint(), tokens, tokens[hop_in].total, tokens[hop_out].total))
+                exchange._batch = tokens
+
+                tokens[hop_in].deposit(to, hop_amount_in)
+                if hop_out == exchange.token1:
+                    exchange.swap(0, hop_amount_out, to, log=False)
+                else:
+                    exchange.swap(hop_amount_out, 0, to, log=False)
+        except BaseException:
+            self._restore(snapshots, path, ledgers)
+            raise
+        finally:
+            for exchange, *_ in snapshots:
+                exchange._batch = None
+
+        for ledger in ledgers:
+            ledger.commit()
+        for exchange, checkpoint, *_ in snapshots:
+            exchange._commit(checkpoint)
+        if self.factory.journal is not None:
+            self.factory.journal.log_router_swap(self, amount_in, amount_out_min, token_in, token_out, to)
+        return amounts
+
+    def _restore(self, snapshots, path, ledgers):
+        """
+        Undoes the hops of a failed trade: the pools get their state back, and the
+        token ledgers roll back their transactions, so an address that had no
+        balance has none again. Listeners never heard of the hops.
+        """
+        # in reverse, so a token shared by two hops ends with its total before the first one
+        for snapshot, (_, hop_in, hop_out) in reversed(list(zip(snapshots, path))):
+            exchange, checkpoint, tokens, total_in, total_out = snapshot
+            exchange._rollback(checkpoint)
+            tokens[hop_in].total = total_in
+            tokens[hop_out].total = total_out
+        for ledger in ledgers:
+            ledger.rollback()
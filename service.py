@@ -0,0 +1,174 @@
+import asyncio
+import json
+import numbers
+from functools import partial
+
+from lp import Factory
+
+
+class ExchangeService:
+    """
+        asyncio facade over the exchanges of a factory.
+
+        State-changing calls on a pool go through a queue consumed by one worker
+        task per pool, so trades on the same pool are applied one at a time and in
+        order while different pools progress independently. With an `executor` the
+        calls run off the event loop.
+
+        Quotes asked for the same pool and direction during one iteration of the
+        event loop are answered by a single vectorized Exchange.price_impact call
+        against the same reserves. With an `executor` that call goes through the
+        pool's queue too, so it never reads the reserves while a trade writes them.
+    """
+
+    def __init__(self, factory: Factory, executor=None) -> None:
+        self.factory = factory
+        self.executor = executor
+        self._pools = {exchange.name: exchange for exchange in factory.all_pairs}
+        self._queues = {}
+        self._workers = {}
+        self._quotes = {}       # (pool, zero_for_one) -> ([amount_in, ...], [future, ...])
+
+    def _exchange(self, pool):
+        exchange = self._pools.get(pool)
+        if exchange is None:
+            tokens = self.factory.get_token(pool)
+            assert tokens is not None, "Unknown pool"
+            exchange = self._pools[pool] = self.factory.get_pair(*tokens)
+        return exchange
+
+    async def swap(self, pool, amount_in, amount_out_min, to):
+        return await self._submit(pool, "swapExactTokensForTokens", amount_in, amount_out_min, to)
+
+    async def add_liquidity(self, pool, _from, balance0, balance1, balance0Min, balance1Min):
+        return await self._submit(pool, "add_liquidity", _from, balance0, balance1, balance0Min, balance1Min)
+
+    async def remove_liquidity(self, pool, to, liquidity, amount0_min, amount1_min):
+        return await self._submit(pool, "remove_liquidity", to, liquidity, amount0_min, amount1_min)
+
+    def _queue(self, pool, exchange):
+        queue = self._queues.get(pool)
+        if queue is None:
+            queue = self._queues[pool] = asyncio.Queue()
+            self._workers[pool] = asyncio.create_task(self._worker(exchange, queue))
+        return queue
+
+    async def _submit(self, pool, method, *args):
+        exchange = self._exchange(pool)
+        queue = self._queue(pool, exchange)
+        future = asyncio.get_running_loop().create_future()
+        await queue.put((getattr(exchange, method), args, future))
+        return await future
+
+    async def _worker(self, exchange, queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            call, args, future = await queue.get()
+            try:
+                if self.executor is None:
+                    result = call(*args)
+                else:
+                    result = await loop.run_in_executor(self.executor, call, *args)
+                future.set_result(result)
+            except Exception as error:
+                future.set_exception(error)
+            finally:
+                queue.task_done()
+
+    async def quote(self, pool, amount_in, zero_for_one=True):
+        exchange = self._exchange(pool)
+        # checked here, one bad amount would fail every quote coalesced with it
+        if not isinstance(amount_in, numbers.Real) or isinstance(amount_in, bool):
+            raise TypeError("Invalid amount")
+        assert amount_in > 0, 'UniswapV2Library: INSUFFICIENT_INPUT_AMOUNT'
+        key = (pool, zero_for_one)
+        loop = asyncio.get_running_loop()
+
+        pending = self._quotes.get(key)
+        if pending is None:
+            pending = self._quotes[key] = ([], [])
+            loop.call_soon(self._flush_quotes, exchange, key)
+
+        future = loop.create_future()
+        pending[0].append(amount_in)
+        pending[1].append(future)
+        return await future
+
+    def _flush_quotes(self, exchange, key):
+        amounts_in, futures = self._quotes.pop(key)
+        call = partial(exchange.price_impact, amounts_in, zero_for_one=key[1])
+        if self.executor is None:
+            self._answer(futures, call)
+            return
+
+        # the trades of the pool run on the executor's threads, the quotes wait for their turn
+        done = asyncio.get_running_loop().create_future()
+        done.add_done_callback(lambda done: self._answer(futures, done.result))
+        self._queue(key[0], exchange).put_nowait((call, (), done))
+
+    @staticmethod
+    def _answer(futures, call):
+        """
+        Resolves the futures of coalesced quotes with the amounts out of call()
+        """
+        try:
+            amounts_out, _, _ = call()
+            amounts_out = amounts_out.tolist()
+        except Exception as error:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        for future, amount_out in zip(futures, amounts_out):
+            if not future.done():
+                future.set_result(amount_out)
+
+    async def close(self):
+        for worker in self._workers.values():
+            worker.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        self._workers.clear()
+        self._queues.clear()
+
+    async def handle(self, request):
+        """
+        Answers a JSON request {"id": ..., "method": ..., "params": {...}} where method
+        is one of quote, swap, add_liquidity, remove_liquidity
+        """
+        method = request.get("method")
+        try:
+            assert method in ("quote", "swap", "add_liquidity", "remove_liquidity"), "Unknown method"
+            result = await getattr(self, method)(**request.get("params", {}))
+            return {"id": request.get("id"), "result": result}
+        except Exception as error:
+            return {"id": request.get("id"), "error": str(error) or type(error).__name__}
+
+    async def _serve_connection(self, reader, writer):
+        tasks = set()
+
+        async def respond(line):
+            try:
+                response = await self.handle(json.loads(line))
+            except ValueError:
+                response = {"id": None, "error": "Invalid JSON"}
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+
+        while line := await reader.readline():
+            task = asyncio.create_task(respond(line))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        await asyncio.gather(*tasks)
+        writer.close()
+
+    async def serve(self, host="127.0.0.1", port=0, path=None):
+        """
+        Starts a server speaking newline-delimited JSON on a TCP port or, with
+        `path`, on a Unix socket. Requests on a connection are handled concurrently
+        and answered as they complete, matched by their id.
+        """
+        if path is not None:
+            return await asyncio.start_unix_server(self._serve_connection, path)
+        return await asyncio.start_server(self._serve_connection, host, port)
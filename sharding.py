@@ -0,0 +1,183 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from lp import ERC20, FEE_COLUMNS, BaseExchange, Factory
+
+
+def _export(exchange):
+    tokens = exchange.get_tokens()
+    return {
+        "tokens": [
+            (token.name, token.token_addr, token.total, dict(token.balances))
+            for token in (tokens[exchange.token0], tokens[exchange.token1])
+        ],
+        "symbol": exchange.symbol,
+        "reserve0": exchange.reserve0,
+        "reserve1": exchange.reserve1,
+        "total_supply": exchange.total_supply,
+        "fee": exchange.fee,
+        "fee_growth": (exchange.fee_growth0, exchange.fee_growth1),
+        "oracle": (exchange.price0_cumulative_last, exchange.price1_cumulative_last, exchange.block_timestamp_last),
+        "liquidity_providers": dict(exchange.liquidity_providers),
+        "fees": {column: dict(exchange.liquidity_providers.ledger.mapping(column)) for column in FEE_COLUMNS},
+    }
+
+
+def _restore(exchange, state):
+    """
+    Puts the exported state into the exchange as it is, accumulators included,
+    then notifies the listeners once of the whole new state
+    """
+    tokens = exchange.get_tokens()
+    for name, _, total, balances in state["tokens"]:
+        tokens[name].total = total
+        tokens[name].balances.clear()
+        tokens[name].balances.update(balances)
+    exchange.reserve0 = state["reserve0"]
+    exchange.reserve1 = state["reserve1"]
+    exchange.total_supply = state["total_supply"]
+    exchange.fee = state["fee"]
+    exchange.fee_growth0, exchange.fee_growth1 = state["fee_growth"]
+    exchange.price0_cumulative_last, exchange.price1_cumulative_last, exchange.block_timestamp_last = state["oracle"]
+    exchange.liquidity_providers.clear()
+    exchange.liquidity_providers.update(state["liquidity_providers"])
+    for column, values in state["fees"].items():
+        fees = exchange.liquidity_providers.ledger.mapping(column)
+        fees.clear()
+        fees.update(values)
+    exchange.version += 1
+    if exchange.factory.listeners:
+        exchange.factory.notify(exchange)
+
+
+def _apply(pools, operations):
+    """
+    Runs (pool, method, args) operations in order, returning the result or the
+    exception of each one
+    """
+    results = []
+    for pool, method, args in operations:
+        try:
+            results.append(getattr(pools[pool], method)(*args))
+        except Exception as error:
+            results.append(error)
+    return results
+
+
+# pools owned by the current shard process
+_shard_pools = {}
+
+
+def _init_shard(numeric, clock, states):
+    factory = Factory("shard", "0x0", numeric=numeric, clock=clock)
+    for state in states:
+        token0, token1 = (ERC20(name, address) for name, address, _, _ in state["tokens"])
+        exchange = factory.create_exchange(token0, token1, state["symbol"])
+        _restore(exchange, state)
+        _shard_pools[exchange.name] = exchange
+
+
+def _call_in_shard(pool, method, args):
+    return getattr(_shard_pools[pool], method)(*args)
+
+
+def _apply_in_shard(operations):
+    return _apply(_shard_pools, operations)
+
+
+def _export_shard():
+    return {name: _export(exchange) for name, exchange in _shard_pools.items()}
+
+
+class ShardedExecutor:
+    """
+        Runs pool operations on shards, each shard owning a fixed subset of the pools
+        and a single worker, so a pool is never touched by two workers at once and no
+        locking is needed. Operations on the same pool keep their submission order.
+
+        - backend="thread": one thread per shard working on the factory's own exchanges.
+          Suits I/O-bound callers; exchanges must not share ERC20 objects, which is
+          the case for pools built with main.create_exchange. The factory's listeners
+          are called one update at a time (see Factory.notify) and its quote cache
+          locks its entries, so both can be shared by the shards.
+        - backend="process": one process per shard holding a copy of its pools, so
+          CPU-bound replay scales with cores. The shards get a copy of the factory's
+          clock. Call `sync` to copy the shards' state, price accumulators
+          included, back into the factory's exchanges, each one notifying the
+          listeners once.
+    """
+
+    def __init__(self, factory: Factory, shards=4, backend="thread") -> None:
+        assert backend in ("thread", "process"), "Unknown backend"
+        assert factory.journal is None, "Journaled factories can't be sharded"
+        self.factory = factory
+        self.backend = backend
+        self.pools = {exchange.name: exchange for exchange in factory.all_pairs}
+        self.shard_of = {name: pool_id % shards for pool_id, name in enumerate(self.pools)}
+
+        if backend == "thread":
+            self.shards = [ThreadPoolExecutor(max_workers=1) for _ in range(shards)]
+        else:
+            assert all(isinstance(exchange, BaseExchange) for exchange in self.pools.values()), \
+                "Only constant product pools can be copied to shard processes"
+            states = [[] for _ in range(shards)]
+            for name, exchange in self.pools.items():
+                states[self.shard_of[name]].append(_export(exchange))
+            self.shards = [
+                ProcessPoolExecutor(
+                    max_workers=1, initializer=_init_shard, initargs=(factory.numeric.name, factory.clock, shard_states)
+                )
+                for shard_states in states
+            ]
+
+    def submit(self, pool, method, *args):
+        """
+        Runs one operation on the shard owning the pool and returns its future
+        """
+        shard = self.shards[self.shard_of[pool]]
+        if self.backend == "thread":
+            return shard.submit(getattr(self.pools[pool], method), *args)
+        return shard.submit(_call_in_shard, pool, method, args)
+
+    def submit_many(self, operations):
+        """
+        Sends the operations to their shards, one message per shard, and returns a
+        future of each shard's results
+        """
+        batches = {}
+        for operation in operations:
+            batches.setdefault(self.shard_of[operation[0]], []).append(operation)
+
+        futures = {}
+        for shard, batch in batches.items():
+            if self.backend == "thread":
+                futures[shard] = self.shards[shard].submit(_apply, self.pools, batch)
+            else:
+                futures[shard] = self.shards[shard].submit(_apply_in_shard, batch)
+        return futures
+
+    def map(self, operations):
+        """
+        Runs (pool, method, args) operations across the shards in parallel and
+        returns their results (or exceptions) in the order of `operations`
+        """
+        operations = list(operations)
+        futures = self.submit_many(operations)
+        results = {shard: iter(future.result()) for shard, future in futures.items()}
+        return [next(results[self.shard_of[pool]]) for pool, _, _ in operations]
+
+    def sync(self):
+        if self.backend == "thread":
+            return
+        for shard in self.shards:
+            for name, state in shard.submit(_export_shard).result().items():
+                _restore(self.pools[name], state)
+
+    def close(self):
+        for shard in self.shards:
+            shard.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
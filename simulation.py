@@ -0,0 +1,107 @@
+import heapq
+from multiprocessing import Pool
+
+from clock import ManualClock
+from lp import ERC20, Factory
+from staking_rewards import StakingRewards
+
+
+class Simulation:
+    """
+        Runs a StakingRewards contract in virtual time.
+
+        Events are scheduled at timestamps and applied in order (ties keep their
+        scheduling order), jumping the clock straight from one event to the next,
+        so a year-long reward period costs as much as the events in it. Each
+        simulation owns its clock, so any number of them can run side by side.
+    """
+
+    def __init__(self, staking: StakingRewards, clock: ManualClock) -> None:
+        assert staking.clock is clock, "The contract must read the simulation clock"
+        self.staking = staking
+        self.clock = clock
+        self.events = []        # heap of (timestamp, sequence, method, args)
+        self.results = []       # (timestamp, method, args, result or exception)
+        self.sequence = 0
+
+    def schedule(self, timestamp, method, *args):
+        assert timestamp >= self.clock.time(), "Can't schedule events in the past"
+        heapq.heappush(self.events, (timestamp, self.sequence, method, args))
+        self.sequence += 1
+
+    def stake(self, timestamp, _from, amount):
+        self.schedule(timestamp, "stake", _from, amount)
+
+    def withdraw(self, timestamp, _from, amount):
+        self.schedule(timestamp, "withdraw", _from, amount)
+
+    def claim(self, timestamp, _from):
+        self.schedule(timestamp, "get_reward", _from)
+
+    def add_rewards(self, timestamp, reward, duration=None):
+        self.schedule(timestamp, "add_rewards", reward, duration)
+
+    def run(self, until=None):
+        """
+        Applies the events scheduled up to `until` (all of them by default) and leaves
+        the clock at `until`. Rejected events are recorded with their exception.
+        """
+        events = self.events
+        while events and (until is None or events[0][0] <= until):
+            timestamp, _, method, args = heapq.heappop(events)
+            self.clock.set(timestamp)
+            try:
+                result = getattr(self.staking, method)(*args)
+            except Exception as error:
+                result = error
+            self.results.append((timestamp, method, args, result))
+
+        if until is not None:
+            self.clock.set(max(until, self.clock.time()))
+        return self.results
+
+
+def run_scenario(scenario):
+    """
+    Builds a fresh pool and staking contract and runs a scenario on them, a dict with:
+    - "providers": {address: liquidity provided to the pool}
+    - "rewards": reward added at time 0, "duration": its duration (optional)
+    - "events": [(timestamp, "stake" | "withdraw" | "claim", address[, amount]), ...]
+    - "until": timestamp the simulation ends at (optional)
+
+    Returns the rewards claimed and still pending per address, and the number of
+    rejected events.
+    """
+    factory = Factory("simulation", "0x0")
+    lp = factory.create_exchange(ERC20("TST", "0x111"), ERC20("ETH", "0x09"), "TST")
+    for address, liquidity in scenario["providers"].items():
+        lp.add_liquidity(address, liquidity, liquidity, liquidity, liquidity)
+
+    clock = ManualClock()
+    simulation = Simulation(StakingRewards(lp, clock=clock), clock)
+    simulation.add_rewards(0, scenario["rewards"], scenario.get("duration"))
+    for timestamp, event, *args in scenario.get("events", ()):
+        getattr(simulation, event)(timestamp, *args)
+
+    claimed = {}
+    rejected = 0
+    for _, method, args, result in simulation.run(scenario.get("until")):
+        if isinstance(result, Exception):
+            rejected += 1
+        elif method == "get_reward":
+            claimed[args[0]] = claimed.get(args[0], 0) + result
+
+    staking = simulation.staking
+    pending = dict(zip(staking.ledger.addresses, staking.earned_all().tolist()))
+    pending.pop("deployer", None)
+    return {"claimed": claimed, "pending": pending, "rejected": rejected}
+
+
+def run_scenarios(scenarios, processes=None):
+    """
+    Runs independent scenarios, on a pool of `processes` processes when given
+    """
+    if not processes:
+        return [run_scenario(scenario) for scenario in scenarios]
+    with Pool(processes) as pool:
+        return pool.map(run_scenario, scenarios, chunksize=max(1, len(scenarios) // (4 * processes)))
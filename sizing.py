@@ -0,0 +1,92 @@
+import math
+from fractions import Fraction
+
+import numpy as np
+
+
+def _arrays(*values):
+    return np.broadcast_arrays(*(np.asarray(value, dtype=np.float64) for value in values))
+
+
+def amounts_in_for_price(reserves_in, reserves_out, target_prices, gammas=1.0):
+    """
+    Input that moves the spot price (reserve_out / reserve_in) of each pool down to
+    its target price, 0 where the price is already at or below it or the pool is empty.
+
+    With the fee kept in the pool, selling x leaves reserves such that
+    (reserve_in + gamma * x) * (reserve_in + x) = reserve_in * reserve_out / target,
+    a quadratic in x whose positive root is the answer.
+    """
+    reserves_in, reserves_out, target_prices, gammas = _arrays(reserves_in, reserves_out, target_prices, gammas)
+    valid = (reserves_in > 0) & (reserves_out > 0) & (target_prices > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        b = (1 + gammas) * reserves_in
+        c = reserves_in * reserves_in - reserves_in * reserves_out / target_prices
+        amounts = (np.sqrt(b * b - 4 * gammas * c) - b) / (2 * gammas)
+    return np.where(valid & (c < 0), amounts, 0.0)
+
+
+def amounts_in_for_slippage(reserves_in, max_slippages, gammas=1.0):
+    """
+    Largest input whose price impact (1 - effective price / spot price after the fee)
+    stays within the bound: gamma * x / (reserve_in + gamma * x) <= max_slippage
+    """
+    reserves_in, max_slippages, gammas = _arrays(reserves_in, max_slippages, gammas)
+    assert ((max_slippages >= 0) & (max_slippages < 1)).all(), 'Slippage must be in [0, 1)'
+    amounts = max_slippages * reserves_in / (gammas * (1 - max_slippages))
+    return np.where(reserves_in > 0, amounts, 0.0)
+
+
+def amount_in_for_price_exact(reserve_in, reserve_out, target_price, fee):
+    """
+    amounts_in_for_price for one pool of integer amounts, solved exactly: the
+    largest integer x with (1000 * reserve_in + (1000 - fee) * x) * (reserve_in + x)
+    * target <= 1000 * reserve_in * reserve_out, so the price after selling x is
+    at or above the target, whatever the size of the reserves.
+    """
+    if reserve_in <= 0 or reserve_out <= 0:
+        return 0
+    a, b = Fraction(target_price).as_integer_ratio()
+    gamma = 1000 - fee
+    # A x^2 + B x + C <= 0
+    A = gamma * a
+    B = a * reserve_in * (1000 + gamma)
+    C = 1000 * reserve_in * (a * reserve_in - b * reserve_out)
+    if C >= 0:
+        return 0
+
+    def excess(x):
+        return (A * x + B) * x + C
+
+    amount = (math.isqrt(B * B - 4 * A * C) - B) // (2 * A)
+    while excess(amount + 1) <= 0:
+        amount += 1
+    while amount > 0 and excess(amount) > 0:
+        amount -= 1
+    return amount
+
+
+def amount_in_for_slippage_exact(reserve_in, reserve_out, max_slippage, fee):
+    """
+    amounts_in_for_slippage for one pool of integer amounts: the largest integer x
+    whose output, rounded down as the pool does, keeps the price impact within the
+    bound: 1000 * reserve_in * amount_out(x) >= (1 - max_slippage) * (1000 - fee) * x * reserve_out
+    """
+    assert 0 <= max_slippage < 1, 'Slippage must be in [0, 1)'
+    if reserve_in <= 0 or reserve_out <= 0:
+        return 0
+    p, q = Fraction(max_slippage).as_integer_ratio()
+    gamma = 1000 - fee
+    # the impact is within the bound when amount_out(x) * denominator >= x * numerator
+    numerator = (q - p) * gamma * reserve_out
+    denominator = q * 1000 * reserve_in
+
+    def amount_out(x):
+        return x * gamma * reserve_out // (1000 * reserve_in + x * gamma)
+
+    # the real-valued bound, then down while rounding the output down goes past it;
+    # no x above amount_out(x) * denominator / numerator is within the bound, as the output only grows with x
+    amount = 1000 * p * reserve_in // (gamma * (q - p))
+    while amount > 0 and amount_out(amount) * denominator < amount * numerator:
+        amount = amount_out(amount) * denominator // numerator
+    return amount
@@ -0,0 +1,340 @@
+import mmap
+import struct
+
+import numpy as np
+
+from lp import ERC20, FEE_COLUMNS, BaseExchange, Factory, pair_key
+from pool_table import PoolTable, PoolView, TableFactory
+from staking_rewards import StakingRewards
+
+
+MAGIC = b"LPSNAP03"
+
+# magic, factory name and address (string ids), then the length and the offset of each section
+HEADER = struct.Struct("<8s18Q")
+SECTIONS = ("pools", "providers", "tokens", "string_offsets", "blob", "stakings", "stakers", "balances")
+
+POOL = np.dtype([
+    ("reserve0", "<f8"), ("reserve1", "<f8"), ("total_supply", "<f8"), ("fee", "<f8"),
+    ("fee_growth0", "<f8"), ("fee_growth1", "<f8"),
+    ("balance0", "<f8"), ("balance1", "<f8"), ("providers_start", "<u8"), ("providers_count", "<u8"),
+    ("holders0_start", "<u8"), ("holders0_count", "<u8"), ("holders1_start", "<u8"), ("holders1_count", "<u8"),
+    ("token0", "<u4"), ("token1", "<u4"), ("token0_addr", "<u4"), ("token1_addr", "<u4"),
+    ("name", "<u4"), ("symbol", "<u4"),
+])
+# a provider's fee columns are 0 until a fee is charged, see Exchange._settle
+PROVIDER = np.dtype([("address", "<u8"), ("liquidity", "<f8")] + [(column, "<f8") for column in FEE_COLUMNS])
+STAKING = np.dtype([
+    ("pool", "<u8"), ("last_update_time", "<f8"), ("reward_rate", "<f8"), ("rewards_duration", "<f8"),
+    ("total_supply", "<f8"), ("period_finish", "<f8"), ("reward_per_token", "<f8"),
+    ("stakers_start", "<u8"), ("stakers_count", "<u8"),
+])
+# `present` is a bitmask of the ledgers holding the address: balances, rewards, paid
+STAKER = np.dtype([("address", "<u4"), ("present", "<u4"), ("balance", "<f8"), ("reward", "<f8"), ("paid", "<f8")])
+LEDGERS = ("balances", "rewards", "user_reward_per_token_paid")
+# balance of a holder of one of the tokens of a pool
+BALANCE = np.dtype([("address", "<u4"), ("balance", "<f8")])
+
+
+def dump(factory: Factory, path, stakings=()):
+    """
+    Writes the state of every pool of the factory (reserves, total supply, fee and
+    fee growth, token totals and the balances of their holders, liquidity providers
+    and their fees) and of the staking contracts into a single file
+    that `load` maps into memory.
+    """
+    assert factory.numeric.name == "float", "Snapshots store float pools"
+
+    strings = {}
+    tokens = {}
+
+    def string_id(value):
+        return strings.setdefault(value, len(strings))
+
+    def token_id(name):
+        return tokens.setdefault(name, len(tokens))
+
+    factory_strings = (string_id(factory.name), string_id(factory.address))
+    pool_ids = {}
+    pools = np.zeros(factory.pair_count(), dtype=POOL)
+    providers = []
+    balances = []
+    for pool_id, exchange in enumerate(factory.all_pairs):
+        assert isinstance(exchange, BaseExchange), "Snapshots store constant product pools"
+        pool_ids[exchange.name] = pool_id
+        erc20 = exchange.get_tokens()
+        token0, token1 = erc20[exchange.token0], erc20[exchange.token1]
+        liquidity_providers = exchange.liquidity_providers
+        holders = []
+        for token in (token0, token1):
+            holders.append((len(balances), token.ledger.count("balances")))
+            balances.extend((string_id(address), balance) for address, balance in token.balances.items())
+        pools[pool_id] = (
+            exchange.reserve0, exchange.reserve1, exchange.total_supply, exchange.fee,
+            exchange.fee_growth0, exchange.fee_growth1,
+            token0.total, token1.total, len(providers), len(liquidity_providers), *holders[0], *holders[1],
+            token_id(token0.name), token_id(token1.name), string_id(token0.token_addr), string_id(token1.token_addr),
+            string_id(exchange.name), string_id(exchange.symbol),
+        )
+        ledger = liquidity_providers.ledger
+        providers.extend(
+            (string_id(address), liquidity, *(ledger.get(column, address, 0) for column in FEE_COLUMNS))
+            for address, liquidity in liquidity_providers.items()
+        )
+
+    staking_rows = []
+    stakers = []
+    for staking in stakings:
+        addresses = {}
+        for bit, ledger in enumerate(LEDGERS):
+            for address in getattr(staking, ledger):
+                addresses[address] = addresses.get(address, 0) | 1 << bit
+
+        staking_rows.append((
+            pool_ids[staking.lp.name], staking.last_update_time, staking.reward_rate, staking.rewards_duration,
+            staking.total_supply, staking.period_finish, staking.reward_per_token, len(stakers), len(addresses),
+        ))
+        stakers.extend(
+            (
+                string_id(address), present, staking.balances.get(address, 0),
+                staking.rewards.get(address, 0), staking.user_reward_per_token_paid.get(address, 0),
+            )
+            for address, present in addresses.items()
+        )
+
+    token_names = np.array([string_id(name) for name in tokens], dtype="<u4")
+    encoded = [value.encode() for value in strings]
+    string_offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+    np.cumsum([len(value) for value in encoded], out=string_offsets[1:])
+
+    sections = [
+        pools.tobytes(),
+        np.array(providers, dtype=PROVIDER).tobytes(),
+        token_names.tobytes(),
+        string_offsets.tobytes(),
+        b"".join(encoded),
+        np.array(staking_rows, dtype=STAKING).tobytes(),
+        np.array(stakers, dtype=STAKER).tobytes(),
+        np.array(balances, dtype=BALANCE).tobytes(),
+    ]
+    lengths = [len(pools), len(providers), len(token_names), len(string_offsets), len(sections[4]),
+               len(staking_rows), len(stakers), len(balances)]
+
+    offsets = []
+    offset = HEADER.size
+    for section in sections:
+        offset += -offset % 8
+        offsets.append(offset)
+        offset += len(section)
+
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, *factory_strings, *lengths, *offsets))
+        for section, offset in zip(sections, offsets):
+            file.write(b"\0" * (offset - file.tell()))
+            file.write(section)
+
+
+class _LazyList:
+    """
+        Read-only list over the snapshot that decodes items when accessed;
+        items appended after loading are kept in a regular list.
+    """
+
+    def __init__(self, getter, length) -> None:
+        self.getter = getter
+        self.length = length
+        self.appended = []
+
+    def __len__(self):
+        return self.length + len(self.appended)
+
+    def __getitem__(self, index):
+        if index < self.length:
+            return self.getter(index)
+        return self.appended[index - self.length]
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+    def append(self, value):
+        self.appended.append(value)
+
+
+class SnapshotTable(PoolTable):
+    """
+        PoolTable whose columns are views over a memory-mapped snapshot. Token
+        objects, with the balances of their holders, and liquidity providers of a
+        pool are built on first touch.
+    """
+
+    def __init__(self, factory: Factory, sections) -> None:
+        self.factory = factory
+        self.sections = sections
+        self.pools = pools = sections["pools"]
+        self.snapshot_size = self.size = len(pools)
+        for column, dtype in self.COLUMNS.items():
+            # views over the snapshot, or zeros for the state it doesn't store
+            setattr(self, column, pools[column] if column in POOL.names else np.zeros(len(pools), dtype=dtype))
+
+        token_names = sections["tokens"]
+        self.tokens = _LazyList(lambda token_id: self.string(token_names[token_id]), len(token_names))
+        self.token_ids = None
+        self.names = _LazyList(lambda pool_id: self.string(pools["name"][pool_id]), len(pools))
+        self.symbols = _LazyList(lambda pool_id: self.string(pools["symbol"][pool_id]), len(pools))
+        self.liquidity_providers = {}
+        self.batches = {}
+        self.erc20 = {}
+
+    def string(self, string_id):
+        offsets = self.sections["string_offsets"]
+        return bytes(self.sections["blob"][offsets[string_id]:offsets[string_id + 1]]).decode()
+
+    def token_id(self, token):
+        if self.token_ids is None:
+            self.token_ids = {name: token_id for token_id, name in enumerate(self.tokens)}
+        return super().token_id(token)
+
+    def get_tokens(self, pool_id):
+        if pool_id >= self.snapshot_size:
+            return super().get_tokens(pool_id)
+
+        tokens = self.erc20.get(pool_id)
+        if tokens is None:
+            row = self.pools[pool_id]
+            token0 = ERC20(self.tokens[row["token0"]], self.string(row["token0_addr"]))
+            token1 = ERC20(self.tokens[row["token1"]], self.string(row["token1_addr"]))
+            token0.total = float(row["balance0"])
+            token1.total = float(row["balance1"])
+            for token, holders in ((token0, "holders0"), (token1, "holders1")):
+                start = int(row[holders + "_start"])
+                for address, balance in self.sections["balances"][start:start + int(row[holders + "_count"])].tolist():
+                    token.ledger.set("balances", self.string(address), balance)
+            tokens = self.erc20[pool_id] = {token0.name: token0, token1.name: token1}
+        return tokens
+
+    def _load_providers(self, pool_id, providers):
+        if pool_id >= self.snapshot_size:
+            return
+
+        start = int(self.pools["providers_start"][pool_id])
+        rows = self.sections["providers"][start:start + int(self.pools["providers_count"][pool_id])]
+        ledger = providers.ledger
+        for address, liquidity, *fees in rows.tolist():
+            address = self.string(address)
+            providers[address] = liquidity
+            for column, value in zip(FEE_COLUMNS, fees):
+                if value:
+                    ledger.set(column, address, value)
+
+
+class _Registry:
+    """
+        Factory registry attribute that is only built from the snapshot when it is first used
+    """
+
+    def __set_name__(self, owner, name):
+        self.attribute = "_" + name
+
+    def __get__(self, factory, owner=None):
+        if factory is None:
+            return self
+        factory._index()
+        return factory.__dict__[self.attribute]
+
+    def __set__(self, factory, value):
+        factory.__dict__[self.attribute] = value
+
+
+class _PoolTokens(dict):
+    def __init__(self, factory) -> None:
+        super().__init__()
+        self.factory = factory
+
+    def __missing__(self, name):
+        return self.factory.pool_table.get_tokens(self.factory._pool_ids[name])
+
+
+class SnapshotFactory(TableFactory):
+    """
+        Factory loaded from a snapshot. Pools are addressed by id through get_pool
+        without building anything; the pair and token registries are only built
+        the first time they are used.
+    """
+    token_to_exchange = _Registry()
+    exchange_to_tokens = _Registry()
+    pairs = _Registry()
+    token_to_pairs = _Registry()
+    all_pairs = _Registry()
+
+    def __init__(self, sections, name_id, address_id) -> None:
+        self.__dict__["_indexed"] = False
+        self.pool_table = SnapshotTable(self, sections)
+        self._views = {}
+        Factory.__init__(self, self.pool_table.string(name_id), self.pool_table.string(address_id))
+
+    def get_pool(self, pool_id):
+        if pool_id >= self.pool_table.snapshot_size:
+            return self.all_pairs[pool_id]
+
+        view = self._views.get(pool_id)
+        if view is None:
+            view = self._views[pool_id] = PoolView(self.pool_table, pool_id)
+        return view
+
+    def pair_count(self):
+        return self.pool_table.size
+
+    def _index(self):
+        if self._indexed:
+            return
+        self._indexed = True
+
+        self.exchange_to_tokens = _PoolTokens(self)
+        self._pool_ids = {}
+        for pool_id in range(self.pool_table.snapshot_size):
+            exchange = self.get_pool(pool_id)
+            self._pool_ids[exchange.name] = pool_id
+            self._register(exchange)
+
+    def _register(self, exchange):
+        self.pairs[pair_key(exchange.token0, exchange.token1)] = exchange
+        self.all_pairs.append(exchange)
+        self.token_to_exchange.setdefault(exchange.token0, exchange)
+        for token in (exchange.token0, exchange.token1):
+            self.token_to_pairs.setdefault(token, []).append(exchange)
+
+
+def load(path):
+    """
+    Maps a snapshot written by `dump` into memory (copy-on-write, the file is never
+    modified) and returns a SnapshotFactory over it and the staking contracts.
+    """
+    with open(path, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    magic, name_id, address_id, *fields = HEADER.unpack_from(buffer, 0)
+    assert magic == MAGIC, "Not a liquidity pool snapshot"
+    lengths, offsets = fields[:len(SECTIONS)], fields[len(SECTIONS):]
+    dtypes = (POOL, PROVIDER, "<u4", "<u8", np.uint8, STAKING, STAKER, BALANCE)
+    sections = {
+        section: np.frombuffer(buffer, dtype=dtype, count=length, offset=offset)
+        for section, dtype, length, offset in zip(SECTIONS, dtypes, lengths, offsets)
+    }
+
+    factory = SnapshotFactory(sections, name_id, address_id)
+    table = factory.pool_table
+    stakings = []
+    for row in sections["stakings"]:
+        staking = StakingRewards(factory.get_pool(int(row["pool"])))
+        for attribute in ("last_update_time", "reward_rate", "rewards_duration", "total_supply",
+                          "period_finish", "reward_per_token"):
+            setattr(staking, attribute, float(row[attribute]))
+
+        start = int(row["stakers_start"])
+        for address, present, *values in sections["stakers"][start:start + int(row["stakers_count"])].tolist():
+            for bit, (ledger, value) in enumerate(zip(LEDGERS, values)):
+                if present >> bit & 1:
+                    getattr(staking, ledger)[table.string(address)] = value
+        stakings.append(staking)
+
+    return factory, stakings
@@ -1,4 +1,7 @@
-import time
+import numpy as np
+
+from clock import SystemClock
+from ledger import ArrayLedger
 
 
 class Factory:
@@ -10,21 +13,30 @@ class Factory:
 class StakingRewards:
     """
     Liquidity provider can stake a % of their deposits amount against the pool of LP providers.
+
+    Time is read from `clock` (see clock.py), the system clock by default.
     """
 
-    def __init__(self, liquidity_pool) -> None:
+    def __init__(self, liquidity_pool, journal=None, clock=None) -> None:
         self.last_update_time = 0
         self.reward_rate = 0
         self.rewards_duration = 31536000    # 365 days = 60*60*24*365
         self.total_supply = 0
         self.period_finish = 0
         self.lp = liquidity_pool
+        self.clock = clock or SystemClock()
 
         self.reward_per_token = 0        # changes frequently
-        self.user_reward_per_token_paid = {}
 
-        self.rewards = {}
-        self.balances = {}
+        # the three ledgers below are dict-like views over its columns
+        self.ledger = ArrayLedger()
+        self.user_reward_per_token_paid = self.ledger.mapping("user_reward_per_token_paid")
+        self.rewards = self.ledger.mapping("rewards")
+        self.balances = self.ledger.mapping("balances")
+
+        self.journal = journal
+        if journal is not None:
+            journal.log_staking(self)
 
     def doc(self):
         print("Funcionalidades disponíveis: \n- [public] Stake\n- [public] Withdraw\n- [public] Get rewards\n- [private] Add rewards")
@@ -39,7 +51,7 @@ class StakingRewards:
         if duration:
             self.rewards_duration = duration
 
-        current_timestamp = time.time()
+        current_timestamp = self.clock.time()
         if current_timestamp >= self.period_finish:
             self.reward_rate = reward / self.rewards_duration
         else:
@@ -49,7 +61,10 @@ class StakingRewards:
 
         self.last_update_time = current_timestamp
         self.period_finish = current_timestamp + self.rewards_duration
-        self.update_reward("deployer")
+        self.update_reward("deployer", current_timestamp)
+
+        if self.journal is not None:
+            self.journal.log_add_rewards(self, reward, duration, current_timestamp)
 
     def stake(self, _from: str,  amount):
         assert amount > 0, "Cannot stake 0"
@@ -60,36 +75,47 @@ class StakingRewards:
         staking_total_for_user = self.balances.get(_from, 0) + amount
         assert staking_total_for_user <= provided_liquidity, "Not enough provided liquidity"
 
+        now = self.clock.time()
         self.total_supply += amount
         if not self.balances.get(_from):
             self.balances[_from] = amount
         else:
             self.balances[_from] += amount
-        self.update_reward(_from)
+        self.update_reward(_from, now)
+
+        if self.journal is not None:
+            self.journal.log_stake(self, _from, amount, now)
 
     def withdraw(self, _from, amount):
         assert amount > 0, "Cannot withdraw 0"
+        now = self.clock.time()
         self.total_supply -= amount
         self.balances[_from] -= amount
-        self.update_reward(_from)
+        self.update_reward(_from, now)
+
+        if self.journal is not None:
+            self.journal.log_withdraw(self, _from, amount, now)
 
     def get_reward(self, _from):
-        self.update_reward(_from)
+        now = self.clock.time()
+        self.update_reward(_from, now)
         reward = self.rewards[_from]
         if (reward > 0):
             self.rewards[_from] = 0
 
+        if self.journal is not None:
+            self.journal.log_get_reward(self, _from, now)
         return reward
 
-    def last_time_reward_applicable(self):
-        return min(time.time(), self.period_finish)
+    def last_time_reward_applicable(self, now=None):
+        return min(self.clock.time() if now is None else now, self.period_finish)
 
-    def _reward_per_token(self):
+    def _reward_per_token(self, now=None):
         if (self.total_supply == 0):
             return self.reward_per_token
 
         return self.reward_per_token + (
-            (self.last_time_reward_applicable() - self.last_update_time) * (self.reward_rate / self.total_supply)
+            (self.last_time_reward_applicable(now) - self.last_update_time) * (self.reward_rate / self.total_supply)
         )
 
     def earned(self, _from, debug=False):
@@ -98,22 +124,39 @@ class StakingRewards:
             were not optimized, since contracts have maximum size and operations inside
             the contracts result in taxes to users, implementations avoid using for-loops
         """
-        if not self.user_reward_per_token_paid.get(_from):
-            self.user_reward_per_token_paid[_from] = 0
-
-        if not self.balances.get(_from):
-            self.balances[_from] = 0
+        return self._earned(_from, self._reward_per_token())
 
-        if not self.rewards.get(_from):
-            self.rewards[_from] = 0
-
-        return self.balances[_from] * (
-            self._reward_per_token() - self.user_reward_per_token_paid[_from]
-        ) + self.rewards[_from]
-
-    def update_reward(self, _from):
-        self.reward_per_token = self._reward_per_token()
-        self.last_update_time = self.last_time_reward_applicable()
+    def earned_all(self, addresses=None):
+        """
+        Pending rewards of every staker, in the order of self.ledger.addresses, or of
+        the given addresses (0 for unknown ones), computed at once from the ledger
+        columns. Read-only, like earned.
+        """
+        ledger = self.ledger
+        balances = ledger.column("balances")
+        rewards = ledger.column("rewards")
+        paid = ledger.column("user_reward_per_token_paid")
+        earned = balances * (self._reward_per_token() - paid) + rewards
+        if addresses is None:
+            return earned
+
+        rows = ledger.lookup(addresses)
+        if earned.size == 0:
+            return np.zeros(len(rows), dtype=earned.dtype)
+        return np.where(rows >= 0, earned[np.maximum(rows, 0)], 0)
+
+    def _earned(self, _from, reward_per_token):
+        return self.balances.get(_from, 0) * (
+            reward_per_token - self.user_reward_per_token_paid.get(_from, 0)
+        ) + self.rewards.get(_from, 0)
+
+    def update_reward(self, _from, now=None):
+        """
+        All the reads of the clock in a call use the same timestamp, like block.timestamp
+        """
+        now = self.clock.time() if now is None else now
+        self.reward_per_token = self._reward_per_token(now)
+        self.last_update_time = self.last_time_reward_applicable(now)
 
-        self.rewards[_from] = self.earned(_from)
+        self.rewards[_from] = self._earned(_from, self.reward_per_token)
         self.user_reward_per_token_paid[_from] = self.reward_per_token
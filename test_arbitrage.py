@@ -0,0 +1,55 @@
+import pytest
+
+from arbitrage import ArbitrageDetector
+from lp import ERC20, Factory
+
+
+def setup():
+    factory = Factory("ETH pool factory", "0x1")
+    detector = ArbitrageDetector(factory)
+    pools = [
+        factory.create_exchange(ERC20(token0, f"0x{token0}"), ERC20(token1, f"0x{token1}"), token0 + token1)
+        for token0, token1 in (("A", "B"), ("B", "C"), ("C", "A"))
+    ]
+    for pool in pools:
+        pool.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+    return factory, detector, pools
+
+
+def cycle_output(opportunity, amount_in):
+    amount = amount_in
+    for exchange, token_in, _ in opportunity.hops:
+        amount = exchange.get_amount_out(amount, *exchange.get_reserves(token_in))
+    return amount
+
+
+def test_balanced_pools_have_no_arbitrage():
+    _, detector, pools = setup()
+    assert detector.opportunities == []
+    assert len(detector.cycles[pools[-1].name]) == 2
+
+
+def test_detects_cycle_after_trade_with_optimal_input():
+    _, detector, pools = setup()
+    found = []
+    detector.callbacks.append(found.append)
+
+    pools[0].swapExactTokensForTokens(600, 375, "rsarai")      # A/B reserves 1600/625
+
+    best = detector.opportunities[0]
+    assert found[0] is best
+    assert best.path == ["B", "A", "C", "B"]
+    assert best.amount_in == pytest.approx(625 / 7)
+    assert best.profit == pytest.approx(cycle_output(best, best.amount_in) - best.amount_in)
+    for amount_in in (0.9 * best.amount_in, 1.1 * best.amount_in):
+        assert cycle_output(best, amount_in) - amount_in < best.profit
+
+
+def test_cycles_are_rebuilt_when_pools_are_created():
+    factory, detector, pools = setup()
+    assert len(detector.cycles[pools[0].name]) == 2
+
+    factory.create_exchange(ERC20("A", "0xA"), ERC20("D", "0xD"), "AD")
+    factory.create_exchange(ERC20("D", "0xD"), ERC20("B", "0xB"), "DB")
+    assert len(detector.check(pools[0])) == 0
+    assert len(detector.cycles[pools[0].name]) == 4
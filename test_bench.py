@@ -0,0 +1,31 @@
+from bench import BENCHMARKS, compare, main, run_all
+
+
+def test_run_all_reports_every_scenario(tmp_path):
+    params = {"pools": 2, "holders": 4, "trades": 20, "seed": 0}
+    report = run_all(params)
+
+    assert set(report["results"]) == set(BENCHMARKS)
+    for result in report["results"].values():
+        assert result["ops_per_sec"] > 0
+        assert result["p50_us"] <= result["p99_us"]
+        assert result["peak_kib"] > 0
+    assert report["results"]["swapExactTokensForTokens"]["errors"] == 0
+
+    output = tmp_path / "results.json"
+    assert main(["--pools", "2", "--holders", "4", "--trades", "20", "--only", "earned", "--output", str(output)]) == 0
+    assert main(["--pools", "2", "--holders", "4", "--trades", "20", "--only", "earned", "--baseline", str(output),
+                 "--tolerance", "1000"]) == 0
+
+
+def test_compare_flags_regressions():
+    baseline = {"results": {"stake": {"ops_per_sec": 1000, "p99_us": 10, "peak_kib": 100}}}
+    report = {"results": {
+        "stake": {"ops_per_sec": 700, "p99_us": 11, "peak_kib": 200},
+        "earned": {"ops_per_sec": 1, "p99_us": 1, "peak_kib": 1},
+    }}
+
+    regressions = compare(report, baseline, tolerance=0.2)
+    assert len(regressions) == 2
+    assert regressions[0].startswith("stake: 700 op/s")
+    assert compare(report, baseline, tolerance=1) == []
@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+import snapshot
+from concentrated import ConcentratedExchange, sqrt_price_at
+from instrumentation import Metrics, instrument
+from journal import Journal
+from lp import ERC20, Factory
+from router import Router
+from service import ExchangeService
+from sharding import ShardedExecutor
+
+
+def setup(tick_spacing=1):
+    factory = Factory("ETH pool factory", "0x1")
+    pool = factory.create_exchange(ERC20("USDC", "0x1c"), ERC20("DAI", "0xda"), "USDC-DAI", kind="concentrated",
+                                   tick_spacing=tick_spacing)
+    return factory, pool
+
+
+def test_full_range_position_trades_like_constant_product():
+    _, pool = setup()
+    assert isinstance(pool, ConcentratedExchange)
+    amount0, amount1 = pool.add_liquidity("rsarai", 1000, 1000, 999, 999)
+    assert (amount0, amount1) == (pytest.approx(1000), pytest.approx(1000))
+    assert pool.liquidity_providers["rsarai"] == pytest.approx(1000)
+
+    assert pool.get_amount_out(600) == pytest.approx(375)
+    assert pool.swapExactTokensForTokens(600, 374, "rsarai") == pytest.approx(375)
+    assert (pool.reserve0, pool.reserve1) == (pytest.approx(1600), pytest.approx(625))
+    assert pool.price == pytest.approx(625 / 1600)
+
+    amount0, amount1 = pool.remove_liquidity("rsarai", 10_000, 0, 0)
+    assert (amount0, amount1) == (pytest.approx(1600), pytest.approx(625))
+    assert pool.liquidity == pytest.approx(0, abs=1e-9)
+    assert pool.ticks == []
+
+
+def test_concentrated_position_is_deeper_and_crosses_ticks():
+    _, pool = setup(tick_spacing=10)
+    pool.add_liquidity("rsarai", 1000, 1000, 0, 0)                      # full range, sets the price to 1
+    pool.add_liquidity("alice", 1000, 1000, 0, 0, tick_lower=-100, tick_upper=100)
+    assert pool.ticks == [-887270, -100, 100, 887270]
+    in_range = pool.liquidity
+
+    # a small trade stays in the range, much less slippage than the full range alone
+    assert pool.get_amount_out(10) > 10 * 1000 / 1010
+    assert pool.tick == 0
+
+    # a large one crosses -100, where alice's liquidity stops trading
+    amount_out = pool.swapExactTokensForTokens(2000, 0, "bob")
+    assert pool.tick < -100
+    assert pool.liquidity == pytest.approx(in_range - pool.positions[("alice", -100, 100)])
+    assert pool.sqrt_price < sqrt_price_at(-100)
+    assert amount_out < 2000
+
+    # and back up
+    pool.swapExactTokensForTokens(amount_out, 0, "bob", zero_for_one=False)
+    assert pool.tick >= -100
+    assert pool.liquidity == pytest.approx(in_range)
+
+
+def test_swap_beyond_the_liquidity_is_rejected():
+    _, pool = setup(tick_spacing=10)
+    pool.add_liquidity("alice", 1000, 1000, 0, 0, tick_lower=-100, tick_upper=100)
+
+    with pytest.raises(AssertionError, match="UniswapV2Library: INSUFFICIENT_LIQUIDITY"):
+        pool.swapExactTokensForTokens(1_000_000, 0, "bob")
+    assert pool.tick == 0
+
+
+def test_router_trades_through_concentrated_pools():
+    factory, pool = setup()
+    pool.add_liquidity("rsarai", 1000, 1000, 0, 0)
+    other = factory.create_exchange(ERC20("DAI", "0xda"), ERC20("ETH", "0x09"), "DAI-ETH")
+    other.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+
+    router = Router(factory)
+    amounts = router.get_amounts_out(600, router.get_paths("ETH", "USDC")[0])
+    assert amounts[1] == pytest.approx(375)
+    assert amounts[2] == pytest.approx(pool.get_amount_out(375, *pool.get_reserves("DAI")))
+    assert amounts[2] < 375
+    assert router.swapExactTokensForTokens(600, 0, "ETH", "USDC", "bob") == amounts
+    assert pool.reserve1 == pytest.approx(1375)
+
+    with pytest.raises(Exception, match="Unknown pool kind"):
+        factory.create_exchange(ERC20("A", "0xa"), ERC20("B", "0xb"), "AB", kind="stable")
+
+
+def test_concentrated_pools_have_the_exchange_interface(tmp_path):
+    factory, pool = setup(tick_spacing=10)
+    pool.add_liquidity("rsarai", 1000, 1000, 0, 0)
+    pool.add_liquidity("alice", 1000, 1000, 0, 0, tick_lower=-100, tick_upper=100)
+
+    for amount_in in (10, 2000):        # within the range, then crossing -100
+        amount_out = pool.get_amount_out(amount_in)
+        assert pool.get_amount_in(amount_out) == pytest.approx(amount_in)
+        assert pool.get_amount_in(amount_in, *pool.get_reserves("DAI")) > 0
+    amounts_out, _, impacts = pool.price_impact([10, 2000])
+    assert amounts_out.tolist() == [pool.get_amount_out(10), pool.get_amount_out(2000)]
+    assert 0 < impacts[0] < impacts[1]
+
+    sequential = setup(tick_spacing=10)[1]
+    sequential.add_liquidity("rsarai", 1000, 1000, 0, 0)
+    sequential.add_liquidity("alice", 1000, 1000, 0, 0, tick_lower=-100, tick_upper=100)
+    expected = [sequential.swapExactTokensForTokens(amount, 0, "bob") for amount in (100, 1000)]
+    amounts_out, accepted, reserves = pool.swapExactTokensForTokensBatch([100, 100, 1000], [0, 10**9, 0], "bob")
+    assert accepted.tolist() == [True, False, True]
+    assert amounts_out[accepted].tolist() == expected
+    assert reserves == pytest.approx((sequential.reserve0, sequential.reserve1))
+
+    state = (pool.reserve0, pool.sqrt_price, pool.tick, list(pool.ticks), dict(pool.positions))
+    with pytest.raises(AssertionError, match="UniswapV2Router: INSUFFICIENT_OUTPUT_AMOUNT"):
+        pool.multicall([
+            ("add_liquidity", "bob", 100, 100, 0, 0, -50, 50),
+            ("swapExactTokensForTokens", 10, 1000, "bob"),
+        ])
+    assert (pool.reserve0, pool.sqrt_price, pool.tick, pool.ticks, pool.positions) == state
+    assert "bob" not in pool.liquidity_providers
+
+    metrics = Metrics()
+    instrument(pool, metrics)
+    assert asyncio.run(ExchangeService(factory).quote(pool.name, 10)) == pytest.approx(pool.get_amount_out(10))
+    assert metrics.snapshot()["calls"][pool.name]["price_impact"] == 1
+
+    with pytest.raises(AssertionError, match="Snapshots store constant product pools"):
+        snapshot.dump(factory, tmp_path / "pools.snapshot")
+    with pytest.raises(AssertionError, match="Only constant product pools can be copied to shard processes"):
+        ShardedExecutor(factory, backend="process")
+    with Journal(tmp_path / "journal.bin") as journal:
+        with pytest.raises(AssertionError, match="Only constant product pools are journaled"):
+            Factory("ETH pool factory", "0x1", journal=journal).create_exchange(
+                ERC20("USDC", "0x1c"), ERC20("DAI", "0xda"), "USDC-DAI", kind="concentrated"
+            )
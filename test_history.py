@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from clock import ManualClock
+from history import HistoryRecorder, ReserveHistory
+from lp import Factory
+from main import create_exchange
+
+
+def setup(**options):
+    clock = ManualClock(1000)
+    factory = Factory("ETH pool factory", "0x1", clock=clock)
+    recorder = HistoryRecorder(factory, **options)
+    lp = create_exchange("test-coin", "0x111", "TST1", factory)
+    lp.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+    return clock, recorder, lp
+
+
+def test_as_of_returns_the_state_at_a_time():
+    clock, recorder, lp = setup()
+    clock.advance(100)
+    lp.swapExactTokensForTokens(600, 375, "rsarai")     # reserves 1600/625
+    clock.advance(100)
+    lp.add_liquidity("newcomer", 160, 62.5, 0, 0)
+
+    assert recorder.as_of(lp, 1000) == (1000, 1000, 1000)
+    assert recorder.as_of(lp, 1150) == (1600, 625, 1000)
+    assert recorder.as_of(lp, 1200) == (1760, 687.5, lp.total_supply)
+    with pytest.raises(AssertionError, match="History: OLD"):
+        recorder.as_of(lp, 999)
+
+    rows = recorder.range(lp, 1100, 1300)
+    assert rows["timestamp"].tolist() == [1100, 1200]
+    assert rows["reserve1"].tolist() == [625, 687.5]
+    assert np.shares_memory(rows["reserve0"], recorder.histories[lp.name].columns["reserve0"])
+
+
+def test_sealed_segments_spill_to_memory_mapped_files(tmp_path):
+    history = ReserveHistory(segment_size=4, spill_dir=tmp_path)
+    for timestamp in range(10):
+        history.append(timestamp, timestamp, 100 - timestamp, 10)
+
+    assert len(history) == 10
+    assert len(history.sealed) == 2
+    assert isinstance(history.sealed[0]["reserve0"], np.memmap)
+    assert history.as_of(5.5) == (5, 95, 10)
+    assert history.as_of(100) == (9, 91, 10)
+
+    assert [len(view["timestamp"]) for view in history.segments(2, 9)] == [2, 4, 1]
+    assert history.range(2, 9)["reserve0"].tolist() == [2, 3, 4, 5, 6, 7, 8]
+    assert history.range(5, 7)["reserve0"].tolist() == [5, 6]
+    assert len(history.range(20, 30)["timestamp"]) == 0
+
+def test_histories_sharing_a_spill_dir_keep_their_own_files(tmp_path):
+    histories = [ReserveHistory(segment_size=2, spill_dir=tmp_path) for _ in range(2)]
+    for offset, history in enumerate(histories):
+        for timestamp in range(4):
+            history.append(timestamp, 100 * offset + timestamp, 1, 1)
+
+    assert histories[0].directory != histories[1].directory
+    assert len(list(tmp_path.iterdir())) == 2
+    assert [history.as_of(1)[0] for history in histories] == [1, 101]
+
+
+def test_integer_pools_keep_exact_history(tmp_path):
+    clock = ManualClock(1000)
+    factory = Factory("ETH pool factory", "0x1", numeric="integer", clock=clock)
+    recorder = HistoryRecorder(factory, segment_size=2, spill_dir=tmp_path)
+    lp = create_exchange("test-coin", "0x111", "TST1", factory)
+    lp.add_liquidity("rsarai", 10**24 + 1, 10**24, 1, 1)
+    for _ in range(3):
+        clock.advance(100)
+        lp.swapExactTokensForTokens(10**6, 1, "garrincha")
+
+    history = recorder.histories[lp.name]
+    assert len(history.sealed) == 1
+    assert isinstance(history.sealed[0]["timestamp"], np.memmap)
+    assert recorder.as_of(lp, 1000)[0] == 10**24 + 1
+    assert recorder.as_of(lp, 1300) == (lp.reserve0, lp.reserve1, lp.total_supply)
+    assert recorder.range(lp, 1000, 1100)["reserve0"].tolist() == [10**24 + 1]
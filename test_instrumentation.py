@@ -0,0 +1,66 @@
+import pytest
+
+from instrumentation import Metrics, disable, enable, instrument, uninstrument
+from lp import Exchange, Factory
+from main import create_exchange, create_staking_rewards
+
+
+def setup():
+    factory = Factory("ETH pool factory", "0x1")
+    lp = create_exchange("test-coin", "0x111", "TST1", factory)
+    other = create_exchange("other-coin", "0x222", "OTH1", factory)
+    lp.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+    other.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+    return lp, other
+
+
+def test_instrument_single_pool():
+    lp, other = setup()
+    metrics = Metrics()
+    instrument(lp, metrics)
+
+    lp.swapExactTokensForTokens(600, 375, "rsarai")
+    other.swapExactTokensForTokens(600, 375, "rsarai")
+    with pytest.raises(AssertionError):
+        lp.swapExactTokensForTokens(10, 1000, "rsarai")
+
+    snapshot = metrics.snapshot()
+    assert list(snapshot["calls"]) == ["test-coin/ETH"]
+    assert snapshot["calls"]["test-coin/ETH"]["swapExactTokensForTokens"] == 2
+    assert snapshot["calls"]["test-coin/ETH"]["swap"] == 1
+    assert snapshot["failures"] == {
+        "test-coin/ETH": {"swapExactTokensForTokens": {"UniswapV2Router: INSUFFICIENT_OUTPUT_AMOUNT": 1}}
+    }
+    latency = snapshot["latency"]["test-coin/ETH"]["swap"]
+    assert latency["count"] == 1 and latency["p50_ns"] >= 128
+
+    uninstrument(lp)
+    assert type(lp) is Exchange
+    lp.swapExactTokensForTokens(400, 125, "rsarai")
+    assert metrics.snapshot()["calls"]["test-coin/ETH"]["swapExactTokensForTokens"] == 2
+
+
+def test_enable_globally_and_prometheus_dump(tmp_path):
+    lp, other = setup()
+    metrics = Metrics()
+    get_amount_out = Exchange.get_amount_out
+    enable(metrics)
+    try:
+        staking = create_staking_rewards(lp, 1_000_000)
+        staking.stake("rsarai", 10)
+        other.get_amount_out(10)
+    finally:
+        disable()
+    other.get_amount_out(10)
+
+    snapshot = metrics.snapshot()
+    assert snapshot["calls"]["test-coin/ETH:staking"] == {"add_rewards": 1, "stake": 1}
+    assert snapshot["calls"]["other-coin/ETH"] == {"get_amount_out": 1}
+    assert Exchange.get_amount_out is get_amount_out
+
+    path = tmp_path / "metrics.prom"
+    metrics.write_prometheus(path)
+    text = path.read_text()
+    assert 'lp_calls_total{target="other-coin/ETH",method="get_amount_out"} 1' in text
+    assert 'lp_latency_seconds_bucket{target="test-coin/ETH:staking",method="stake",le="+Inf"} 1' in text
+    assert "# TYPE lp_assertion_failures_total counter" in text
@@ -0,0 +1,145 @@
+import pytest
+from freezegun import freeze_time
+
+from lp import Factory, ERC20
+from main import create_exchange
+from staking_rewards import StakingRewards
+from journal import Journal, RECORD_SIZE, recover
+from router import Router
+from numeric import to_wei
+
+
+def test_recover_replays_pools_and_staking(tmp_path):
+    path = tmp_path / "journal.bin"
+    with Journal(path, group_size=4) as journal:
+        factory = Factory("ETH pool factory", "0x1", journal=journal)
+        lp = create_exchange("test-coin", "0x111", "TST1", factory)
+        other = create_exchange("other-coin", "0x222", "OTH1", factory)
+
+        with freeze_time('2022-08-20 14:49:07'):
+            lp.add_liquidity("rsarai", 50000, 50000, 50000, 50000)
+            lp.add_liquidity("garrincha", 1000, 1000, 1000, 1000)
+            other.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+            st = StakingRewards(lp, journal=journal)
+            st.add_rewards(1_000_000)
+            st.stake("rsarai", 30000.0)
+
+        with freeze_time('2022-08-20 14:49:12'):
+            lp.swapExactTokensForTokens(50, 30, "x")
+            with pytest.raises(Exception, match="UniswapV2Router: INSUFFICIENT_OUTPUT_AMOUNT"):
+                other.swapExactTokensForTokens(600, 600, "x")
+            st.stake("garrincha", 500.0)
+            lp.remove_liquidity("garrincha", 200, 1, 1)
+
+        with freeze_time('2022-09-01 10:00:00'):
+            st.withdraw("rsarai", 10000.0)
+            st.get_reward("rsarai")
+
+    recovered, (recovered_st,) = recover(path)
+    recovered_lp, recovered_other = recovered.all_pairs
+
+    assert (recovered_lp.reserve0, recovered_lp.reserve1) == (lp.reserve0, lp.reserve1)
+    assert (recovered_other.reserve0, recovered_other.reserve1) == (other.reserve0, other.reserve1)
+    assert recovered_lp.liquidity_providers == lp.liquidity_providers
+    assert recovered_lp.total_supply == lp.total_supply
+    assert recovered.exchange_to_tokens[lp.name]["test-coin"].token_addr == "0x111"
+
+    for attribute in ("reward_rate", "reward_per_token", "last_update_time", "period_finish", "total_supply",
+                      "balances", "rewards", "user_reward_per_token_paid"):
+        assert getattr(recovered_st, attribute) == getattr(st, attribute)
+
+def test_integer_amounts_are_logged_exactly(tmp_path):
+    path = tmp_path / "journal.bin"
+    with Journal(path) as journal:
+        factory = Factory("ETH pool factory", "0x1", numeric="integer", journal=journal)
+        lp = factory.create_exchange(ERC20("test-coin", "0x111"), ERC20("ETH", "0x09"), "TST1")
+        lp.add_liquidity("rsarai", to_wei(10**9), to_wei(3), 1, 1)
+        lp.swapExactTokensForTokens(to_wei(0.123456789), 1, "x")
+        assert path.stat().st_size == 0
+
+    assert path.stat().st_size % RECORD_SIZE == 0
+    recovered, _ = recover(path)
+    assert recovered.numeric.name == "integer"
+    assert (recovered.all_pairs[0].reserve0, recovered.all_pairs[0].reserve1) == (lp.reserve0, lp.reserve1)
+
+def test_failed_multicall_is_not_journaled(tmp_path):
+    path = tmp_path / "journal.bin"
+    with Journal(path, group_size=1) as journal:
+        factory = Factory("ETH pool factory", "0x1", journal=journal)
+        lp = create_exchange("test-coin", "0x111", "TST1", factory)
+        lp.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+        size = path.stat().st_size
+
+        with pytest.raises(AssertionError, match="UniswapV2Router: INSUFFICIENT_OUTPUT_AMOUNT"):
+            lp.multicall([
+                ("add_liquidity", "newcomer", 100, 100, 100, 100),
+                ("swapExactTokensForTokens", 100, 1000, "newcomer"),
+            ])
+        assert path.stat().st_size == size
+        lp.multicall([("swapExactTokensForTokens", 600, 375, "garrincha")])
+
+    recovered, _ = recover(path)
+    assert recovered.all_pairs[0].liquidity_providers == lp.liquidity_providers
+    assert (recovered.all_pairs[0].reserve0, recovered.all_pairs[0].reserve1) == (1600, 625)
+
+def test_reopened_journal_keeps_its_ids(tmp_path):
+    path = tmp_path / "journal.bin"
+    with Journal(path) as journal:
+        factory = Factory("ETH pool factory", "0x1", journal=journal)
+        lp = create_exchange("test-coin", "0x111", "TST1", factory)
+        lp.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+        st = StakingRewards(lp, journal=journal)
+        st.stake("rsarai", 100.0)
+    with open(path, "ab") as file:
+        file.write(b"\1" * (RECORD_SIZE // 2))      # cut short by a crash
+
+    with Journal(path) as journal:
+        assert path.stat().st_size % RECORD_SIZE == 0
+        factory, (st,) = recover(path, journal=journal)
+        lp = factory.all_pairs[0]
+        create_exchange("other-coin", "0x222", "OTH1", factory).add_liquidity("garrincha", 500, 500, 500, 500)
+        lp.swapExactTokensForTokens(600, 375, "garrincha")
+        lp.add_liquidity("garrincha", 100, 100, 1, 1)
+        st.stake("garrincha", 50.0)
+
+    recovered, (recovered_st,) = recover(path)
+    assert [(pool.name, pool.reserve0, pool.reserve1) for pool in recovered.all_pairs] == \
+        [(pool.name, pool.reserve0, pool.reserve1) for pool in factory.all_pairs]
+    assert recovered.all_pairs[0].get_tokens()["ETH"].balances == lp.get_tokens()["ETH"].balances
+    assert recovered_st.balances == st.balances == {"rsarai": 100.0, "garrincha": 50.0}
+
+
+@pytest.mark.parametrize("numeric", ["float", "integer"])
+def test_every_trade_is_journaled(tmp_path, numeric):
+    path = tmp_path / "journal.bin"
+    with Journal(path) as journal:
+        factory = Factory("ETH pool factory", "0x1", numeric=numeric, journal=journal)
+        lp = create_exchange("test-coin", "0x111", "TST1", factory)
+        other = factory.create_exchange(ERC20("other-coin", "0x222"), ERC20("test-coin", "0x111"), "OTH1")
+        lp.add_liquidity("rsarai", 100000, 100000, 1, 1)
+        other.add_liquidity("rsarai", 100000, 100000, 1, 1)
+        lp.set_fee(5)
+
+        for amount in (100, 200, 300):
+            lp.swapExactTokensForTokens(amount, 1, "garrincha")
+        lp.swapExactTokensForTokensBatch([400, 500, 10**6], [1, 1, 1], "garrincha")
+        Router(factory).swapExactTokensForTokens(1000, 1, "other-coin", "ETH", "garrincha")
+
+        tokens = lp.get_tokens()
+        tokens["test-coin"].deposit("pele", 1000)
+        lp.swap(0, lp.get_amount_out(1000), "pele")
+        tokens["test-coin"].deposit("pele", 2000)
+        tokens["ETH"].deposit("pele", 2000)
+        lp.mint("pele", 2000, 2000)
+        lp.burn("pele", 100, 100, 100)
+
+    recovered, _ = recover(path)
+    for pool, recovered_pool in zip(factory.all_pairs, recovered.all_pairs):
+        for attribute in ("reserve0", "reserve1", "total_supply", "fee", "fee_growth0", "fee_growth1"):
+            assert getattr(recovered_pool, attribute) == getattr(pool, attribute)
+        assert recovered_pool.liquidity_providers == pool.liquidity_providers
+        for address in ("rsarai", "pele"):
+            assert recovered_pool.fees_earned(address) == pool.fees_earned(address)
+    assert lp.fees_earned("rsarai")[0] > 0
+    for name, token in lp.get_tokens().items():
+        assert recovered.all_pairs[0].get_tokens()[name].balances == token.balances
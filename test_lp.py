@@ -1,7 +1,11 @@
+import random
+from fractions import Fraction
+
 import pytest
 
+from clock import ManualClock
 from main import create_exchange
-from lp import Factory
+from lp import ERC20, Factory
 
 def test_create_liquidity_pool():
     factory = Factory("ETH pool factory", "0x1")
@@ -222,3 +226,351 @@ def test_get_amount_out():
     assert lp.get_amount_out(35) == pytest.approx(33.81, 0.01)
     assert lp.get_amount_out(209) == pytest.approx(172.87, 0.01)
     assert lp.get_amount_out(13) == pytest.approx(12.83, 0.01)
+
+def test_swapExactTokensForTokensBatch_matches_single_swaps():
+    factory = Factory("ETH pool factory", "0x1")
+    lp = create_exchange("test-coin", "0x111", "TST1", factory)
+    lp.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+
+    amounts1_out, accepted, reserves = lp.swapExactTokensForTokensBatch([600, 400], [375, 125], "rsarai")
+    assert accepted.tolist() == [True, True]
+    assert amounts1_out.tolist() == pytest.approx([375, 125])
+    assert reserves == pytest.approx((2000, 500))
+    assert lp.reserve0 == pytest.approx(2000)
+    assert lp.reserve1 == pytest.approx(500)
+
+def test_swapExactTokensForTokensBatch_rejects_trades_below_min():
+    factory = Factory("ETH pool factory", "0x1")
+    lp = create_exchange("test-coin", "0x111", "TST1", factory)
+    lp.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+
+    single = create_exchange("test-coin", "0x111", "TST1", Factory("ETH pool factory", "0x1"))
+    single.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+
+    amounts0_in = [600, 0, 400, 500, 2000]
+    amounts1_out_min = [375, 1, 125, 200, 250]
+    expected = []
+    for amount0_in, amount1_out_min in zip(amounts0_in, amounts1_out_min):
+        try:
+            expected.append(single.swapExactTokensForTokens(amount0_in, amount1_out_min, "rsarai"))
+        except AssertionError:
+            expected.append(0)
+
+    amounts1_out, accepted, reserves = lp.swapExactTokensForTokensBatch(amounts0_in, amounts1_out_min, "rsarai")
+    assert accepted.tolist() == [True, False, True, False, True]
+    assert amounts1_out.tolist() == pytest.approx(expected)
+    assert reserves == pytest.approx((single.reserve0, single.reserve1))
+
+def test_price_impact():
+    factory = Factory("ETH pool factory", "0x1")
+    lp = create_exchange("test-coin", "0x111", "TST1", factory)
+    lp.add_liquidity("rsarai", 1000, 4000, 1000, 4000)
+
+    amounts_out, effective_prices, price_impacts = lp.price_impact([50, 135, 1000])
+    assert amounts_out.tolist() == pytest.approx([lp.get_amount_out(50), lp.get_amount_out(135), 2000])
+    assert effective_prices[2] == pytest.approx(2)
+    assert price_impacts[2] == pytest.approx(0.5)
+    assert lp.reserve0 == 1000
+    assert lp.reserve1 == 4000
+
+    amounts_out, effective_prices, price_impacts = lp.price_impact([4000], zero_for_one=False)
+    assert amounts_out.tolist() == pytest.approx([500])
+    assert price_impacts.tolist() == pytest.approx([0.5])
+
+    with pytest.raises(Exception, match="UniswapV2Library: INSUFFICIENT_INPUT_AMOUNT"):
+        lp.price_impact([10, 0])
+
+def test_factory_pair_index():
+    factory = Factory("ETH pool factory", "0x1")
+    tst = create_exchange("test-coin", "0x111", "TST1", factory)
+    other = create_exchange("other-coin", "0x222", "OTH1", factory)
+
+    assert factory.get_pair("test-coin", "ETH") is tst
+    assert factory.get_pair("ETH", "test-coin") is tst
+    assert factory.get_pair("test-coin", "other-coin") is None
+    assert list(factory.get_pairs("ETH")) == [tst, other]
+    assert list(factory.get_pairs("other-coin")) == [other]
+    assert factory.get_exchange("ETH") is tst
+    assert factory.get_token(other.name)["other-coin"].token_addr == "0x222"
+    assert factory.get_exchange("other-coin") is other
+    assert factory.token_count() == 2
+    assert factory.distinct_token_count() == 3
+    assert factory.pair_count() == 2
+
+def test_erc20_holder_balances():
+    factory = Factory("ETH pool factory", "0x1")
+    lp = create_exchange("test-coin", "0x111", "TST1", factory)
+    tokens = lp.get_tokens()
+    tokens["test-coin"].mint("rsarai", 2000)
+    tokens["ETH"].mint("rsarai", 1000)
+
+    lp.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+    lp.swapExactTokensForTokens(600, 375, "rsarai")
+    assert tokens["test-coin"].balance_of("rsarai") == 400
+    assert tokens["ETH"].balance_of("rsarai") == pytest.approx(375)
+    assert tokens["ETH"].balance_of("nobody") == 0
+
+    tokens["test-coin"].transfer_from("rsarai", "alice", 100)
+    assert tokens["test-coin"].balance_of("alice") == 100
+    with pytest.raises(AssertionError, match="ERC20: transfer amount exceeds balance"):
+        tokens["test-coin"].transfer_from("alice", "bob", 101)
+
+def test_erc20_batch_transfer_is_all_or_nothing():
+    token = ERC20("test-coin", "0x111")
+    token.mint("alice", 100)
+    token.mint("bob", 50)
+
+    token.batch_transfer(["alice", "alice", "bob"], ["bob", "carol", "carol"], [60, 40, 50])
+    assert (token.balance_of("alice"), token.balance_of("bob"), token.balance_of("carol")) == (0, 60, 90)
+
+    with pytest.raises(AssertionError, match="ERC20: transfer amount exceeds balance"):
+        token.batch_transfer(["carol", "carol", "dave"], ["alice", "alice", "alice"], [50, 40, 1])
+    assert token.balance_of("carol") == 90
+
+def test_erc20_balances_are_exact_in_integer_mode():
+    factory = Factory("ETH pool factory", "0x1", numeric="integer")
+    lp = create_exchange("test-coin", "0x111", "TST1", factory)
+    token = lp.get_tokens()["test-coin"]
+    token.mint("rsarai", 10**30 + 1)
+    token.batch_transfer(["rsarai"], ["alice"], [10**30])
+    assert token.balance_of("rsarai") == 1
+    assert token.balance_of("alice") == 10**30
+
+def test_ledgers_move_from_dicts_to_arrays():
+    from ledger import AddressRegistry, ArrayLedger
+
+    registry = AddressRegistry()
+    ledger = ArrayLedger(registry=registry, threshold=2)
+    balances = ledger.mapping("balances")
+    balances["a"] = 1
+    balances.add("b", 2)
+    assert ledger.values is None and len(registry) == 0
+
+    ledger.begin()
+    balances["c"] = 3
+    ledger.rollback()
+    assert ledger.values is None and dict(balances) == {"a": 1, "b": 2}
+
+    balances["c"] = 3
+    assert ledger.dicts is None
+    assert ledger.values["balances"][registry.find("c")] == 3
+    assert balances.get("c") == 3 and "d" not in balances
+
+    ledger.begin()
+    del balances["a"]
+    balances.add("d", 4)
+    ledger.mapping("rewards")["b"] = 5
+    ledger.rollback()
+    assert dict(balances) == {"a": 1, "b": 2, "c": 3}
+    assert ledger.addresses == ["a", "b", "c"]
+    assert ledger.lookup(["c", "x", "a"]).tolist() == [2, -1, 0]
+    assert ledger.gather("balances", ["c", "x"]).tolist() == [3, 0]
+
+    ledger.mapping("rewards")["b"] = 5
+    assert ledger.column("rewards").tolist() == [0, 5, 0]
+
+    for address in range(100):
+        registry.id(str(address))
+    sparse = ArrayLedger(registry=registry, threshold=2)
+    for address in ("x", "y", "z"):
+        sparse.add("balances", address, 1)
+    assert sparse.values is None and sparse.threshold == 4
+
+    factory = Factory("ETH pool factory", "0x1")
+    lp = create_exchange("test-coin", "0x111", "TST1", factory)
+    lp.add_liquidity("rsarai", 100, 100, 100, 100)
+    assert lp.liquidity_providers == {"0": 10, "rsarai": 90}
+
+def test_quote_cache_is_invalidated_by_reserve_changes():
+    assert Factory("ETH pool factory", "0x1").quote_cache is None
+    factory = Factory("ETH pool factory", "0x1", quote_cache_size=2)
+    lp = create_exchange("test-coin", "0x111", "TST1", factory)
+    lp.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+    cache = factory.quote_cache
+
+    assert lp.get_amount_out(600) == lp.get_amount_out(600) == pytest.approx(375)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    lp.swapExactTokensForTokens(600, 375, "rsarai")
+    assert cache.hits == 2
+    assert lp.get_amount_out(400) == pytest.approx(125)
+    assert lp.get_amount_out(500, lp.reserve1, lp.reserve0) == pytest.approx(6400 / 9)
+    assert (cache.misses, cache.evictions, len(cache.entries)) == (3, 1, 2)
+
+    assert lp.get_amount_out(400, 1, 1) == pytest.approx(400 / 401)
+    assert cache.misses == 3
+
+def test_trade_sizing_solvers():
+    factory = Factory("ETH pool factory", "0x1")
+    lp = create_exchange("test-coin", "0x111", "TST1", factory)
+    lp.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+
+    amount_in = lp.get_amount_in_for_price(625 / 1600)
+    assert amount_in == pytest.approx(600)
+    assert lp.get_amount_in_for_price(2) == 0
+    assert lp.get_amount_in_for_price(0.25, zero_for_one=False) == pytest.approx(1000)
+
+    amount_in = lp.get_amount_in_for_slippage(0.2)
+    assert amount_in == pytest.approx(250)
+    _, _, price_impacts = lp.price_impact([amount_in])
+    assert price_impacts[0] == pytest.approx(0.2)
+
+    lp.fee = 3
+    amount_in = lp.get_amount_in_for_price(0.5)
+    amount_out = amount_in * lp.gamma * 1000 / (1000 + amount_in * lp.gamma)
+    assert (1000 - amount_out) / (1000 + amount_in) == pytest.approx(0.5)
+
+    integer = create_exchange("test-coin", "0x111", "TST1", Factory("ETH pool factory", "0x1", numeric="integer"))
+    integer.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+    assert integer.get_amount_in_for_slippage(0.2) == 250
+
+def test_trade_sizing_exact_at_wei_scale():
+    rng = random.Random(22)
+    integer = create_exchange("test-coin", "0x111", "TST1", Factory("ETH pool factory", "0x1", numeric="integer"))
+    integer.add_liquidity("rsarai", 10**18, 10**18, 10**18, 10**18)
+    for _ in range(200):
+        reserve_in, reserve_out = rng.randrange(10**18, 10**26), rng.randrange(10**18, 10**26)
+        integer.reserve0, integer.reserve1 = reserve_in, reserve_out
+        target = reserve_out / reserve_in * rng.uniform(0.01, 1)
+        amount_in = integer.get_amount_in_for_price(target)
+        assert isinstance(amount_in, int)
+
+        amount_out = integer.get_amount_out(amount_in) if amount_in else 0
+        assert Fraction(reserve_out - amount_out, reserve_in + amount_in) >= Fraction(target)
+        # one more wei would cross the target, even without rounding the output down
+        amount_in += 1
+        amount_out = Fraction(amount_in * (1000 - integer.fee) * reserve_out, reserve_in * 1000 + amount_in * (1000 - integer.fee))
+        assert (reserve_out - amount_out) / (reserve_in + amount_in) < Fraction(target)
+
+def test_slippage_sizing_exact_at_wei_scale():
+    rng = random.Random(22)
+    integer = create_exchange("test-coin", "0x111", "TST1", Factory("ETH pool factory", "0x1", numeric="integer"))
+    integer.add_liquidity("rsarai", 10**18, 10**18, 10**18, 10**18)
+    integer.fee = 3
+
+    def impact(amount_in):
+        amount_out = integer.price_impact([amount_in])[0][0]
+        return 1 - Fraction(amount_out * 1000 * reserve_in, amount_in * (1000 - integer.fee) * reserve_out)
+
+    for _ in range(200):
+        reserve_in, reserve_out = rng.randrange(10**18, 10**26), rng.randrange(10**18, 10**26)
+        integer.reserve0, integer.reserve1 = reserve_in, reserve_out
+        max_slippage = rng.uniform(0.001, 0.5)
+        amount_in = integer.get_amount_in_for_slippage(max_slippage)
+        assert isinstance(amount_in, int)
+        assert impact(amount_in) <= Fraction(max_slippage) < impact(amount_in + 1)
+
+def test_multicall_commits_all_or_nothing():
+    factory = Factory("ETH pool factory", "0x1")
+    lp = create_exchange("test-coin", "0x111", "TST1", factory)
+    lp.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+    tokens = lp.get_tokens()
+    before = (
+        lp.reserve0, lp.reserve1, lp.total_supply, dict(lp.liquidity_providers),
+        tokens["test-coin"].total, dict(tokens["test-coin"].balances), dict(tokens["ETH"].balances),
+    )
+
+    with pytest.raises(AssertionError, match="UniswapV2Router: INSUFFICIENT_OUTPUT_AMOUNT"):
+        lp.multicall([
+            ("remove_liquidity", "rsarai", 490, 1, 1),
+            ("add_liquidity", "newcomer", 100, 100, 100, 100),
+            ("swapExactTokensForTokens", 100, 1000, "rsarai"),
+        ])
+    after = (
+        lp.reserve0, lp.reserve1, lp.total_supply, dict(lp.liquidity_providers),
+        tokens["test-coin"].total, dict(tokens["test-coin"].balances), dict(tokens["ETH"].balances),
+    )
+    assert after == before
+    assert "newcomer" not in lp.liquidity_providers
+    assert lp.get_amount_out(600) == pytest.approx(375)
+
+    results = lp.multicall([
+        ("swapExactTokensForTokens", 600, 375, "rsarai"),
+        ("add_liquidity", "newcomer", 160, 62.5, 160, 62.5),
+    ])
+    assert results[0] == pytest.approx(375)
+    assert (lp.reserve0, lp.reserve1) == (1760, 687.5)
+    assert lp.liquidity_providers["newcomer"] == pytest.approx(1000 / 11)    # same as calling them one by one
+
+    with pytest.raises(AssertionError, match="Multicall: INVALID_METHOD"):
+        lp.multicall([("info",)])
+
+
+def test_multicall_updates_the_pool_once():
+    factory = Factory("ETH pool factory", "0x1", quote_cache_size=16, clock=ManualClock(100))
+    lp = create_exchange("test-coin", "0x111", "TST1", factory)
+    lp.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+    updates = []
+    factory.listeners.append(lambda exchange: updates.append((exchange.reserve0, exchange.reserve1)))
+    version = lp.version
+    factory.clock.advance(10)
+    assert lp.get_amount_out(400) == pytest.approx(1000 * 400 / 1400)     # cached at the current version
+
+    lp.multicall([
+        ("swapExactTokensForTokens", 600, 375, "rsarai"),
+        ("swapExactTokensForTokens", 400, 125, "rsarai"),     # quoted against the reserves the first one left
+    ])
+    assert updates == [(2000, 500)]
+    assert lp.version == version + 1
+    assert (lp.price0_cumulative_last, lp.block_timestamp_last) == (10, 110)     # price 1 over the 10 seconds
+
+
+def test_fee_is_charged_and_accrued_to_providers():
+    factory = Factory("ETH pool factory", "0x1")
+    lp = create_exchange("test-coin", "0x111", "TST1", factory)
+    lp.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+    lp.fee = 500    # half of the input, so the numbers stay exact in floats
+
+    assert lp.get_amount_out(2000) == 500
+    assert lp.get_amount_in(500) == 2000
+    assert lp.swapExactTokensForTokens(2000, 500, "garrincha") == 500
+    assert lp.fee_growth0 == 1      # 1000 of fee over 1000 of liquidity
+    assert lp.fees_earned("rsarai") == (990, 0)
+    assert lp.fees_earned("0") == (10, 0)
+
+    lp.add_liquidity("newcomer", 300, 50, 0, 0)
+    assert lp.fees_earned("newcomer") == (0, 0)
+    assert lp.fees_earned("nobody") == (0, 0)
+    _, _, price_impacts = lp.price_impact([lp.get_amount_in_for_slippage(0.2)])
+    assert price_impacts[0] == pytest.approx(0.2)
+
+
+def test_fee_accrual_in_integer_mode():
+    factory = Factory("ETH pool factory", "0x1", numeric="integer")
+    lp = create_exchange("test-coin", "0x111", "TST1", factory)
+    lp.add_liquidity("rsarai", 10**12, 10**12, 0, 0)
+    lp.fee = 3
+
+    k = lp.reserve0 * lp.reserve1
+    lp.swapExactTokensForTokens(10**9, 0, "garrincha")
+    lp.add_liquidity("newcomer", 10**11, 10**11, 0, 0)
+    _, accepted, _ = lp.swapExactTokensForTokensBatch([10**9, 2 * 10**9], 0, "garrincha")
+    assert accepted.all() and lp.reserve0 * lp.reserve1 > k
+
+    share = lp.liquidity_providers["newcomer"] / lp.total_supply
+    rsarai, _ = lp.fees_earned("rsarai")
+    newcomer, _ = lp.fees_earned("newcomer")
+    lp.remove_liquidity("newcomer", lp.liquidity_providers["newcomer"], 0, 0)
+    assert lp.fees_earned("newcomer")[0] == newcomer     # settled, nothing more to earn
+    fees = 4 * 10**9 * 3 // 1000
+    assert fees - 2 <= rsarai + newcomer + lp.fees_earned("0")[0] <= fees
+    assert newcomer == pytest.approx(3 * 10**9 * 3 / 1000 * share, rel=1e-6)
+
+
+def test_batch_swaps_with_fee_match_single_swaps():
+    factory = Factory("ETH pool factory", "0x1")
+    lp = create_exchange("test-coin", "0x111", "TST1", factory)
+    lp.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+    lp.fee = 3
+
+    reserves = (lp.reserve0, lp.reserve1)
+    expected = []
+    for amount_in in (10, 20, 30):
+        expected.append(lp.get_amount_out(amount_in, *reserves))
+        reserves = (reserves[0] + amount_in, reserves[1] - expected[-1])
+
+    amounts_out, accepted, final = lp.swapExactTokensForTokensBatch([10, 20, 30], 0, "garrincha")
+    assert accepted.all()
+    assert amounts_out == pytest.approx(expected)
+    assert final == pytest.approx(reserves)
+    assert lp.fee_growth0 == pytest.approx(60 * 0.003 / 1000)
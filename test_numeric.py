@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from lp import Factory, ERC20
+from numeric import to_wei, from_wei
+
+
+def setup():
+    factory = Factory("ETH pool factory", "0x1", numeric="integer")
+    lp = factory.create_exchange(ERC20("test-coin", "0x111"), ERC20("ETH", "0x09"), "TST1")
+    lp.add_liquidity("rsarai", to_wei(1000), to_wei(1000), to_wei(1000), to_wei(1000))
+    return lp
+
+def test_integer_pool_math():
+    lp = setup()
+    assert lp.liquidity_providers["rsarai"] == to_wei(1000) - 10
+    assert type(lp.reserve0) is int
+
+    assert lp.swapExactTokensForTokens(to_wei(600), to_wei(375), "rsarai") == to_wei(375)
+    assert (lp.reserve0, lp.reserve1) == (to_wei(1600), to_wei(625))
+
+    amount0, amount1 = lp.remove_liquidity("rsarai", to_wei(100), 1, 1)
+    assert (amount0, amount1) == (to_wei(160), to_wei(62.5))
+    assert from_wei(lp.reserve0) == 1440
+
+def test_integer_swaps_round_in_favour_of_the_pool():
+    lp = setup()
+    for amount in (to_wei(0.3), 7, to_wei(13.37), 123456789):
+        k = lp.reserve0 * lp.reserve1
+        expected = amount * lp.reserve1 // (lp.reserve0 + amount)
+        assert lp.swapExactTokensForTokens(amount, 1, "rsarai") == expected
+        assert lp.reserve0 * lp.reserve1 >= k
+
+    amount_in = lp.get_amount_in(to_wei(1))
+    assert lp.get_amount_out(amount_in) >= to_wei(1)
+    assert lp.get_amount_out(amount_in - 1) < to_wei(1)
+
+def test_integer_batch_matches_single_swaps():
+    lp = setup()
+    single = setup()
+    amounts0_in = [to_wei(0.3), 0, 7, to_wei(500), to_wei(13.37)]
+    amounts1_out_min = [1, 1, 1, to_wei(1000), 1]
+
+    expected = []
+    for amount0_in, amount1_out_min in zip(amounts0_in, amounts1_out_min):
+        try:
+            expected.append(single.swapExactTokensForTokens(amount0_in, amount1_out_min, "rsarai"))
+        except AssertionError:
+            expected.append(0)
+
+    amounts1_out, accepted, reserves = lp.swapExactTokensForTokensBatch(amounts0_in, amounts1_out_min, "rsarai")
+    assert amounts1_out.tolist() == expected
+    assert accepted.tolist() == [True, False, True, False, True]
+    assert reserves == (single.reserve0, single.reserve1)
+
+def test_float_swaps_pass_the_k_check_with_a_fee():
+    factory = Factory("ETH pool factory", "0x1")
+    lp = factory.create_exchange(ERC20("test-coin", "0x111"), ERC20("ETH", "0x09"), "TST1")
+    lp.add_liquidity("rsarai", 1000.0, 1000.0, 0, 0)
+    lp.fee = 3
+
+    rng = np.random.default_rng(0)
+    for amount in rng.uniform(0.001, 50, 500).tolist():
+        k = lp.reserve0 * lp.reserve1
+        lp.swapExactTokensForTokens(amount, 0, "garrincha")
+        assert lp.reserve0 * lp.reserve1 > k
+    lp.get_tokens()["test-coin"].deposit("garrincha", 10.0)
+    with pytest.raises(AssertionError, match="UniswapV2: K"):
+        lp.swap(0, lp.get_amount_out(10.0) * (1 + 1e-6), "garrincha")
@@ -0,0 +1,56 @@
+import pytest
+
+from clock import ManualClock
+from lp import Factory
+from main import create_exchange
+from oracle import Oracle
+
+
+def setup(capacity=1024):
+    clock = ManualClock(1000)
+    factory = Factory("ETH pool factory", "0x1", clock=clock)
+    oracle = Oracle(factory, capacity)
+    lp = create_exchange("test-coin", "0x111", "TST1", factory)
+    lp.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+    return clock, oracle, lp
+
+
+def test_cumulative_prices_accumulate_previous_reserves():
+    clock, _, lp = setup()
+    clock.advance(100)
+    lp.swapExactTokensForTokens(600, 375, "rsarai")
+
+    assert lp.price0_cumulative_last == pytest.approx(100)
+    assert lp.price1_cumulative_last == pytest.approx(100)
+    assert lp.block_timestamp_last == 1100
+
+
+def test_consult_time_weighted_average():
+    clock, oracle, lp = setup()
+    clock.advance(100)
+    lp.swapExactTokensForTokens(600, 375, "rsarai")     # reserves 1600/625
+    clock.advance(100)
+
+    price0, price1 = oracle.consult(lp, 200)
+    assert price0 == pytest.approx((1 * 100 + 625 / 1600 * 100) / 200)
+    assert price1 == pytest.approx((1 * 100 + 1600 / 625 * 100) / 200)
+    assert oracle.consult(lp, 50)[0] == pytest.approx(625 / 1600)
+    # interpolated between the two observations
+    assert oracle.consult(lp, 150)[0] == pytest.approx((1 * 50 + 625 / 1600 * 100) / 150)
+
+    with pytest.raises(AssertionError, match="Oracle: OLD"):
+        oracle.consult(lp, 201)
+
+
+def test_ring_buffer_keeps_the_latest_observations():
+    clock, oracle, lp = setup(capacity=2)
+    for amount_in in (1000, 500, 1500):
+        clock.advance(10)
+        lp.swapExactTokensForTokens(amount_in, 0, "rsarai")
+
+    observations = oracle.observations[lp.name]
+    assert observations.count == 2
+    assert observations.get(0)[0] == 1020
+    assert oracle.consult(lp, 10)[0] == pytest.approx(400 / 2500)
+    with pytest.raises(AssertionError, match="Oracle: OLD"):
+        oracle.consult(lp, 11)
@@ -0,0 +1,71 @@
+import pytest
+
+from main import create_exchange
+from pool_table import TableFactory
+
+
+def test_pool_view_behaves_like_exchange():
+    factory = TableFactory("ETH pool factory", "0x1", capacity=1)
+    lp = create_exchange("test-coin", "0x111", "TST1", factory)
+    other = create_exchange("other-coin", "0x222", "OTH1", factory)
+
+    lp.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+    lp.swapExactTokensForTokens(600, 375, "rsarai")
+    assert (lp.reserve0, lp.reserve1) == (1600, 625)
+    assert (other.reserve0, other.reserve1) == (0, 0)
+    assert lp.name == "test-coin/ETH"
+    assert other.token0 == "other-coin"
+
+    amount0, amount1 = lp.remove_liquidity("rsarai", 490, 1, 1)
+    assert lp.liquidity_providers == {"0": 10, "rsarai": 500.0}
+    assert factory.pool_table.total_supply[0] == 510
+    assert not hasattr(lp, "__dict__")
+    assert type(lp).__slots__ == ("table", "pool_id")
+    assert factory.pool_table.version[0] == lp.version > 0
+    assert factory.pool_table.block_timestamp_last[0] == lp.block_timestamp_last > 0
+
+def test_pool_view_multicall_rolls_back():
+    factory = TableFactory("ETH pool factory", "0x1")
+    lp = create_exchange("test-coin", "0x111", "TST1", factory)
+    lp.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+    before = (lp.reserve0, lp.reserve1, lp.total_supply, lp.price0_cumulative_last, dict(lp.liquidity_providers))
+
+    with pytest.raises(AssertionError, match="UniswapV2Router: INSUFFICIENT_OUTPUT_AMOUNT"):
+        lp.multicall([("swapExactTokensForTokens", 600, 375, "x"), ("swapExactTokensForTokens", 400, 126, "x")])
+    assert (lp.reserve0, lp.reserve1, lp.total_supply, lp.price0_cumulative_last, dict(lp.liquidity_providers)) == before
+    assert factory.pool_table.batches == {}
+
+    assert lp.multicall([("swapExactTokensForTokens", 600, 375, "x")]) == [375]
+    assert (lp.reserve0, lp.reserve1) == (1600, 625)
+
+def test_aggregate_queries():
+    factory = TableFactory("ETH pool factory", "0x1")
+    lp = create_exchange("test-coin", "0x111", "TST1", factory)
+    other = create_exchange("other-coin", "0x222", "OTH1", factory)
+    create_exchange("empty-coin", "0x333", "EMP1", factory)
+
+    lp.add_liquidity("rsarai", 1000, 2000, 1000, 2000)
+    other.add_liquidity("rsarai", 500, 100, 500, 100)
+
+    prices = factory.pool_table.spot_prices()
+    assert prices[:2].tolist() == [2, 0.2]
+    assert prices[2] != prices[2]
+    assert factory.pool_table.total_value_locked() == {
+        "test-coin": 1000, "ETH": 2100, "other-coin": 500, "empty-coin": 0,
+    }
+
+def test_vectorized_trade_sizing():
+    factory = TableFactory("ETH pool factory", "0x1")
+    lp = create_exchange("test-coin", "0x111", "TST1", factory)
+    other = create_exchange("other-coin", "0x222", "OTH1", factory)
+    create_exchange("empty-coin", "0x333", "EMP1", factory)
+    lp.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+    other.add_liquidity("rsarai", 1000, 4000, 1000, 4000)
+
+    table = factory.pool_table
+    amounts = table.amounts_in_for_price([625 / 1600, 1, 1])
+    assert amounts.tolist() == pytest.approx([600, 1000, 0])
+    assert amounts[1] == pytest.approx(other.get_amount_in_for_price(1))
+
+    amounts = table.amounts_in_for_slippage(0.2, zero_for_one=False)
+    assert amounts.tolist() == pytest.approx([250, 1000, 0])
@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+from replay import replay
+
+
+def write_feed(path):
+    records = [
+        {"op": "create_exchange", "token0": "test-coin", "token0_addr": "0x111", "token1": "ETH", "token1_addr": "0x09", "symbol": "TST1"},
+        {"op": "create_exchange", "token0": "test-coin", "token0_addr": "0x111", "token1": "ETH", "token1_addr": "0x09", "symbol": "TST1"},
+        {"op": "add_liquidity", "pool": "test-coin/ETH", "from": "rsarai", "amount0": 1000, "amount1": 1000, "amount0_min": 1000, "amount1_min": 1000},
+        {"op": "swap", "pool": "test-coin/ETH", "to": "x", "amount_in": 600, "amount_out_min": 375},
+        {"op": "swap", "pool": "test-coin/ETH", "to": "x", "amount_in": 500, "amount_out_min": 200},
+        {"op": "swap", "pool": "test-coin/ETH", "to": "x", "amount_in": 400, "amount_out_min": 125},
+        {"op": "swap", "pool": "other/ETH", "to": "x", "amount_in": 1, "amount_out_min": 1},
+        {"op": "remove_liquidity", "pool": "test-coin/ETH", "to": "rsarai", "liquidity": 490, "amount0_min": 1, "amount1_min": 1},
+    ]
+    with open(path, "w") as feed:
+        for record in records:
+            feed.write(json.dumps(record) + "\n")
+
+@pytest.mark.parametrize("batch_swaps", [True, False])
+def test_replay_reports_rejects_and_final_state(tmp_path, batch_swaps):
+    path = tmp_path / "feed.jsonl"
+    write_feed(path)
+    report = replay(path, chunk_size=3, batch_swaps=batch_swaps)
+
+    assert report.operations == 8
+    assert report.rejects == {
+        "Exchange already created for token": 1,
+        "UniswapV2Router: INSUFFICIENT_OUTPUT_AMOUNT": 1,
+        "Unknown pool": 1,
+    }
+    assert [line for line, _ in report.samples] == [2, 5, 7]
+    assert report.pools["test-coin/ETH"] == pytest.approx((1020, 255, 510))
+    assert report.throughput > 0
+
+def test_replay_rejects_malformed_records(tmp_path):
+    path = tmp_path / "feed.jsonl"
+    write_feed(path)
+    with open(path, "a") as feed:
+        for record in (
+            {"op": "swap", "pool": "test-coin/ETH", "amount_in": 10, "amount_out_min": 1},
+            {"pool": "test-coin/ETH", "to": "x"},
+            {"op": "mint", "pool": "test-coin/ETH"},
+            [1, 2],
+            {"op": "swap", "pool": "test-coin/ETH", "to": "x", "amount_in": 10, "amount_out_min": 1},
+        ):
+            feed.write(json.dumps(record) + "\n")
+    report = replay(path)
+
+    assert report.operations == 13
+    assert report.rejects["Missing field to"] == 1
+    assert report.rejects["Missing field op"] == 1
+    assert report.rejects["Unknown operation mint"] == 1
+    assert report.rejects["Malformed record"] == 1
+    assert [line for line, _ in report.samples][-4:] == [9, 10, 11, 12]
+    assert report.pools["test-coin/ETH"][0] == pytest.approx(1030)
+
+def test_replay_rejects_bad_lines_and_amounts(tmp_path):
+    path = tmp_path / "feed.jsonl"
+    write_feed(path)
+    with open(path, "a") as feed:
+        feed.write('{"op": "swap", "pool": "test-coin/ETH", "to": "x", "amou\n')
+        for amount_in in ("abc", None, float("nan"), True):
+            feed.write(json.dumps({"op": "swap", "pool": "test-coin/ETH", "to": "x", "amount_in": amount_in, "amount_out_min": 1}) + "\n")
+        feed.write(json.dumps({"op": "swap", "pool": "test-coin/ETH", "to": "x", "amount_in": 10, "amount_out_min": 1}) + "\n")
+    report = replay(path)
+
+    assert report.operations == 14
+    assert report.rejects["Malformed record"] == 1
+    assert report.rejects["Invalid field amount_in"] == 4
+    assert [line for line, _ in report.samples][-5:] == [9, 10, 11, 12, 13]
+    assert report.pools["test-coin/ETH"][0] == pytest.approx(1030)
@@ -0,0 +1,109 @@
+import pytest
+
+from lp import Exchange, Factory, ERC20
+from clock import ManualClock
+from router import Router
+
+
+def setup(b_address="0xb"):
+    factory = Factory("ETH pool factory", "0x1")
+    a_eth = factory.create_exchange(ERC20("A", "0xa"), ERC20("ETH", "0x09"), "A")
+    b_eth = factory.create_exchange(ERC20("B", b_address), ERC20("ETH", "0x09"), "B")
+    a_b = factory.create_exchange(ERC20("A", "0xa"), ERC20("B", b_address), "AB")
+
+    a_eth.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+    b_eth.add_liquidity("rsarai", 1000, 1125, 1000, 1125)
+    a_b.add_liquidity("rsarai", 1000, 200, 1000, 200)
+    return factory, a_eth, b_eth, a_b
+
+def test_finds_paths_in_both_directions():
+    factory, a_eth, b_eth, a_b = setup()
+    router = Router(factory)
+
+    paths = router.get_paths("A", "B")
+    assert ((a_b, "A", "B"),) in paths
+    assert ((a_eth, "A", "ETH"), (b_eth, "ETH", "B")) in paths
+    assert len(paths) == 2
+    assert len(Router(factory, max_hops=1).get_paths("A", "B")) == 1
+
+def test_swaps_through_best_path():
+    factory, a_eth, b_eth, a_b = setup()
+    router = Router(factory)
+
+    amounts = router.swapExactTokensForTokens(600, 250, "A", "B", "trader")
+    assert amounts == [600, 375, 250]
+    assert (a_eth.reserve0, a_eth.reserve1) == (1600, 625)
+    assert (b_eth.reserve0, b_eth.reserve1) == (750, 1500)
+    assert (a_b.reserve0, a_b.reserve1) == (1000, 200)
+
+def test_swap_below_min_is_rejected():
+    factory, a_eth, b_eth, a_b = setup()
+    router = Router(factory)
+
+    with pytest.raises(Exception, match="UniswapV2Router: INSUFFICIENT_OUTPUT_AMOUNT"):
+        router.swapExactTokensForTokens(600, 251, "A", "B", "trader")
+
+def test_failed_hop_restores_previous_hops():
+    factory, a_eth, b_eth, a_b = setup(b_address="trader")
+    router = Router(factory)
+
+    with pytest.raises(Exception, match="UniswapV2: INVALID_TO"):
+        router.swapExactTokensForTokens(600, 250, "A", "B", "trader")
+
+    tokens = factory.exchange_to_tokens[a_eth.name]
+    assert (a_eth.reserve0, a_eth.reserve1) == (1000, 1000)
+    assert (tokens["A"].total, tokens["ETH"].total) == (1000, 1000)
+
+def test_paths_are_recomputed_when_pools_are_added():
+    factory, a_eth, b_eth, a_b = setup()
+    router = Router(factory, max_hops=2)
+    assert router.get_paths("A", "C") == []
+
+    c_eth = factory.create_exchange(ERC20("C", "0xc"), ERC20("ETH", "0x09"), "C")
+    assert router.get_paths("A", "C") == [((a_eth, "A", "ETH"), (c_eth, "ETH", "C"))]
+
+def test_failed_hop_is_undone_without_updates():
+    factory, a_eth, b_eth, a_b = setup(b_address="trader")
+    factory.clock = ManualClock(1000)
+    updates = []
+    factory.listeners.append(updates.append)
+    cumulatives = (a_eth.price0_cumulative_last, a_eth.price1_cumulative_last, a_eth.block_timestamp_last)
+
+    with pytest.raises(Exception, match="UniswapV2: INVALID_TO"):
+        Router(factory).swapExactTokensForTokens(600, 250, "A", "B", "trader")
+
+    assert updates == []            # the first hop only moved reserves, its rollback tells nobody
+    assert (a_eth.price0_cumulative_last, a_eth.price1_cumulative_last, a_eth.block_timestamp_last) == cumulatives
+    for tokens in (factory.exchange_to_tokens[a_eth.name], factory.exchange_to_tokens[b_eth.name]):
+        for token in tokens.values():
+            assert "trader" not in token.balances
+
+def test_pools_are_updated_once_the_path_succeeds():
+    factory, a_eth, b_eth, a_b = setup()
+    factory.clock = ManualClock(a_eth.block_timestamp_last)
+    reserves = []
+    factory.listeners.append(lambda exchange: reserves.append((exchange, exchange.reserve0, exchange.reserve1)))
+
+    factory.clock.advance(10)
+    Router(factory).swapExactTokensForTokens(600, 1, "A", "B", "trader")
+    assert reserves == [(a_eth, a_eth.reserve0, a_eth.reserve1), (b_eth, b_eth.reserve0, b_eth.reserve1)]
+    assert a_eth.price0_cumulative_last == 10       # the reserves before the trade, for 10 seconds
+
+def test_any_error_undoes_the_hops(monkeypatch):
+    factory, a_eth, b_eth, a_b = setup()
+    swap = Exchange.swap
+
+    def failing_swap(exchange, *args, **kwargs):
+        if exchange is b_eth:
+            raise RuntimeError("interrupted")
+        return swap(exchange, *args, **kwargs)
+
+    monkeypatch.setattr(Exchange, "swap", failing_swap)
+    with pytest.raises(RuntimeError, match="interrupted"):
+        Router(factory).swapExactTokensForTokens(600, 1, "A", "B", "trader")
+    monkeypatch.undo()
+
+    assert (a_eth.reserve0, a_eth.reserve1) == (1000, 1000)
+    for token in factory.exchange_to_tokens[a_eth.name].values():
+        assert token.ledger.undo is None
+    a_eth.multicall([("swapExactTokensForTokens", 100, 1, "trader")])
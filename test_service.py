@@ -0,0 +1,142 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from lp import Factory, Exchange
+from main import create_exchange
+from service import ExchangeService
+
+
+def setup():
+    factory = Factory("ETH pool factory", "0x1")
+    lp = create_exchange("test-coin", "0x111", "TST1", factory)
+    other = create_exchange("other-coin", "0x222", "OTH1", factory)
+    lp.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+    other.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+    return factory, lp, other
+
+def test_trades_on_a_pool_are_serialized_in_order():
+    factory, lp, other = setup()
+
+    async def main():
+        service = ExchangeService(factory)
+        results = await asyncio.gather(
+            service.swap("test-coin/ETH", 600, 375, "x"),
+            service.swap("other-coin/ETH", 600, 375, "x"),
+            service.swap("test-coin/ETH", 400, 126, "x"),
+            service.swap("test-coin/ETH", 400, 125, "x"),
+            return_exceptions=True,
+        )
+        await service.close()
+        return results
+
+    first, second, rejected, last = asyncio.run(main())
+    assert (first, second, last) == (375, 375, 125)
+    assert str(rejected) == "UniswapV2Router: INSUFFICIENT_OUTPUT_AMOUNT"
+    assert (lp.reserve0, lp.reserve1) == (2000, 500)
+    assert (other.reserve0, other.reserve1) == (1600, 625)
+
+def test_quotes_are_coalesced(monkeypatch):
+    factory, lp, other = setup()
+    calls = []
+    price_impact = Exchange.price_impact
+
+    def counting_price_impact(self, amounts_in, zero_for_one=True):
+        calls.append(list(amounts_in))
+        return price_impact(self, amounts_in, zero_for_one)
+
+    monkeypatch.setattr(Exchange, "price_impact", counting_price_impact)
+
+    async def main():
+        service = ExchangeService(factory)
+        return await asyncio.gather(*(service.quote("test-coin/ETH", amount) for amount in (50, 135, 600)))
+
+    assert asyncio.run(main()) == pytest.approx([lp.get_amount_out(50), lp.get_amount_out(135), 375])
+    assert calls == [[50, 135, 600]]
+
+def test_bad_quotes_fail_alone(monkeypatch):
+    factory, lp, other = setup()
+
+    async def main():
+        service = ExchangeService(factory)
+        return await asyncio.gather(
+            service.quote("test-coin/ETH", 600),
+            service.quote("test-coin/ETH", 0),
+            service.quote("test-coin/ETH", "600"),
+            return_exceptions=True,
+        )
+
+    amount_out, zero, text = asyncio.run(main())
+    assert amount_out == 375
+    assert str(zero) == 'UniswapV2Library: INSUFFICIENT_INPUT_AMOUNT'
+    assert isinstance(text, TypeError)
+
+    def broken_price_impact(self, amounts_in, zero_for_one=True):
+        raise ValueError("broken")
+
+    monkeypatch.setattr(Exchange, "price_impact", broken_price_impact)
+
+    async def broken():
+        service = ExchangeService(factory)
+        return await asyncio.wait_for(
+            asyncio.gather(*(service.quote("test-coin/ETH", amount) for amount in (1, 2)), return_exceptions=True), 1
+        )
+
+    assert [str(error) for error in asyncio.run(broken())] == ["broken", "broken"]
+
+def test_quotes_wait_for_trades_running_on_the_executor(monkeypatch):
+    factory, lp, other = setup()
+    before = lp.get_amount_out(100)
+    update = Exchange._update
+
+    def slow_update(self, balance0, balance1):
+        self.reserve0 = balance0
+        time.sleep(0.05)            # a quote reading now would see a torn pair of reserves
+        update(self, balance0, balance1)
+
+    monkeypatch.setattr(Exchange, "_update", slow_update)
+
+    async def main():
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            service = ExchangeService(factory, executor)
+            swap = asyncio.ensure_future(service.swap("test-coin/ETH", 600, 375, "x"))
+            await asyncio.sleep(0.01)
+            quote = await service.quote("test-coin/ETH", 100)
+            await swap
+            await service.close()
+            return quote
+
+    quote = asyncio.run(main())
+    assert quote == lp.get_amount_out(100) != before
+
+def test_json_server():
+    factory, lp, other = setup()
+
+    async def main():
+        service = ExchangeService(factory)
+        server = await service.serve()
+        host, port = server.sockets[0].getsockname()[:2]
+        reader, writer = await asyncio.open_connection(host, port)
+        for request in (
+            {"id": 1, "method": "quote", "params": {"pool": "test-coin/ETH", "amount_in": 600}},
+            {"id": 2, "method": "swap", "params": {"pool": "test-coin/ETH", "amount_in": 600, "amount_out_min": 376, "to": "x"}},
+            {"id": 3, "method": "withdraw"},
+        ):
+            writer.write(json.dumps(request).encode() + b"\n")
+        await writer.drain()
+        responses = [json.loads(await reader.readline()) for _ in range(3)]
+
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        await service.close()
+        return sorted(responses, key=lambda response: response["id"])
+
+    assert asyncio.run(main()) == [
+        {"id": 1, "result": 375},
+        {"id": 2, "error": "UniswapV2Router: INSUFFICIENT_OUTPUT_AMOUNT"},
+        {"id": 3, "error": "Unknown method"},
+    ]
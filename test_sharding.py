@@ -0,0 +1,96 @@
+import time
+
+import pytest
+
+from clock import ManualClock
+from lp import Factory
+from main import create_exchange
+from quote_cache import QuoteCache
+from sharding import ShardedExecutor
+
+
+def setup(clock=None):
+    factory = Factory("ETH pool factory", "0x1", clock=clock)
+    for i in range(4):
+        lp = create_exchange(f"coin-{i}", f"0x{i}", f"C{i}", factory)
+        lp.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+    return factory
+
+def operations():
+    for i in range(4):
+        pool = f"coin-{i}/ETH"
+        yield pool, "swapExactTokensForTokens", (600, 375, "x")
+        yield pool, "swapExactTokensForTokens", (400, 126, "x")
+        yield pool, "swapExactTokensForTokens", (400, 125, "x")
+        yield pool, "remove_liquidity", ("rsarai", 490, 1, 1)
+
+@pytest.mark.parametrize("backend", ["thread", "process"])
+def test_sharded_operations_match_sequential(backend):
+    expected_factory = setup()
+    expected = []
+    for pool, method, args in operations():
+        exchange = expected_factory.get_pair(pool.split("/")[0], "ETH")
+        try:
+            expected.append(getattr(exchange, method)(*args))
+        except AssertionError as error:
+            expected.append(str(error))
+
+    factory = setup()
+    with ShardedExecutor(factory, shards=2, backend=backend) as executor:
+        results = executor.map(operations())
+        assert executor.submit("coin-0/ETH", "get_amount_out", 100).result() > 0
+        executor.sync()
+
+    assert [result if not isinstance(result, Exception) else str(result) for result in results] == expected
+    for exchange, expected_exchange in zip(factory.all_pairs, expected_factory.all_pairs):
+        assert (exchange.reserve0, exchange.reserve1) == (expected_exchange.reserve0, expected_exchange.reserve1)
+        assert exchange.liquidity_providers == expected_exchange.liquidity_providers
+        assert exchange.get_tokens()["ETH"].total == expected_exchange.get_tokens()["ETH"].total
+
+def test_thread_shards_share_listeners_and_quote_cache():
+    factory = setup()
+    factory.quote_cache = QuoteCache(64)
+    updates = []
+    inside = []
+
+    def listener(exchange):
+        inside.append(exchange)
+        assert len(inside) == 1, "listeners called concurrently"
+        time.sleep(0.001)
+        updates.append((exchange.name, exchange.reserve0, exchange.reserve1))
+        inside.pop()
+
+    factory.listeners.append(listener)
+    quotes = [(f"coin-{i}/ETH", "get_amount_out", (100,)) for i in range(4)] * 5
+    with ShardedExecutor(factory, shards=4, backend="thread") as executor:
+        results = executor.map(list(operations()) + quotes)
+
+    assert not any(isinstance(result, Exception) and "concurrently" in str(result) for result in results)
+    assert len(updates) == sum(not isinstance(result, Exception) for result in results[:16])
+    for exchange in factory.all_pairs:
+        assert [update for update in updates if update[0] == exchange.name][-1][1:] == (exchange.reserve0, exchange.reserve1)
+    assert factory.quote_cache.stats()["hits"] == 4 * (1 + 4)     # the swap retried at 125, then 4 of 5 quotes
+
+def test_sync_restores_the_pools_with_one_update():
+    expected_factory = setup(ManualClock(1000))
+    factory = setup(ManualClock(1000))
+    for pool_factory in (expected_factory, factory):
+        pool_factory.clock.advance(100)
+    for pool, method, args in operations():
+        try:
+            getattr(expected_factory.get_pair(pool.split("/")[0], "ETH"), method)(*args)
+        except AssertionError:
+            pass
+
+    updates = []
+    with ShardedExecutor(factory, shards=2, backend="process") as executor:
+        executor.map(operations())
+        factory.listeners.append(lambda exchange: updates.append((exchange, exchange.reserve0, exchange.total_supply)))
+        executor.sync()
+
+    assert sorted(updates, key=lambda update: update[0].name) == [
+        (exchange, exchange.reserve0, exchange.total_supply) for exchange in factory.all_pairs
+    ]
+    for exchange, expected_exchange in zip(factory.all_pairs, expected_factory.all_pairs):
+        for attribute in ("total_supply", "price0_cumulative_last", "price1_cumulative_last", "block_timestamp_last"):
+            assert getattr(exchange, attribute) == getattr(expected_exchange, attribute)
@@ -0,0 +1,51 @@
+import pytest
+
+from clock import ManualClock
+from simulation import Simulation, run_scenario, run_scenarios
+from staking_rewards import StakingRewards
+from test_staking_rewards import setup
+
+YEAR = 31536000
+
+
+def test_manual_clock_only_moves_forward():
+    clock = ManualClock(100)
+    clock.advance(50)
+    assert clock.time() == 150
+
+    with pytest.raises(AssertionError, match="back in time"):
+        clock.set(10)
+
+
+def test_simulation_applies_events_in_time_order():
+    lp = setup()
+    clock = ManualClock()
+    simulation = Simulation(StakingRewards(lp, clock=clock), clock)
+    simulation.add_rewards(0, YEAR)
+    simulation.claim(YEAR // 2, "rsarai")
+    simulation.stake(0, "rsarai", 1000)
+    simulation.stake(10, "random", 1000)
+
+    results = simulation.run(until=2 * YEAR)
+
+    assert [method for _, method, _, _ in results] == ["add_rewards", "stake", "stake", "get_reward"]
+    assert isinstance(results[2][3], Exception)
+    assert results[3][3] == pytest.approx(YEAR / 2)
+    assert clock.time() == 2 * YEAR
+    # rewards stop at the end of the period
+    assert simulation.staking.earned("rsarai") == pytest.approx(YEAR / 2)
+
+
+def test_run_scenarios_are_isolated():
+    scenario = {
+        "providers": {"alice": 1000, "bob": 1000},
+        "rewards": YEAR,
+        "events": [(0, "stake", "alice", 500), (0, "stake", "bob", 500), (YEAR, "claim", "alice")],
+        "until": YEAR,
+    }
+    results = run_scenarios([scenario, {**scenario, "events": scenario["events"][:1]}])
+
+    assert results[0]["claimed"]["alice"] == pytest.approx(YEAR / 2)
+    assert results[0]["pending"]["bob"] == pytest.approx(YEAR / 2)
+    assert results[1]["pending"] == {"alice": pytest.approx(YEAR)}
+    assert run_scenarios([scenario], processes=2) == [run_scenario(scenario)]
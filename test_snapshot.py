@@ -0,0 +1,89 @@
+from freezegun import freeze_time
+
+from lp import Factory, ERC20
+from main import create_exchange
+from staking_rewards import StakingRewards
+from snapshot import dump, load
+
+
+def setup():
+    factory = Factory("ETH pool factory", "0x1")
+    lp = create_exchange("test-coin", "0x111", "TST1", factory)
+    other = create_exchange("other-coin", "0x222", "OTH1", factory)
+    lp.add_liquidity("rsarai", 1000, 1000, 1000, 1000)
+    lp.add_liquidity("garrincha", 500, 500, 500, 500)
+    lp.swapExactTokensForTokens(500, 1, "x")
+    other.add_liquidity("rsarai", 300, 900, 300, 900)
+
+    with freeze_time('2022-08-20 14:49:07'):
+        st = StakingRewards(lp)
+        st.add_rewards(1_000_000)
+        st.stake("rsarai", 900.0)
+    with freeze_time('2022-08-20 14:49:12'):
+        st.get_reward("garrincha")
+    return factory, lp, other, st
+
+def test_load_restores_pools_and_staking(tmp_path):
+    factory, lp, other, st = setup()
+    dump(factory, tmp_path / "snapshot.bin", [st])
+    loaded, (loaded_st,) = load(tmp_path / "snapshot.bin")
+
+    assert (loaded.name, loaded.address, loaded.pair_count()) == ("ETH pool factory", "0x1", 2)
+    loaded_lp = loaded.get_pool(0)
+    assert loaded.pool_table.liquidity_providers == {}
+    assert (loaded_lp.reserve0, loaded_lp.reserve1, loaded_lp.total_supply) == (lp.reserve0, lp.reserve1, lp.total_supply)
+    assert loaded_lp.liquidity_providers == lp.liquidity_providers
+    assert list(loaded.pool_table.liquidity_providers) == [0]
+    assert loaded.get_pool(1).name == "other-coin/ETH"
+
+    assert loaded_st.lp is loaded_lp
+    for attribute in ("reward_rate", "reward_per_token", "last_update_time", "period_finish", "total_supply",
+                      "rewards_duration", "balances", "rewards", "user_reward_per_token_paid"):
+        assert getattr(loaded_st, attribute) == getattr(st, attribute)
+
+def test_loaded_factory_keeps_trading(tmp_path):
+    factory, lp, other, st = setup()
+    dump(factory, tmp_path / "snapshot.bin", [st])
+    loaded, _ = load(tmp_path / "snapshot.bin")
+
+    assert loaded.get_pair("ETH", "other-coin") is loaded.get_pool(1)
+    assert loaded.get_pool(1).swapExactTokensForTokens(100, 1, "x") == other.swapExactTokensForTokens(100, 1, "x")
+    assert loaded.get_pool(1).get_tokens()["ETH"].total == other.get_tokens()["ETH"].total
+    loaded.get_pool(0).remove_liquidity("garrincha", 100, 1, 1)
+
+    new = loaded.create_exchange(ERC20("new-coin", "0x333"), ERC20("ETH", "0x09"), "NEW1")
+    new.add_liquidity("rsarai", 100, 100, 100, 100)
+    assert loaded.get_pair("new-coin", "ETH") is new
+    assert loaded.get_pool(2) is new
+    assert loaded.pool_table.total_value_locked()["new-coin"] == 100
+
+    reloaded_path = tmp_path / "reloaded.bin"
+    dump(loaded, reloaded_path)
+    reloaded, _ = load(reloaded_path)
+    assert reloaded.get_pool(2).reserve0 == 100
+    assert reloaded.get_pool(0).liquidity_providers == loaded.get_pool(0).liquidity_providers
+
+def test_load_restores_fees(tmp_path):
+    factory, lp, other, st = setup()
+    lp.set_fee(3)
+    lp.swapExactTokensForTokens(200, 1, "x")
+    lp.remove_liquidity("garrincha", 100, 1, 1)     # settles garrincha's fees so far
+    lp.swapExactTokensForTokens(50, 1, "x")
+    dump(factory, tmp_path / "snapshot.bin", [st])
+    loaded, _ = load(tmp_path / "snapshot.bin")
+
+    loaded_lp = loaded.get_pool(0)
+    assert (loaded_lp.fee, loaded_lp.fee_growth0, loaded_lp.fee_growth1) == (lp.fee, lp.fee_growth0, lp.fee_growth1)
+    for address in ("rsarai", "garrincha"):
+        assert loaded_lp.fees_earned(address) == lp.fees_earned(address)
+    assert loaded_lp.fees_earned("garrincha")[0] > 0
+
+def test_load_restores_holder_balances(tmp_path):
+    factory, lp, other, st = setup()
+    dump(factory, tmp_path / "snapshot.bin", [st])
+    loaded, _ = load(tmp_path / "snapshot.bin")
+
+    for pool_id, pool in enumerate((lp, other)):
+        for name, token in pool.get_tokens().items():
+            assert loaded.get_pool(pool_id).get_tokens()[name].balances == token.balances
+    assert loaded.get_pool(0).get_tokens()["ETH"].balance_of("x") == lp.get_tokens()["ETH"].balance_of("x") > 0
@@ -4,6 +4,7 @@ from freezegun import freeze_time
 
 from main import create_exchange, create_staking_rewards
 from lp import Factory
+from staking_rewards import StakingRewards
 
 
 def setup():
@@ -140,3 +141,45 @@ def test_get_reward_one_year_after():
         res = st.get_reward("rsarai")
         assert res == 1000000.0
         assert st.rewards.get("rsarai") == 0
+
+
+def test_earned_does_not_add_stakers():
+    with freeze_time('2022-08-20 14:49:07'):
+        lp = setup()
+        st = create_staking_rewards(lp, 1_000_000)
+        st.stake("rsarai", 49990.0)
+
+    with freeze_time('2022-08-20 14:49:12'):
+        assert st.earned("random") == 0
+        assert "random" not in st.balances
+        assert "random" not in st.rewards
+        assert "random" not in st.user_reward_per_token_paid
+
+
+def test_earned_all():
+    with freeze_time('2022-08-20 14:49:07'):
+        lp = setup()
+        lp.add_liquidity("garrincha", 50000, 50000, 50000, 50000)
+        st = create_staking_rewards(lp, 1_000_000)
+        st.stake("rsarai", 49990.0)
+
+    with freeze_time('2022-08-20 14:49:12'):
+        st.stake("garrincha", 25000.0)
+
+    with freeze_time('2022-08-20 14:49:17'):
+        earned = st.earned_all()
+        assert st.ledger.addresses == ["deployer", "rsarai", "garrincha"]
+        assert earned.tolist() == [st.earned(address) for address in st.ledger.addresses]
+        assert round(earned[1], 4) == 0.2114
+
+        assert st.earned_all(["garrincha", "random"]).tolist() == [st.earned("garrincha"), 0]
+
+
+def test_earned_all_empty_ledger():
+    with freeze_time('2022-08-20 14:49:07'):
+        lp = setup()
+        st = StakingRewards(lp)
+
+        assert st.earned_all().tolist() == []
+        assert st.earned_all(["random"]).tolist() == [0]
+        assert st.earned_all([]).tolist() == []